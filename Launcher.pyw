@@ -3,14 +3,17 @@ import os
 import tkinter as tk
 from tkinter import messagebox
 from plyer import notification
-import json
 
-# Verifica el JSON
+# Verifica la base de datos de usuarios (al abrirla se aplican las migraciones,
+# incluida la importación de usuarios.json)
 try:
-    with open("usuarios.json") as f:
-        json.load(f)
+    from database import db
+    if db.count_users() == 0:
+        messagebox.showerror("Error", "No hay usuarios registrados en zero.db")
+        exit()
+    db.close()
 except Exception as e:
-    messagebox.showerror("Error", f"Archivo JSON inválido: {e}")
+    messagebox.showerror("Error", f"Base de datos de usuarios inválida: {e}")
     exit()
 
 # Rutas
@@ -1,35 +1,18 @@
 import streamlit as st
-import json
-import os
 from lector_nfc import leer_uid_pn532
-
-RUTA_USUARIOS = "usuarios.json"
-
-# --- CARGAR USUARIOS ---
-def cargar_usuarios():
-    if not os.path.exists(RUTA_USUARIOS):
-        return {}
-    with open(RUTA_USUARIOS, "r") as f:
-        return json.load(f)
-
-# --- GUARDAR USUARIOS ---
-def guardar_usuarios(usuarios):
-    with open(RUTA_USUARIOS, "w") as f:
-        json.dump(usuarios, f, indent=4)
+from user_store import user_store
 
 # --- REGISTRAR NUEVO USUARIO ---
 def registrar_usuario(usuario, clave, rol, uid_nfc=None):
-    usuarios = cargar_usuarios()
-    if usuario in usuarios:
+    if user_store.get_by_username(usuario):
         st.warning("⚠️ El usuario ya existe.")
-        return
-    usuarios[usuario] = {
-        "clave": clave,
-        "rol": rol,
-        "nfc_uid": uid_nfc
-    }
-    guardar_usuarios(usuarios)
+        return False
+    # El índice de tarjetas NFC es único
+    if not user_store.create(usuario, clave, rol, uid_nfc):
+        st.warning("⚠️ El usuario o la tarjeta NFC ya están registrados.")
+        return False
     st.success(f"✅ Usuario '{usuario}' registrado con rol '{rol}'")
+    return True
 
 # --- VERIFICAR LOGIN ---
 def verificar_login():
@@ -259,12 +242,13 @@ def verificar_login():
                                              use_container_width=True)
                 
                 if submit:
-                    usuarios = cargar_usuarios()
-                    if usuario in usuarios and usuarios[usuario]["clave"] == clave:
+                    datos = user_store.authenticate(usuario, clave)
+                    if datos:
                         st.session_state["autenticado"] = True
                         st.session_state["usuario"] = usuario
                         st.session_state["usuario_id"] = usuario
-                        st.session_state["rol"] = usuarios[usuario]["rol"]
+                        st.session_state["user_id"] = datos["id"]
+                        st.session_state["rol"] = datos["rol"]
                         st.rerun()
                     else:
                         st.error("❌ Usuario o contraseña incorrectos")
@@ -282,19 +266,15 @@ def verificar_login():
                     uid = leer_uid_pn532()
                 
                 if uid:
-                    usuarios = cargar_usuarios()
-                    usuario_encontrado = False
-                    
-                    for usuario, datos in usuarios.items():
-                        if datos.get("nfc_uid") == uid:
-                            st.success(f"✅ Bienvenido, {usuario}")
-                            st.session_state["autenticado"] = True
-                            st.session_state["usuario"] = usuario
-                            st.session_state["rol"] = datos["rol"]
-                            usuario_encontrado = True
-                            st.rerun()
-                    
-                    if not usuario_encontrado:
+                    datos = user_store.get_by_nfc_uid(uid)
+                    if datos:
+                        st.success(f"✅ Bienvenido, {datos['username']}")
+                        st.session_state["autenticado"] = True
+                        st.session_state["usuario"] = datos["username"]
+                        st.session_state["user_id"] = datos["id"]
+                        st.session_state["rol"] = datos["rol"]
+                        st.rerun()
+                    else:
                         st.error("❌ Tarjeta no registrada.")
                 else:
                     st.error("⚠️ No se pudo leer la tarjeta.")
@@ -20,15 +20,22 @@ import os
 from twilio.rest import Client
 import uuid
 from dotenv import load_dotenv
-import requests
-import json
 
 # Importaciones para el nuevo sistema
-from database import ZeroDatabase
-from file_processor import FileProcessor
-
-# Inicializar base de datos
-db = ZeroDatabase()
+from database import db
+from retrieval import retriever
+from blob_store import blob_store
+from ingestion import get_ingestion_queue
+from bulk_ingest import ingest_user_folder, user_docs_dir, format_report
+from folder_watcher import get_storage_watcher
+from user_store import user_store
+from database import JOB_PENDING, JOB_RUNNING, JOB_DONE, DEFAULT_CHAT_TITLE
+from groq_client import get_groq_client, GroqError
+from llm_gateway import get_llm_gateway
+from stream_render import ThrottledRenderer
+from context_window import ContextBudgeter, format_transcript, SUMMARY_MAX_TOKENS
+from response_cache import response_cache
+from semantic_cache import semantic_cache
 
 # --- Load environment variables ---
 load_dotenv()
@@ -45,21 +52,18 @@ st.set_page_config(
 GROQ_API_KEY = os.getenv("GROQ_API_KEY", "")
 if not GROQ_API_KEY:
     st.error("Falta GROQ_API_KEY en tu entorno (.env).")
-API_URL = "https://api.groq.com/openai/v1/chat/completions"
 
 # Modelos (puedes cambiarlos por env si quieres)
 GROQ_TEXT_MODEL = os.getenv("GROQ_TEXT_MODEL", "llama-3.1-8b-instant")
 # Para visión, prueba con alguno de los vision-preview soportados por tu cuenta
 GROQ_VISION_MODEL = os.getenv("GROQ_VISION_MODEL", "llama-3.2-11b-vision-preview")
 
-BASE_HEADERS = {
-    "Authorization": f"Bearer {GROQ_API_KEY}",
-    "Content-Type": "application/json",
-}
-STREAM_HEADERS = {
-    **BASE_HEADERS,
-    "Accept": "text/event-stream",
-}
+# Paginación del historial
+SIDEBAR_CHATS_LIMIT = 10
+MESSAGES_PAGE_SIZE = 50
+
+# Vigilar storage/<usuario>/docs y reindexar los cambios automáticamente
+WATCH_STORAGE = os.getenv("ZERO_WATCH_STORAGE", "1") == "1"
 
 # --- FIX DE ENCODING ---
 def safe_text(text: str) -> str:
@@ -436,6 +440,11 @@ def initialize_session_state():
         st.session_state.chat_history = {}
     if "current_chat" not in st.session_state:
         st.session_state.current_chat = str(uuid.uuid4())
+    # Mensajes del chat actual que siguen en la base de datos sin cargar
+    if "messages_offset" not in st.session_state:
+        st.session_state.messages_offset = 0
+    if "oldest_message_id" not in st.session_state:
+        st.session_state.oldest_message_id = None
 
 initialize_session_state()
 
@@ -453,38 +462,39 @@ def _system_prompt():
     
     return {"role": "system", "content": base_prompt}
 
+def summarize_history(previous_summary, messages):
+    """Condensa turnos antiguos del chat en el resumen acumulado"""
+    prompt = (
+        "Resume de forma breve y en español la conversación entre el usuario y Zero, "
+        "conservando datos, decisiones y preferencias del usuario que puedan ser útiles después."
+    )
+    content = format_transcript(messages)
+    if previous_summary:
+        content = f"Resumen previo:\n{previous_summary}\n\nNuevos mensajes:\n{content}"
+    return get_groq_client().chat(
+        [{"role": "system", "content": prompt}, {"role": "user", "content": content}],
+        model=GROQ_TEXT_MODEL, max_tokens=SUMMARY_MAX_TOKENS, temperature=0.3, timeout=60
+    )
+
+# Presupuesto de tokens del chat; el resumen de turnos antiguos se guarda por chat en la base de datos
+budgeter = ContextBudgeter(db, summarize_history)
+
 def groq_chat_stream(history_messages, *, model=None, max_tokens=1200, temperature=0.7):
     """
-    Streaming SSE con requests.iter_lines() (sin SDK extra).
+    Streaming SSE a través del cliente Groq compartido (conexiones keep-alive).
     Devuelve un generador de "delta" (fragmentos de texto) como en OpenAI.
     """
     m = model or GROQ_TEXT_MODEL
-    payload = {
-        "model": m,
-        "messages": [_system_prompt()] + history_messages,
-        "max_tokens": max_tokens,
-        "temperature": temperature,
-        "stream": True,
-    }
+    messages = [_system_prompt()] + history_messages
+    payload = {"model": m, "messages": messages, "max_tokens": max_tokens, "temperature": temperature}
     try:
-        with requests.post(API_URL, headers=STREAM_HEADERS, json=payload, stream=True, timeout=300) as r:
-            r.raise_for_status()
-            for raw in r.iter_lines(decode_unicode=True):
-                if not raw:
-                    continue
-                if raw.startswith("data: "):
-                    data = raw[6:]
-                    if data.strip() == "[DONE]":
-                        break
-                    try:
-                        obj = json.loads(data)
-                        delta = obj["choices"][0]["delta"].get("content")
-                        if delta:
-                            # FIX ENCODING por si llega interpretado raro
-                            yield safe_text(delta)
-                    except Exception:
-                        continue
-    except requests.HTTPError as http_err:
+        # Una respuesta cacheada se reproduce al instante; si no, se guarda al terminar el stream
+        for delta in response_cache.stream(payload, get_groq_client().chat_stream(
+            messages, model=m, max_tokens=max_tokens, temperature=temperature
+        )):
+            # FIX ENCODING por si llega interpretado raro
+            yield safe_text(delta)
+    except GroqError as http_err:
         yield safe_text(f"⚠️ Error HTTP: {http_err}")
     except Exception as e:
         yield safe_text(f"⚠️ Error en streaming: {e}")
@@ -494,18 +504,19 @@ def groq_chat_nonstream(history_messages, *, model=None, max_tokens=1200, temper
     Llamada normal (no streaming) al endpoint OpenAI-compatible de Groq.
     """
     m = model or GROQ_TEXT_MODEL
-    payload = {
-        "model": m,
-        "messages": [_system_prompt()] + history_messages,
-        "max_tokens": max_tokens,
-        "temperature": temperature,
-    }
+    messages = [_system_prompt()] + history_messages
+    payload = {"model": m, "messages": messages, "max_tokens": max_tokens, "temperature": temperature}
+    cached = response_cache.get(payload)
+    if cached is not None:
+        return safe_text(cached)
     try:
-        r = requests.post(API_URL, headers=BASE_HEADERS, json=payload, timeout=90)
-        if r.status_code != 200:
-            return safe_text(f"⚠️ Error {r.status_code}: {r.text}")
-        data = r.json()
-        return safe_text(data["choices"][0]["message"]["content"])
+        content = get_groq_client().chat(
+            messages, model=m, max_tokens=max_tokens, temperature=temperature, timeout=90
+        )
+        response_cache.put(payload, content)
+        return safe_text(content)
+    except GroqError as e:
+        return safe_text(f"⚠️ Error {e.status_code}: {e.body}")
     except Exception as e:
         return safe_text(f"⚠️ Error en la conexión: {e}")
 
@@ -524,29 +535,6 @@ def display_message(role, content):
             unsafe_allow_html=True,
         )
 
-def save_current_chat():
-    """Guarda el chat actual en el historial."""
-    if st.session_state.messages and st.session_state.get("usuario") and st.session_state.get("user_id"):
-        first_message = st.session_state.messages[0]["content"] if st.session_state.messages else "Nuevo chat"
-        title = first_message[:30] + "..." if len(first_message) > 30 else first_message
-        
-        # Actualizar en session_state
-        st.session_state.chat_history[st.session_state.usuario][st.session_state.current_chat] = {
-            "title": safe_text(title),
-            "messages": st.session_state.messages.copy(),
-        }
-        
-        # Guardar en base de datos
-        db.update_chat_title(st.session_state.current_chat, safe_text(title))
-        
-        # Guardar mensajes nuevos
-        for message in st.session_state.messages:
-            db.add_message(
-                st.session_state.current_chat,
-                message["role"],
-                message["content"]
-            )
-
 def load_chat(chat_id):
     """Carga un chat del historial."""
     if "usuario" in st.session_state and chat_id in st.session_state.chat_history.get(st.session_state.usuario, {}):
@@ -554,6 +542,45 @@ def load_chat(chat_id):
         st.session_state.messages = st.session_state.chat_history[st.session_state.usuario][chat_id]["messages"].copy()
         st.rerun()
 
+def load_chat_messages(chat_id):
+    """Carga en la sesión solo la última página de mensajes de un chat."""
+    page = db.get_chat_messages(chat_id, limit=MESSAGES_PAGE_SIZE)
+    if not page:
+        return False
+    
+    chat = db.get_chat(chat_id)
+    persisted = chat['message_count'] if chat else len(page)
+    st.session_state.current_chat = chat_id
+    st.session_state.messages = [
+        {"role": msg['role'], "content": msg['content']}
+        for msg in page
+    ]
+    st.session_state.oldest_message_id = page[0]['id']
+    st.session_state.messages_offset = max(persisted - len(page), 0)
+    return True
+
+def load_older_messages():
+    """Antepone la página anterior de mensajes del chat actual."""
+    older = db.get_chat_messages(
+        st.session_state.current_chat,
+        limit=MESSAGES_PAGE_SIZE,
+        before_id=st.session_state.oldest_message_id
+    )
+    if not older:
+        st.session_state.messages_offset = 0
+        return
+    
+    st.session_state.messages = [
+        {"role": msg['role'], "content": msg['content']}
+        for msg in older
+    ] + st.session_state.messages
+    st.session_state.oldest_message_id = older[0]['id']
+    st.session_state.messages_offset = max(st.session_state.messages_offset - len(older), 0)
+
+def reset_chat_pagination():
+    st.session_state.messages_offset = 0
+    st.session_state.oldest_message_id = None
+
 # --- BARRA LATERAL MEJORADA ---
 def create_sidebar():
     """Crea la barra lateral con navegación y gestión de archivos"""
@@ -572,9 +599,10 @@ def create_sidebar():
     # Renderizar chats del usuario actual
     if st.session_state.get("user_id"):
         try:
-            user_chats = db.get_user_chats(st.session_state.user_id)
-            for chat in user_chats[-10:]:  # Mostrar últimos 10 chats
-                is_active = chat['chat_id'] == st.session_state.current_chat
+            # Solo la primera página: los chats más recientes
+            user_chats = db.get_user_chats(st.session_state.user_id, limit=SIDEBAR_CHATS_LIMIT)
+            for chat in user_chats:
+                is_active = chat['id'] == st.session_state.current_chat
                 preview = chat['title'][:50] + "..." if len(chat['title']) > 50 else chat['title']
                 
                 st.markdown(
@@ -589,13 +617,12 @@ def create_sidebar():
                 
                 # Botón para cargar el chat
                 if st.button("Abrir", key=f"open_{chat['id']}"):
-                    st.session_state.current_chat = chat['chat_id']
-                    # Cargar mensajes del chat
-                    chat_messages = db.get_chat_messages(chat['chat_id'])
-                    st.session_state.messages = [
-                        {"role": msg['role'], "content": msg['content']} 
-                        for msg in chat_messages
-                    ]
+                    # Cargar la última página de mensajes del chat
+                    save_current_chat()
+                    if not load_chat_messages(chat['id']):
+                        st.session_state.current_chat = chat['id']
+                        st.session_state.messages = []
+                        reset_chat_pagination()
                     st.rerun()
         except Exception as e:
             st.write("No hay chats anteriores")
@@ -607,6 +634,7 @@ def create_sidebar():
         save_current_chat()
         st.session_state.current_chat = str(uuid.uuid4())
         st.session_state.messages = []
+        reset_chat_pagination()
         st.rerun()
 
     st.markdown('</div>', unsafe_allow_html=True)
@@ -642,6 +670,14 @@ def create_sidebar():
 
     selected_option = st.radio("", menu_options, key="menu_option", label_visibility="collapsed")
 
+    if st.session_state.rol == "admin":
+        # Métricas de las cachés de respuestas de este proceso
+        exact, semantic = response_cache.stats(), semantic_cache.stats()
+        st.caption(
+            f"Caché exacta: {exact['hit_rate']:.0%} aciertos ({exact['hits']}/{exact['hits'] + exact['misses']}) · "
+            f"Caché semántica: {semantic['hit_rate']:.0%} aciertos, {semantic['entries']} preguntas"
+        )
+
     st.markdown('</div>', unsafe_allow_html=True)
 
     if st.button("🚪 Cerrar sesión", key="logout_btn", use_container_width=True, type="primary"):
@@ -653,105 +689,118 @@ def create_sidebar():
     return selected_option
 
 # --- FUNCIONES DE UTILIDAD PARA ARCHIVOS ---
-def save_uploaded_file(uploaded_file, user_id):
-    """Guarda un archivo subido y lo procesa"""
-    try:
-        # Crear directorio del usuario si no existe
-        user_dir = f"uploads/{user_id}"
-        os.makedirs(user_dir, exist_ok=True)
-        
-        # Guardar archivo físico
-        file_path = os.path.join(user_dir, uploaded_file.name)
-        with open(file_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-        
-        # Procesar archivo
-        processor = FileProcessor()
-        content, summary, error = processor.process_file(file_path)
-        
-        if error:
-            return None, error
-        
-        # Guardar en base de datos
-        file_id = db.save_file(
-            user_id=user_id,
-            filename=uploaded_file.name,
-            file_path=file_path,
-            file_type=FileProcessor.get_file_type(uploaded_file.name),
-            file_size=uploaded_file.size,
-            content_extracted=content,
-            analysis_summary=summary
-        )
-        
-        # Agregar al contexto del usuario
-        if content:
-            context_key = f"Archivo: {uploaded_file.name}"
-            db.save_user_context(user_id, context_key, content, file_id)
-        
-        return file_id, None
-        
-    except Exception as e:
-        return None, str(e)
+def get_file_ingestion_queue():
+    """Cola de ingesta en segundo plano (los trabajos de imágenes se analizan con Groq Vision)"""
+    return get_ingestion_queue(analyze_image_with_groq, GROQ_VISION_MODEL)
+
+@st.fragment(run_every=2)
+def ingestion_jobs_panel(user_id):
+    """Muestra el avance de los archivos encolados en esta sesión y refresca la página al terminar"""
+    job_ids = st.session_state.get("ingestion_jobs", [])
+    if not job_ids:
+        return
+    
+    finished = []
+    for job_id in job_ids:
+        job = db.get_ingestion_job(job_id)
+        if job is None:
+            finished.append(job_id)
+        elif job['status'] in (JOB_PENDING, JOB_RUNNING):
+            st.progress(job['progress'], text=f"⏳ {job['filename']}: {job['message']}")
+        elif job['status'] == JOB_DONE:
+            st.success(f"✅ {job['filename']} procesado y guardado")
+            finished.append(job_id)
+        else:
+            st.error(f"❌ Error al procesar {job['filename']}: {job['error']}")
+            finished.append(job_id)
+    
+    if finished:
+        st.session_state.ingestion_jobs = [job_id for job_id in job_ids if job_id not in finished]
+        # Actualizar archivos en sesión
+        st.session_state.user_files = db.get_user_files(user_id)
+        st.session_state.user_context = db.get_user_context(user_id)
+        st.rerun(scope="app")
+
+def _vision_payload(image_base64, filename):
+    """Payload que identifica un análisis de imagen en la caché de respuestas"""
+    return {
+        "model": GROQ_VISION_MODEL,
+        "messages": [{"role": "user", "content": [_vision_prompt(filename), image_base64]}],
+        "max_tokens": 1000,
+        "temperature": 0.3
+    }
 
 def analyze_image_with_groq(image_base64, filename):
-    """Analiza una imagen usando Groq Vision"""
-    try:
-        payload = {
-            "model": GROQ_VISION_MODEL,
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": f"Analiza esta imagen llamada '{filename}' y proporciona una descripción detallada de lo que ves, incluyendo elementos importantes, texto visible, colores, objetos, personas, y cualquier información relevante que pueda ser útil para futuras conversaciones."
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"
-                            }
-                        }
-                    ]
-                }
-            ],
-            "max_tokens": 1000,
-            "temperature": 0.3
-        }
-        
-        response = requests.post(API_URL, headers=BASE_HEADERS, json=payload)
-        
-        if response.status_code == 200:
-            result = response.json()
-            return result['choices'][0]['message']['content']
+    """Analiza una imagen usando Groq Vision; lanza GroqError si falla (la cola de ingesta reintenta)"""
+    payload = _vision_payload(image_base64, filename)
+    cached = response_cache.get(payload)
+    if cached is not None:
+        return cached
+    analysis = get_groq_client().vision(
+        _vision_prompt(filename),
+        image_base64,
+        model=GROQ_VISION_MODEL,
+        max_tokens=1000,
+        temperature=0.3
+    )
+    if not analysis:
+        raise GroqError(200, "Groq Vision devolvió un análisis vacío")
+    response_cache.put(payload, analysis)
+    return analysis
+
+def _vision_prompt(filename):
+    return f"Analiza esta imagen llamada '{filename}' y proporciona una descripción detallada de lo que ves, incluyendo elementos importantes, texto visible, colores, objetos, personas, y cualquier información relevante que pueda ser útil para futuras conversaciones."
+
+def analyze_images_with_groq(images):
+    """Analiza varias imágenes (base64, nombre) en paralelo; devuelve un análisis por imagen"""
+    payloads = [_vision_payload(image_base64, filename) for image_base64, filename in images]
+    analyses = [response_cache.get(payload) for payload in payloads]
+    
+    # Solo las imágenes sin análisis en caché van a Groq
+    pending = [i for i, analysis in enumerate(analyses) if analysis is None]
+    gateway = get_llm_gateway()
+    results = gateway.gather_sync(*[
+        gateway.vision(
+            _vision_prompt(images[i][1]),
+            images[i][0],
+            model=GROQ_VISION_MODEL,
+            max_tokens=1000,
+            temperature=0.3
+        )
+        for i in pending
+    ]) if pending else []
+    for i, result in zip(pending, results):
+        if isinstance(result, GroqError):
+            analyses[i] = f"Error en análisis: {result.status_code}"
+        elif isinstance(result, Exception):
+            analyses[i] = f"Error procesando imagen: {str(result)}"
         else:
-            return f"Error en análisis: {response.status_code}"
-            
-    except Exception as e:
-        return f"Error procesando imagen: {str(e)}"
+            response_cache.put(payloads[i], result)
+            analyses[i] = result
+    return analyses
 
-def get_personalized_context(user_id, query):
-    """Obtiene contexto personalizado basado en archivos del usuario"""
+def get_personalized_context(user_id, query, chat_id=None):
+    """Obtiene contexto personalizado basado en archivos y conversaciones anteriores del usuario"""
     try:
-        user_context = db.get_user_context(user_id)
-        if not user_context:
-            return ""
-        
-        # Buscar contexto relevante basado en la consulta
+        # Fragmentos más similares de los documentos del usuario (búsqueda vectorial)
         relevant_context = []
-        query_lower = query.lower()
+        for chunk in retriever.search(user_id, query, k=3):
+            key = f"Archivo: {chunk['filename']}"
+            if chunk['page']:
+                key += f" (pág. {chunk['page']})"
+            relevant_context.append({'key': key, 'content': chunk['content'], 'file_id': chunk['file_id']})
         
-        for context in user_context:
-            context_content = context['context_data'].lower()
-            # Búsqueda simple por palabras clave
-            if any(word in context_content for word in query_lower.split() if len(word) > 3):
-                relevant_context.append({
-                    'key': context['context_key'],
-                    'content': context['context_data'][:500] + "..." if len(context['context_data']) > 500 else context['context_data']
-                })
+        # Completar con la búsqueda indexada (FTS5 + bm25) en contexto y chats anteriores
+        if len(relevant_context) < 3:
+            seen_files = {ctx['file_id'] for ctx in relevant_context}
+            # Los mensajes del chat activo ya van en el historial
+            for ctx in db.search_context(user_id, query, k=3, exclude_chat_id=chat_id):
+                if ctx['file_id'] and ctx['file_id'] in seen_files:
+                    continue
+                relevant_context.append(ctx)
         
         if relevant_context:
-            context_text = "\n\nContexto personalizado basado en tus archivos:\n"
+            context_text = "\n\nContexto personalizado basado en tus archivos y conversaciones anteriores:\n"
             for ctx in relevant_context[:3]:  # Limitar a 3 contextos más relevantes
                 context_text += f"\n**{ctx['key']}:**\n{ctx['content']}\n"
             return context_text
@@ -770,6 +819,11 @@ def chat_page():
     # Mostrar mensajes del chat actual
     chat_container = st.container()
     with chat_container:
+        if st.session_state.get("messages_offset", 0) > 0:
+            if st.button("⬆️ Cargar mensajes anteriores", key="load_older_messages"):
+                load_older_messages()
+                st.rerun()
+        
         if st.session_state.messages:
             for message in st.session_state.messages:
                 with st.chat_message(message["role"]):
@@ -786,71 +840,72 @@ def chat_page():
         # Obtener contexto personalizado
         personalized_context = ""
         if st.session_state.get("user_id"):
-            personalized_context = get_personalized_context(st.session_state.user_id, prompt)
+            personalized_context = get_personalized_context(
+                st.session_state.user_id, prompt, st.session_state.current_chat
+            )
         
-        # Preparar mensaje con contexto
-        enhanced_prompt = prompt
-        if personalized_context:
-            enhanced_prompt = f"{prompt}{personalized_context}"
+        # Preguntas de un solo turno sin contexto de archivos: la respuesta no depende
+        # del usuario y puede reutilizarse para preguntas casi idénticas
+        cacheable = (
+            len(st.session_state.messages) == 1
+            and not st.session_state.get("messages_offset", 0)
+            and not personalized_context
+            and not st.session_state.get("user_context")
+        )
+        cached_response = semantic_cache.lookup(prompt, GROQ_TEXT_MODEL) if cacheable else None
         
         # Generar respuesta
         with st.chat_message("assistant"):
             message_placeholder = st.empty()
             full_response = ""
             
-            try:
-                # Preparar mensajes para la API
-                messages_for_api = []
-                for msg in st.session_state.messages[:-1]:  # Excluir el último mensaje del usuario
-                    messages_for_api.append({
-                        "role": msg["role"],
-                        "content": msg["content"]
-                    })
-                
-                # Agregar el mensaje actual con contexto
-                messages_for_api.append({
-                    "role": "user",
-                    "content": enhanced_prompt
-                })
-                
-                payload = {
-                    "model": GROQ_TEXT_MODEL,
-                    "messages": messages_for_api,
-                    "stream": True,
-                    "max_tokens": 2000,
-                    "temperature": 0.7
-                }
+            if cached_response is not None:
+                message_placeholder.markdown(cached_response)
+                full_response = cached_response
+            else:
+                try:
+                    # Prompt de sistema + contexto + turnos recientes dentro del presupuesto de tokens;
+                    # los turnos antiguos van como resumen acumulado
+                    messages_for_api = budgeter.build(
+                        st.session_state.current_chat,
+                        _system_prompt()["content"],
+                        st.session_state.messages[:-1],  # Excluir el último mensaje del usuario
+                        prompt,
+                        context=personalized_context,
+                        response_tokens=2000,
+                        offset=st.session_state.get("messages_offset", 0)
+                    )
                 
-                response = requests.post(API_URL, headers=STREAM_HEADERS, json=payload, stream=True)
+                    # Una petición idéntica (mismo prompt, contexto e historial) se reproduce
+                    # desde la caché de respuestas; si no, se guarda al terminar el stream
+                    payload = {"model": GROQ_TEXT_MODEL, "messages": messages_for_api,
+                               "max_tokens": 2000, "temperature": 0.7}
+                    
+                    # Los deltas se agrupan y se redibujan por presupuesto de tiempo/caracteres;
+                    # el volcado final (sin cursor) está garantizado al salir del bloque
+                    with ThrottledRenderer(
+                        lambda text, final: message_placeholder.markdown(text if final else text + "▌")
+                    ) as renderer:
+                        for delta in response_cache.stream(payload, get_groq_client().chat_stream(
+                            messages_for_api,
+                            model=GROQ_TEXT_MODEL,
+                            max_tokens=2000,
+                            temperature=0.7
+                        )):
+                            renderer.push(delta)
                 
-                if response.status_code == 200:
-                    for line in response.iter_lines():
-                        if line:
-                            line = line.decode('utf-8')
-                            if line.startswith('data: '):
-                                data = line[6:]
-                                if data.strip() == '[DONE]':
-                                    break
-                                try:
-                                    json_data = json.loads(data)
-                                    if 'choices' in json_data and json_data['choices']:
-                                        delta = json_data['choices'][0].get('delta', {})
-                                        if 'content' in delta:
-                                            full_response += delta['content']
-                                            message_placeholder.markdown(full_response + "▌")
-                                except json.JSONDecodeError:
-                                    continue
+                    full_response = renderer.text
+                    if cacheable:
+                        semantic_cache.store(prompt, GROQ_TEXT_MODEL, full_response)
                     
-                    message_placeholder.markdown(full_response)
-                else:
-                    error_msg = f"Error {response.status_code}: {response.text}"
+                except GroqError as e:
+                    error_msg = f"Error {e.status_code}: {e.body}"
+                    message_placeholder.markdown(f"❌ {error_msg}")
+                    full_response = error_msg
+                except Exception as e:
+                    error_msg = f"Error de conexión: {str(e)}"
                     message_placeholder.markdown(f"❌ {error_msg}")
                     full_response = error_msg
-                    
-            except Exception as e:
-                error_msg = f"Error de conexión: {str(e)}"
-                message_placeholder.markdown(f"❌ {error_msg}")
-                full_response = error_msg
         
         # Guardar respuesta del asistente
         st.session_state.messages.append({"role": "assistant", "content": full_response})
@@ -862,31 +917,27 @@ def chat_page():
         st.rerun()
 
 def save_current_chat():
-    """Guarda el chat actual en la base de datos"""
+    """Guarda en la base de datos los mensajes nuevos del chat actual"""
     if st.session_state.get("user_id") and st.session_state.messages:
         try:
-            # Generar título del chat basado en el primer mensaje
-            title = "Nuevo chat"
-            if st.session_state.messages:
+            # Generar título del chat basado en el primer mensaje (solo si está cargado:
+            # con paginación el primer mensaje en memoria no es el primero del chat)
+            title = DEFAULT_CHAT_TITLE
+            first_user_msg = ""
+            if not st.session_state.get("messages_offset", 0):
                 first_user_msg = next((msg['content'] for msg in st.session_state.messages if msg['role'] == 'user'), "")
-                if first_user_msg:
-                    title = first_user_msg[:50] + "..." if len(first_user_msg) > 50 else first_user_msg
+            if first_user_msg:
+                title = first_user_msg[:50] + "..." if len(first_user_msg) > 50 else first_user_msg
             
-            # Guardar o actualizar chat
-            chat_id = db.save_chat(
-                user_id=st.session_state.user_id,
+            # Solo se insertan los mensajes posteriores a la marca de agua del chat,
+            # en una única transacción
+            db.append_chat_messages(
                 chat_id=st.session_state.current_chat,
-                title=title
+                user_id=st.session_state.user_id,
+                title=title,
+                messages=st.session_state.messages,
+                offset=st.session_state.get("messages_offset", 0)
             )
-            
-            # Guardar mensajes
-            for i, message in enumerate(st.session_state.messages):
-                db.save_message(
-                    chat_id=chat_id,
-                    role=message['role'],
-                    content=message['content'],
-                    message_order=i
-                )
                 
         except Exception as e:
             print(f"Error guardando chat: {e}")
@@ -895,28 +946,32 @@ def save_current_chat():
 def image_page():
     """Página de análisis de imágenes mejorada"""
     st.title("🖼️ Análisis de Imágenes")
-    st.write("Sube una imagen para que Zero la analice usando Groq Vision.")
+    st.write("Sube una o varias imágenes para que Zero las analice usando Groq Vision.")
     
-    uploaded_file = st.file_uploader(
-        "Elige una imagen",
-        type=["jpg", "jpeg", "png", "gif", "bmp", "webp"]
+    uploaded_files = st.file_uploader(
+        "Elige una o varias imágenes",
+        type=["jpg", "jpeg", "png", "gif", "bmp", "webp"],
+        accept_multiple_files=True
     )
     
-    if uploaded_file is not None:
-        # Mostrar imagen
-        image = Image.open(uploaded_file)
-        st.image(image, caption=uploaded_file.name, use_column_width=True)
+    if uploaded_files:
+        # Mostrar imágenes
+        for uploaded_file in uploaded_files:
+            image = Image.open(uploaded_file)
+            st.image(image, caption=uploaded_file.name, use_column_width=True)
         
-        if st.button("🔍 Analizar Imagen", type="primary"):
-            with st.spinner("Analizando imagen..."):
-                # Convertir a base64
-                image_base64 = b64encode(uploaded_file.getvalue()).decode('utf-8')
-                
-                # Analizar con Groq Vision
-                analysis = analyze_image_with_groq(image_base64, uploaded_file.name)
-                
+        label = "🔍 Analizar Imagen" if len(uploaded_files) == 1 else f"🔍 Analizar {len(uploaded_files)} Imágenes"
+        if st.button(label, type="primary"):
+            with st.spinner("Analizando imágenes..."):
+                # Todas las imágenes se envían a Groq Vision a la vez
+                analyses = analyze_images_with_groq([
+                    (b64encode(uploaded_file.getvalue()).decode('utf-8'), uploaded_file.name)
+                    for uploaded_file in uploaded_files
+                ])
+            
+            for uploaded_file, analysis in zip(uploaded_files, analyses):
                 # Mostrar resultado
-                st.subheader("📋 Análisis de la Imagen")
+                st.subheader(f"📋 Análisis de {uploaded_file.name}")
                 st.write(analysis)
                 
                 # Guardar análisis si el usuario está autenticado
@@ -1009,7 +1064,7 @@ def file_upload_page():
     
     # Obtener user_id desde la base de datos usando el username
     username = st.session_state.usuario
-    user_id = db.get_user_id_by_username(username)
+    user_id = user_store.get_user_id(username)
     
     if not user_id:
         st.error("❌ No se pudo obtener la información del usuario.")
@@ -1029,41 +1084,38 @@ def file_upload_page():
         st.info(f"📄 **{uploaded_file.name}** ({uploaded_file.size / 1024:.1f} KB)")
         
         if st.button("🚀 Procesar Archivo", type="primary"):
-            with st.spinner("Procesando archivo..."):
-                # Guardar y procesar archivo
-                file_id, error = save_uploaded_file(uploaded_file, user_id)
-                
-                if error:
-                    st.error(f"❌ Error al procesar archivo: {error}")
-                else:
-                    st.success("✅ Archivo procesado y guardado exitosamente")
-                    
-                    # Si es una imagen, realizar análisis con Groq Vision
-                    if uploaded_file.type.startswith('image/'):
-                        with st.spinner("Analizando imagen con Groq Vision..."):
-                            image_base64 = b64encode(uploaded_file.getvalue()).decode('utf-8')
-                            analysis = analyze_image_with_groq(image_base64, uploaded_file.name)
-                            
-                            # Guardar análisis
-                            db.save_image_analysis(
-                                user_id=user_id,
-                                image_path=f"uploads/{user_id}/{uploaded_file.name}",
-                                analysis_result=analysis,
-                                model_used=GROQ_VISION_MODEL,
-                                archivo_id=file_id
-                            )
-                            
-                            # Agregar análisis al contexto
-                            context_key = f"Análisis de imagen: {uploaded_file.name}"
-                            db.save_user_context(user_id, context_key, analysis, file_id)
-                            
-                            st.success("🖼️ Imagen analizada con Groq Vision")
-                    
-                    # Actualizar archivos en sesión
-                    st.session_state.user_files = db.get_user_files(user_id)
-                    st.session_state.user_context = db.get_user_context(user_id)
-                    
-                    st.rerun()
+            # Solo se guarda el archivo y se encola: la extracción, la indexación y el
+            # análisis de imágenes con Groq Vision se hacen en segundo plano
+            try:
+                job_id = get_file_ingestion_queue().enqueue(user_id, uploaded_file.name, uploaded_file.getvalue())
+                st.session_state.setdefault("ingestion_jobs", []).append(job_id)
+                st.info("📥 Archivo en cola de procesamiento")
+            except Exception as e:
+                st.error(f"❌ Error al procesar archivo: {str(e)}")
+    
+    # Avance de los archivos en proceso
+    ingestion_jobs_panel(user_id)
+    
+    # Ingesta masiva de la carpeta de documentos del usuario (solo administradores)
+    if st.session_state.get("rol") == "admin":
+        docs_dir = user_docs_dir(username)
+        st.subheader("📚 Ingesta de Carpeta")
+        st.caption(f"Sincroniza los documentos nuevos, modificados o eliminados de `{docs_dir}`.")
+        
+        if st.button("🔄 Sincronizar carpeta", disabled=not os.path.isdir(docs_dir)):
+            progress_bar = st.progress(0.0, text="Revisando archivos...")
+            report = ingest_user_folder(
+                username,
+                progress=lambda done, total, path: progress_bar.progress(done / total, text=f"[{done}/{total}] {path}"),
+                analyze_image=analyze_image_with_groq,
+                vision_model=GROQ_VISION_MODEL
+            )
+            progress_bar.empty()
+            (st.warning if report['failed'] else st.success)(format_report(report))
+            
+            # Actualizar archivos en sesión
+            st.session_state.user_files = db.get_user_files(user_id)
+            st.session_state.user_context = db.get_user_context(user_id)
     
     # Sección de archivos existentes
     st.subheader("📋 Archivos Subidos")
@@ -1087,15 +1139,9 @@ def file_upload_page():
                 
                 with col2:
                     if st.button(f"🗑️ Eliminar", key=f"delete_{file_data['id']}"):
-                        # Eliminar archivo físico
-                        try:
-                            if os.path.exists(file_data['file_path']):
-                                os.remove(file_data['file_path'])
-                        except:
-                            pass
-                        
-                        # Eliminar de base de datos
-                        db.delete_file(file_data['id'], user_id)
+                        # Eliminar de base de datos; el blob se borra del disco
+                        # solo si ningún otro archivo lo comparte
+                        blob_store.delete_file(file_data, user_id)
                         
                         # Actualizar sesión
                         st.session_state.user_files = db.get_user_files(user_id)
@@ -1130,21 +1176,24 @@ def main():
         verificar_login()
         return
     
+    # Resolver el ID del usuario una vez por sesión
+    if st.session_state.get("usuario") and not st.session_state.get("user_id"):
+        st.session_state.user_id = user_store.get_user_id(st.session_state.usuario)
+    
     # Inicializar base de datos y cargar datos del usuario
     if st.session_state.get("user_id") and "user_files" not in st.session_state:
         st.session_state.user_files = db.get_user_files(st.session_state.user_id)
         st.session_state.user_context = db.get_user_context(st.session_state.user_id)
         
-        # Cargar historial de chats
-        user_chats = db.get_user_chats(st.session_state.user_id)
-        if user_chats:
-            # Cargar mensajes del chat actual
-            current_chat_messages = db.get_chat_messages(st.session_state.current_chat)
-            if current_chat_messages:
-                st.session_state.messages = [
-                    {"role": msg['role'], "content": msg['content']} 
-                    for msg in current_chat_messages
-                ]
+        # Cargar la última página de mensajes del chat actual
+        load_chat_messages(st.session_state.current_chat)
+        
+        # Arrancar la cola de ingesta para retomar trabajos pendientes
+        get_file_ingestion_queue()
+        
+        # Reindexar en segundo plano los cambios en storage/<usuario>/docs
+        if WATCH_STORAGE:
+            get_storage_watcher(analyze_image_with_groq, GROQ_VISION_MODEL)
     
     # Sidebar con navegación
     with st.sidebar:
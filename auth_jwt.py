@@ -1,45 +1,170 @@
 import jwt
 import datetime
-import json
 import os
+import threading
+import time
 import streamlit as st
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 import uuid
 
+from database import db, ZeroDatabase
+from user_store import user_store
+
 # Clave secreta para JWT (en producción debería estar en variables de entorno)
 JWT_SECRET = os.getenv('JWT_SECRET', 'zero_ai_secret_key_2024')
 JWT_ALGORITHM = 'HS256'
 TOKEN_EXPIRY_HOURS = 1
 
-# Archivo para almacenar tokens activos
-TOKENS_FILE = 'active_tokens.json'
-USUARIOS_FILE = 'usuarios.json'
+# Segundos que una sesión verificada se sirve desde memoria sin consultar la base de datos
+TOKEN_CACHE_TTL = float(os.getenv('ZERO_TOKEN_CACHE_TTL', '5'))
+# Segundos entre barridos de sesiones vencidas en segundo plano (0 lo desactiva)
+TOKEN_SWEEP_INTERVAL = float(os.getenv('ZERO_TOKEN_SWEEP_INTERVAL', '300'))
+
+
+class TokenRegistry:
+    """Sesiones JWT activas en la tabla token_sessions, con caché de escritura directa.
+
+    Cada operación es una sola sentencia indexada sobre zero.db, así que varios
+    inicios de sesión a la vez no se pisan. Las sesiones verificadas se guardan
+    en memoria durante `ttl` segundos; las escrituras de este proceso actualizan
+    la base de datos y la caché a la vez, y una invalidación hecha desde otro
+    proceso tarda como mucho `ttl` segundos en verse aquí.
+
+    Las sesiones vencidas las borra un hilo de fondo cada `sweep_interval`
+    segundos; las consultas ya ignoran las vencidas, así que verificar un token
+    nunca hace trabajo de limpieza.
+    """
+
+    def __init__(self, database: ZeroDatabase, ttl: float = TOKEN_CACHE_TTL,
+                 sweep_interval: float = TOKEN_SWEEP_INTERVAL):
+        self.db = database
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        # (usuario, dispositivo) -> (sesión, instante en que se leyó)
+        self._cache: Dict[Tuple[str, str], Tuple[Dict[str, Any], float]] = {}
+        self._lock = threading.Lock()
+        self._sweep_stop = threading.Event()
+        self._sweep_thread: Optional[threading.Thread] = None
+        self._sweep_stats = {
+            'sweeps': 0,
+            'swept_total': 0,
+            'last_swept': 0,
+            'last_sweep_at': None,
+            'last_sweep_ms': 0.0,
+            'errors': 0
+        }
+        if self.sweep_interval > 0:
+            self.start_sweeper()
+
+    def add(self, usuario: str, device_id: str, token: str, jti: Optional[str],
+            created_at: float, expires_at: float):
+        """Registra (o reemplaza) el token de un dispositivo"""
+        self.db.save_token_session(usuario, device_id, token, jti, created_at, expires_at)
+        session = {
+            'username': usuario,
+            'device_id': device_id,
+            'token': token,
+            'jti': jti,
+            'created_at': created_at,
+            'expires_at': expires_at
+        }
+        with self._lock:
+            self._cache[(usuario, device_id)] = (session, time.monotonic())
+
+    def get(self, usuario: str, device_id: str) -> Optional[Dict[str, Any]]:
+        """Sesión vigente de un dispositivo, desde memoria si se leyó hace menos de `ttl`"""
+        key = (usuario, device_id)
+        with self._lock:
+            cached = self._cache.get(key)
+        if cached and time.monotonic() - cached[1] < self.ttl and cached[0]['expires_at'] > time.time():
+            return cached[0]
+        
+        session = self.db.get_token_session(usuario, device_id)
+        with self._lock:
+            if session:
+                self._cache[key] = (session, time.monotonic())
+            else:
+                self._cache.pop(key, None)
+        return session
+
+    def remove(self, usuario: str, device_id: Optional[str] = None) -> int:
+        """Quita el token de un dispositivo o, sin device_id, todos los del usuario"""
+        removed = self.db.delete_token_sessions(usuario, device_id)
+        with self._lock:
+            for key in [key for key in self._cache if key[0] == usuario and device_id in (None, key[1])]:
+                del self._cache[key]
+        return removed
+
+    def purge_expired(self) -> int:
+        """Elimina las sesiones vencidas de la base de datos y de la caché"""
+        now = time.time()
+        removed = self.db.delete_expired_token_sessions(now)
+        with self._lock:
+            for key in [key for key, (session, _) in self._cache.items() if session['expires_at'] <= now]:
+                del self._cache[key]
+        return removed
+
+    # === BARRIDO EN SEGUNDO PLANO ===
+    def sweep(self) -> int:
+        """Un barrido de sesiones vencidas, registrado en las métricas"""
+        started = time.perf_counter()
+        removed = self.purge_expired()
+        with self._lock:
+            self._sweep_stats['sweeps'] += 1
+            self._sweep_stats['swept_total'] += removed
+            self._sweep_stats['last_swept'] = removed
+            self._sweep_stats['last_sweep_at'] = time.time()
+            self._sweep_stats['last_sweep_ms'] = (time.perf_counter() - started) * 1000
+        return removed
+
+    def _sweep_loop(self):
+        while not self._sweep_stop.wait(self.sweep_interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                with self._lock:
+                    self._sweep_stats['errors'] += 1
+                print(f"Error barriendo sesiones JWT vencidas: {e}")
+
+    def start_sweeper(self):
+        """Arranca el hilo que borra las sesiones vencidas periódicamente"""
+        if self._sweep_thread and self._sweep_thread.is_alive():
+            return
+        self._sweep_stop.clear()
+        self._sweep_thread = threading.Thread(
+            target=self._sweep_loop, name="zero-token-sweeper", daemon=True
+        )
+        self._sweep_thread.start()
+
+    def stop_sweeper(self):
+        """Detiene el hilo de barrido"""
+        self._sweep_stop.set()
+        if self._sweep_thread:
+            self._sweep_thread.join(timeout=5)
+            self._sweep_thread = None
+
+    def sweep_stats(self) -> Dict[str, Any]:
+        """Métricas del barrido: ejecuciones, sesiones borradas y duración del último"""
+        with self._lock:
+            return {**self._sweep_stats, 'cached_sessions': len(self._cache)}
+
+
+# Registro compartido por todo el proceso (sobrevive a los reruns de Streamlit)
+token_registry = TokenRegistry(db)
+
 
 class JWTAuth:
     @staticmethod
     def load_active_tokens() -> Dict[str, Any]:
-        """Carga los tokens activos desde el archivo"""
-        if not os.path.exists(TOKENS_FILE):
-            return {}
-        try:
-            with open(TOKENS_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            return {}
-    
-    @staticmethod
-    def save_active_tokens(tokens: Dict[str, Any]):
-        """Guarda los tokens activos en el archivo"""
-        with open(TOKENS_FILE, 'w') as f:
-            json.dump(tokens, f, indent=4)
-    
-    @staticmethod
-    def load_usuarios() -> Dict[str, Any]:
-        """Carga usuarios desde el archivo"""
-        if not os.path.exists(USUARIOS_FILE):
-            return {}
-        with open(USUARIOS_FILE, 'r') as f:
-            return json.load(f)
+        """Devuelve los tokens activos agrupados por usuario y dispositivo"""
+        active_tokens = {}
+        for session in db.get_token_sessions():
+            active_tokens.setdefault(session['username'], {})[session['device_id']] = {
+                'token': session['token'],
+                'created_at': datetime.datetime.utcfromtimestamp(session['created_at']).isoformat(),
+                'expires_at': datetime.datetime.utcfromtimestamp(session['expires_at']).isoformat()
+            }
+        return active_tokens
     
     @staticmethod
     def generate_token(usuario: str, rol: str, device_id: Optional[str] = None) -> str:
@@ -47,29 +172,22 @@ class JWTAuth:
         if not device_id:
             device_id = str(uuid.uuid4())
         
+        issued_at = datetime.datetime.now(datetime.timezone.utc)
+        expires_at = issued_at + datetime.timedelta(hours=TOKEN_EXPIRY_HOURS)
         payload = {
             'usuario': usuario,
             'rol': rol,
             'device_id': device_id,
-            'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=TOKEN_EXPIRY_HOURS),
-            'iat': datetime.datetime.utcnow(),
+            'exp': expires_at,
+            'iat': issued_at,
             'jti': str(uuid.uuid4())  # JWT ID único
         }
         
         token = jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
         
         # Guardar token activo
-        active_tokens = JWTAuth.load_active_tokens()
-        if usuario not in active_tokens:
-            active_tokens[usuario] = {}
-        
-        active_tokens[usuario][device_id] = {
-            'token': token,
-            'created_at': datetime.datetime.utcnow().isoformat(),
-            'expires_at': (datetime.datetime.utcnow() + datetime.timedelta(hours=TOKEN_EXPIRY_HOURS)).isoformat()
-        }
-        
-        JWTAuth.save_active_tokens(active_tokens)
+        token_registry.add(usuario, device_id, token, payload['jti'],
+                           issued_at.timestamp(), expires_at.timestamp())
         return token
     
     @staticmethod
@@ -79,14 +197,9 @@ class JWTAuth:
             payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
             
             # Verificar si el token está en la lista de tokens activos
-            active_tokens = JWTAuth.load_active_tokens()
-            usuario = payload.get('usuario')
-            device_id = payload.get('device_id')
-            
-            if usuario in active_tokens and device_id in active_tokens[usuario]:
-                stored_token = active_tokens[usuario][device_id]['token']
-                if stored_token == token:
-                    return payload
+            stored = token_registry.get(payload.get('usuario'), payload.get('device_id'))
+            if stored and stored['token'] == token:
+                return payload
             
             return None
         except jwt.ExpiredSignatureError:
@@ -97,61 +210,29 @@ class JWTAuth:
     @staticmethod
     def invalidate_token(usuario: str, device_id: str):
         """Invalida un token específico"""
-        active_tokens = JWTAuth.load_active_tokens()
-        if usuario in active_tokens and device_id in active_tokens[usuario]:
-            del active_tokens[usuario][device_id]
-            if not active_tokens[usuario]:  # Si no quedan tokens para el usuario
-                del active_tokens[usuario]
-            JWTAuth.save_active_tokens(active_tokens)
+        token_registry.remove(usuario, device_id)
     
     @staticmethod
     def invalidate_all_user_tokens(usuario: str):
         """Invalida todos los tokens de un usuario (para logout completo)"""
-        active_tokens = JWTAuth.load_active_tokens()
-        if usuario in active_tokens:
-            del active_tokens[usuario]
-            JWTAuth.save_active_tokens(active_tokens)
+        token_registry.remove(usuario)
     
     @staticmethod
-    def cleanup_expired_tokens():
-        """Limpia tokens expirados"""
-        active_tokens = JWTAuth.load_active_tokens()
-        current_time = datetime.datetime.utcnow()
-        
-        users_to_remove = []
-        for usuario, devices in active_tokens.items():
-            devices_to_remove = []
-            for device_id, token_data in devices.items():
-                expires_at = datetime.datetime.fromisoformat(token_data['expires_at'])
-                if current_time > expires_at:
-                    devices_to_remove.append(device_id)
-            
-            for device_id in devices_to_remove:
-                del devices[device_id]
-            
-            if not devices:
-                users_to_remove.append(usuario)
-        
-        for usuario in users_to_remove:
-            del active_tokens[usuario]
-        
-        JWTAuth.save_active_tokens(active_tokens)
+    def cleanup_expired_tokens() -> int:
+        """Limpia tokens expirados (normalmente lo hace el barrido de fondo)"""
+        return token_registry.sweep()
     
     @staticmethod
     def authenticate_user(usuario: str, clave: str) -> Optional[Dict[str, Any]]:
         """Autentica un usuario con credenciales"""
-        usuarios = JWTAuth.load_usuarios()
-        if usuario in usuarios and usuarios[usuario]['clave'] == clave:
-            return usuarios[usuario]
-        return None
+        return user_store.authenticate(usuario, clave)
     
     @staticmethod
     def authenticate_nfc(uid: str) -> Optional[tuple]:
         """Autentica un usuario con NFC"""
-        usuarios = JWTAuth.load_usuarios()
-        for usuario, datos in usuarios.items():
-            if datos.get('nfc_uid') == uid:
-                return usuario, datos
+        datos = user_store.get_by_nfc_uid(uid)
+        if datos:
+            return datos['username'], datos
         return None
     
     @staticmethod
@@ -214,8 +295,7 @@ class JWTAuth:
 # Función de middleware para verificar autenticación
 def require_auth():
     """Middleware que requiere autenticación JWT"""
-    JWTAuth.cleanup_expired_tokens()  # Limpiar tokens expirados
-    
+    # Los tokens vencidos los elimina el barrido de fondo de token_registry
     if not JWTAuth.is_authenticated():
         return False
     return True
\ No newline at end of file
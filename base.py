@@ -9,6 +9,7 @@ import io
 from PIL import Image
 import time
 from Login import verificar_login, logout, registrar_usuario
+from stream_render import ThrottledRenderer
 from base64 import b64encode
 import os
 from twilio.rest import Client
@@ -588,25 +589,27 @@ def chat_page():
 
         if response:
             message_placeholder = st.empty()
-            full_response = ""
 
-            for chunk in response:
-                delta = None
-                try:
-                    delta = chunk.choices[0].delta.content
-                except Exception:
+            with ThrottledRenderer(
+                lambda text, final: message_placeholder.markdown(
+                    f"<div class='message'><div class='assistant-message'>{text}</div></div>",
+                    unsafe_allow_html=True,
+                )
+            ) as renderer:
+                for chunk in response:
+                    delta = None
                     try:
-                        delta = chunk.choices[0].message.get("content")
+                        delta = chunk.choices[0].delta.content
                     except Exception:
-                        delta = None
+                        try:
+                            delta = chunk.choices[0].message.get("content")
+                        except Exception:
+                            delta = None
 
-                if delta:
-                    full_response += delta
-                    message_placeholder.markdown(
-                        f"<div class='message'><div class='assistant-message'>{full_response}</div></div>",
-                        unsafe_allow_html=True,
-                    )
+                    if delta:
+                        renderer.push(delta)
 
+            full_response = renderer.text
             st.session_state.messages.append({"role": "assistant", "content": full_response})
             save_current_chat()
 
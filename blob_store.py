@@ -0,0 +1,104 @@
+import hashlib
+import os
+import tempfile
+from typing import Dict, Optional
+
+from database import db, ZeroDatabase
+
+# Directorio raíz de los blobs (uno por contenido distinto)
+BLOB_ROOT = os.getenv("ZERO_BLOB_ROOT", os.path.join("storage", "blobs"))
+
+
+def content_hash(data: bytes) -> str:
+    """SHA-256 en hexadecimal del contenido"""
+    return hashlib.sha256(data).hexdigest()
+
+
+class BlobStore:
+    """Almacén de archivos direccionado por contenido (SHA-256) con conteo de referencias.
+
+    Cada contenido distinto se guarda una sola vez en `root/ab/cd/<hash>`; los
+    registros de `archivos` apuntan a él mediante `content_hash` y la tabla
+    `blobs` lleva la cuenta de referencias y cachea el resultado de la extracción,
+    de modo que volver a subir el mismo archivo no lo reescribe ni lo reprocesa.
+    """
+
+    def __init__(self, database: ZeroDatabase, root: str = BLOB_ROOT):
+        self.db = database
+        self.root = root
+
+    def path_for(self, digest: str) -> str:
+        """Ruta fragmentada en dos niveles para no acumular miles de archivos en un directorio"""
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def put(self, data: bytes) -> Dict:
+        """Guarda el contenido si no existía y devuelve el registro de su blob.
+
+        La referencia se suma al guardar el archivo con `db.save_file(content_hash=...)`.
+        Comprobar el archivo en disco y registrar el blob ocurren en la misma
+        transacción que `release`, así que un blob no puede borrarse entre ambos pasos.
+        """
+        digest = content_hash(data)
+        path = self.path_for(digest)
+        # El contenido nuevo se escribe fuera del bloqueo de escritura; dentro solo se renombra
+        tmp_path = None if os.path.exists(path) else self._write_temp(path, data)
+        try:
+            with self.db.transaction():
+                if not os.path.exists(path):
+                    os.replace(tmp_path or self._write_temp(path, data), path)
+                    tmp_path = None
+                return self.db.register_blob(digest, len(data), path)
+        finally:
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @staticmethod
+    def _write_temp(path: str, data: bytes) -> str:
+        """Escribe el contenido en un temporal junto a `path` (para renombrarlo de forma atómica)"""
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return tmp_path
+
+    def save_extraction(self, digest: str, file_type: str, content: Optional[str], summary: Optional[str]):
+        """Cachea el texto extraído y el resumen del contenido"""
+        self.db.save_blob_extraction(digest, file_type, content, summary)
+
+    def release(self, digest: str) -> bool:
+        """Elimina el blob del disco si ya no lo referencia ningún archivo"""
+        # El archivo se borra dentro de la transacción para no cruzarse con un `put` del mismo contenido
+        with self.db.transaction():
+            path = self.db.delete_unreferenced_blob(digest)
+            if path is None:
+                return False
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        return True
+
+    def delete_file(self, file_data: Dict, user_id: int) -> bool:
+        """Elimina un archivo del usuario y libera su blob (o su ruta antigua, si no tiene hash)"""
+        if not self.db.delete_file(file_data['id'], user_id):
+            return False
+        digest = file_data.get('content_hash')
+        if digest:
+            self.release(digest)
+        else:
+            # Archivos anteriores al almacén por contenido
+            try:
+                if os.path.exists(file_data['file_path']):
+                    os.remove(file_data['file_path'])
+            except OSError:
+                pass
+        return True
+
+
+# Instancia global del almacén
+blob_store = BlobStore(db)
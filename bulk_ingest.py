@@ -0,0 +1,226 @@
+import argparse
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from database import db, ZeroDatabase
+from blob_store import blob_store, BlobStore
+from file_processor import FileProcessor
+from ingestion import IngestionQueue, ImageAnalyzer, INGEST_WORKERS
+from retrieval import retriever, ChunkRetriever
+
+# Raíz de las carpetas de usuario: storage/<usuario>/docs
+STORAGE_ROOT = os.getenv("ZERO_STORAGE_ROOT", "storage")
+# Bloque de lectura al calcular el hash de un archivo
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# progress(procesados, total, ruta relativa)
+BulkProgress = Callable[[int, int, str], None]
+
+# Una sola sincronización a la vez por usuario (botón, CLI y vigilante pueden coincidir)
+_user_locks: Dict[int, threading.Lock] = {}
+_user_locks_guard = threading.Lock()
+
+
+def _user_lock(user_id: int) -> threading.Lock:
+    with _user_locks_guard:
+        return _user_locks.setdefault(user_id, threading.Lock())
+
+
+def user_docs_dir(username: str, root: str = STORAGE_ROOT) -> str:
+    """Carpeta de documentos de un usuario"""
+    return os.path.join(root, username, "docs")
+
+
+def file_sha256(path: str) -> str:
+    """SHA-256 de un archivo leído por bloques"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def iter_documents(directory: str) -> Iterator[str]:
+    """Rutas relativas (con '/') de los archivos soportados dentro de la carpeta"""
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+        for filename in filenames:
+            if filename.startswith(".") or not FileProcessor.is_supported(filename):
+                continue
+            full_path = os.path.join(dirpath, filename)
+            yield os.path.relpath(full_path, directory).replace(os.sep, "/")
+
+
+class FolderIngestor:
+    """Sincroniza la carpeta de documentos de un usuario con sus archivos en la base de datos.
+
+    Un archivo se considera sin cambios si coinciden su mtime y tamaño con los
+    registrados en `source_files`; si no, se calcula su hash y solo se vuelve a
+    procesar cuando el contenido cambió de verdad. Los archivos nuevos o
+    modificados se procesan en paralelo (hilos para E/S y base de datos, pool de
+    procesos para la extracción) y los que desaparecieron de la carpeta se eliminan.
+    """
+
+    def __init__(self, database: ZeroDatabase, blobs: BlobStore, chunk_retriever: ChunkRetriever,
+                 workers: int = INGEST_WORKERS, analyze_image: Optional[ImageAnalyzer] = None,
+                 vision_model: Optional[str] = None):
+        self.db = database
+        self.blobs = blobs
+        self.workers = max(1, workers)
+        self.ingestor = IngestionQueue(database, blobs, chunk_retriever, analyze_image, vision_model,
+                                       workers=self.workers)
+
+    def sync(self, user_id: int, directory: str, paths: Optional[Iterable[str]] = None,
+             progress: Optional[BulkProgress] = None) -> Dict:
+        """Ingiere lo nuevo o modificado y elimina lo borrado; devuelve un informe.
+
+        Con `paths` (rutas relativas) solo se revisan esos archivos en lugar de
+        recorrer toda la carpeta.
+        """
+        with _user_lock(user_id):
+            return self._sync(user_id, directory, paths, progress)
+
+    def _sync(self, user_id: int, directory: str, paths: Optional[Iterable[str]],
+              progress: Optional[BulkProgress]) -> Dict:
+        started = time.monotonic()
+        known = self.db.get_source_files(user_id)
+        if paths is None:
+            candidates = set(iter_documents(directory)) if os.path.isdir(directory) else set()
+            removed = [path for path in known if path not in candidates]
+        else:
+            paths = {path.replace(os.sep, "/") for path in paths}
+            candidates = {path for path in paths
+                          if os.path.isfile(os.path.join(directory, path)) and FileProcessor.is_supported(path)}
+            removed = [path for path in paths if path in known and path not in candidates]
+
+        report = {
+            'scanned': len(candidates),
+            'new': 0,
+            'changed': 0,
+            'unchanged': 0,
+            'deleted': 0,
+            'failed': 0,
+            'errors': [],
+            'elapsed': 0.0
+        }
+
+        # Filtro barato por mtime y tamaño; el hash solo se calcula para lo que parece cambiado
+        pending = []
+        for path in sorted(candidates):
+            stat = os.stat(os.path.join(directory, path))
+            previous = known.get(path)
+            if (previous and previous['file_exists'] and previous['mtime'] == stat.st_mtime
+                    and previous['size'] == stat.st_size):
+                report['unchanged'] += 1
+            else:
+                pending.append((path, stat, previous))
+
+        for path in removed:
+            self._remove(user_id, known[path])
+            report['deleted'] += 1
+
+        total = len(pending)
+        if total:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="zero-bulk") as pool:
+                futures = {
+                    pool.submit(self._ingest, user_id, directory, path, stat, previous): path
+                    for path, stat, previous in pending
+                }
+                # El avance se informa desde el hilo que llamó (Streamlit no admite otros hilos)
+                for done, future in enumerate(as_completed(futures), 1):
+                    path = futures[future]
+                    try:
+                        report[future.result()] += 1
+                    except Exception as e:
+                        report['failed'] += 1
+                        report['errors'].append((path, str(e)))
+                    if progress:
+                        progress(done, total, path)
+
+        report['elapsed'] = time.monotonic() - started
+        return report
+
+    def _ingest(self, user_id: int, directory: str, path: str, stat: os.stat_result,
+                previous: Optional[Dict]) -> str:
+        """Procesa un archivo; devuelve la categoría del informe"""
+        full_path = os.path.join(directory, path)
+        digest = file_sha256(full_path)
+        if previous and previous['file_exists'] and previous['content_hash'] == digest:
+            # Solo cambió la fecha: se actualiza el registro sin reprocesar
+            self.db.save_source_file(user_id, path, stat.st_mtime, stat.st_size, digest, previous['file_id'])
+            return 'unchanged'
+
+        with open(full_path, "rb") as f:
+            blob = self.blobs.put(f.read())
+        file_id = self.ingestor.ingest_blob(user_id, os.path.basename(path), stat.st_size, blob)
+        self.db.save_source_file(user_id, path, stat.st_mtime, stat.st_size, blob['hash'], file_id)
+
+        # La versión anterior se elimina solo cuando la nueva ya está guardada
+        if previous and previous['file_exists']:
+            self._delete_file(user_id, previous['file_id'])
+            return 'changed'
+        return 'new'
+
+    def close(self):
+        """Cierra el pool de extracción"""
+        self.ingestor.stop()
+
+    def _remove(self, user_id: int, previous: Dict):
+        if previous['file_exists']:
+            self._delete_file(user_id, previous['file_id'])
+        self.db.delete_source_file(user_id, previous['path'])
+
+    def _delete_file(self, user_id: int, file_id: str):
+        file_data = self.db.get_file_by_id(file_id)
+        if file_data:
+            self.blobs.delete_file(file_data, user_id)
+
+
+def format_report(report: Dict) -> str:
+    """Resumen legible del informe de sincronización"""
+    text = (
+        f"{report['scanned']} archivos revisados en {report['elapsed']:.1f}s: "
+        f"{report['new']} nuevos, {report['changed']} modificados, {report['unchanged']} sin cambios, "
+        f"{report['deleted']} eliminados, {report['failed']} con error"
+    )
+    for path, error in report['errors']:
+        text += f"\n  - {path}: {error}"
+    return text
+
+
+def ingest_user_folder(username: str, workers: int = INGEST_WORKERS, progress: Optional[BulkProgress] = None,
+                       analyze_image: Optional[ImageAnalyzer] = None, vision_model: Optional[str] = None,
+                       root: str = STORAGE_ROOT) -> Dict:
+    """Sincroniza storage/<usuario>/docs con los archivos del usuario"""
+    user_id = db.get_user_id_by_username(username)
+    if not user_id:
+        raise ValueError(f"Usuario no encontrado: {username}")
+    ingestor = FolderIngestor(db, blob_store, retriever, workers, analyze_image, vision_model)
+    try:
+        return ingestor.sync(user_id, user_docs_dir(username, root), progress=progress)
+    finally:
+        ingestor.close()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Ingesta masiva de storage/<usuario>/docs")
+    parser.add_argument("usernames", nargs="+", help="Usuarios cuyas carpetas se van a ingerir")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS, help="Procesos de extracción en paralelo")
+    parser.add_argument("--root", default=STORAGE_ROOT, help="Raíz de las carpetas de usuario")
+    args = parser.parse_args(argv)
+
+    def progress(done: int, total: int, path: str):
+        print(f"[{done}/{total}] {path}", flush=True)
+
+    for username in args.usernames:
+        print(f"== {username} ==")
+        report = ingest_user_folder(username, args.workers, progress, root=args.root)
+        print(format_report(report))
+
+
+if __name__ == "__main__":
+    main()
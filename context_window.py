@@ -0,0 +1,141 @@
+import os
+import re
+from typing import Callable, Dict, List, Optional
+
+from database import ZeroDatabase
+
+# Presupuesto total de tokens de la petición (prompt + respuesta)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("ZERO_CONTEXT_BUDGET", "6000"))
+# Máximo de tokens para el contexto recuperado (archivos, búsqueda) que acompaña al prompt
+CONTEXT_MAX_TOKENS = int(os.getenv("ZERO_CONTEXT_MAX_TOKENS", "1500"))
+# Máximo de tokens del resumen de turnos antiguos
+SUMMARY_MAX_TOKENS = int(os.getenv("ZERO_SUMMARY_MAX_TOKENS", "400"))
+# Al resumir, los turnos recientes se recortan a esta fracción del presupuesto del
+# historial para que los siguientes turnos quepan sin volver a resumir en cada mensaje
+RECENT_FRACTION = 0.6
+# Tokens fijos por mensaje (rol y separadores del formato de chat)
+MESSAGE_OVERHEAD = 4
+
+# Palabras, números y signos de puntuación sueltos
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+Summarizer = Callable[[str, List[Dict]], str]
+
+
+def count_tokens(text: str) -> int:
+    """Aproximación local al tokenizador BPE: una pieza por signo y ~6 caracteres por palabra"""
+    if not text:
+        return 0
+    return sum(1 + (len(piece) - 1) // 6 for piece in _TOKEN_RE.findall(text))
+
+
+def count_message_tokens(message: Dict) -> int:
+    return MESSAGE_OVERHEAD + count_tokens(message.get("content") or "")
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Recorta un texto para que no supere `max_tokens` (conserva el principio)"""
+    if max_tokens <= 0:
+        return ""
+    total = 0
+    for match in _TOKEN_RE.finditer(text):
+        total += 1 + (len(match.group()) - 1) // 6
+        if total > max_tokens:
+            return text[:match.start()].rstrip() + "…"
+    return text
+
+
+class ContextBudgeter:
+    """Ajusta los mensajes enviados al modelo a un presupuesto de tokens.
+
+    Siempre se envían el prompt de sistema, el mensaje actual (con su contexto
+    recuperado, recortado a CONTEXT_MAX_TOKENS) y tantos turnos recientes como
+    quepan. Los turnos más antiguos se condensan en un resumen acumulado que se
+    guarda en la base de datos por chat, de modo que solo se vuelve a resumir
+    cuando la ventana se desplaza.
+    """
+
+    def __init__(self, database: ZeroDatabase, summarize: Optional[Summarizer] = None,
+                 budget: int = CONTEXT_TOKEN_BUDGET, context_max_tokens: int = CONTEXT_MAX_TOKENS,
+                 summary_max_tokens: int = SUMMARY_MAX_TOKENS):
+        self.db = database
+        self.summarize = summarize
+        self.budget = budget
+        self.context_max_tokens = context_max_tokens
+        self.summary_max_tokens = summary_max_tokens
+
+    def build(self, chat_id: str, system_prompt: str, history: List[Dict], prompt: str,
+              context: str = "", response_tokens: int = 1200, offset: int = 0) -> List[Dict]:
+        """Devuelve la lista de mensajes a enviar.
+
+        `history` son los turnos anteriores al mensaje actual tal como están en
+        memoria y `offset` cuántos mensajes más antiguos del chat no están cargados.
+        """
+        system = {"role": "system", "content": system_prompt}
+        if context:
+            # El contexto recuperado nunca desplaza al prompt de sistema ni al mensaje actual
+            room = (self.budget - response_tokens - count_message_tokens(system)
+                    - count_message_tokens({"content": prompt}))
+            context = truncate_to_tokens(context, min(self.context_max_tokens, room))
+        current = {"role": "user", "content": f"{prompt}{context}"}
+        history = [{"role": msg["role"], "content": msg["content"]} for msg in history]
+
+        history_budget = (self.budget - response_tokens
+                          - count_message_tokens(system) - count_message_tokens(current))
+        costs = [count_message_tokens(msg) for msg in history]
+
+        cached = self.db.get_chat_summary(chat_id) if chat_id else None
+        if cached is None and sum(costs) <= history_budget:
+            return [system] + history + [current]
+
+        # Los mensajes ya cubiertos por el resumen no se reenvían
+        summary = cached['summary'] if cached else ""
+        covered = min(max(cached['covered_count'] - offset, 0), len(history)) if cached else 0
+        history_budget -= MESSAGE_OVERHEAD + self.summary_max_tokens
+
+        if sum(costs[covered:]) > history_budget:
+            split = self._split_point(costs, covered, int(max(history_budget, 0) * RECENT_FRACTION))
+            summary = self._extend_summary(chat_id, summary, history[covered:split], offset + split)
+            covered = split
+
+        messages = [system]
+        if summary:
+            messages.append({
+                "role": "system",
+                "content": "Resumen de la conversación anterior:\n"
+                           + truncate_to_tokens(summary, self.summary_max_tokens)
+            })
+        return messages + history[covered:] + [current]
+
+    @staticmethod
+    def _split_point(costs: List[int], start: int, target: int) -> int:
+        """Primer índice de los turnos recientes que caben en `target` tokens"""
+        used = 0
+        split = len(costs)
+        while split > start and used + costs[split - 1] <= target:
+            split -= 1
+            used += costs[split]
+        return split
+
+    def _extend_summary(self, chat_id: str, summary: str, messages: List[Dict], covered_count: int) -> str:
+        """Incorpora `messages` al resumen acumulado y lo guarda"""
+        if not messages or self.summarize is None:
+            return summary
+        try:
+            summary = truncate_to_tokens(self.summarize(summary, messages), self.summary_max_tokens)
+        except Exception as e:
+            # Sin resumen nuevo los turnos antiguos simplemente quedan fuera de la ventana
+            print(f"Error resumiendo historial: {e}")
+            return summary
+        if chat_id:
+            try:
+                self.db.save_chat_summary(chat_id, covered_count, summary)
+            except Exception as e:
+                print(f"Error guardando resumen: {e}")
+        return summary
+
+
+def format_transcript(messages: List[Dict]) -> str:
+    """Convierte turnos en texto plano para pedir su resumen"""
+    names = {"user": "Usuario", "assistant": "Zero"}
+    return "\n".join(f"{names.get(msg['role'], msg['role'])}: {msg['content']}" for msg in messages)
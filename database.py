@@ -1,193 +1,811 @@
 import sqlite3
+import hashlib
 import json
 import os
-from datetime import datetime
-from typing import List, Dict, Optional, Any
+import queue
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import List, Dict, Optional, Any, Iterator, Callable, Union
 import uuid
 
+# Tamaño máximo del pool de conexiones (configurable por entorno)
+DB_POOL_SIZE = int(os.getenv("ZERO_DB_POOL_SIZE", "5"))
+# Segundos de espera por una conexión libre cuando el pool está agotado
+DB_POOL_TIMEOUT = float(os.getenv("ZERO_DB_POOL_TIMEOUT", "30"))
+# Sentencias preparadas que cada conexión mantiene en caché
+DB_STATEMENT_CACHE_SIZE = 256
+
+# Perfil de PRAGMAs aplicado a cada conexión del pool. Con WAL los lectores
+# no se bloquean mientras otra sesión escribe.
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,          # ms esperando un lock antes de fallar
+    "cache_size": -16000,          # negativo = KiB (16 MB por conexión)
+    "mmap_size": 134217728,        # 128 MB de lectura mapeada en memoria
+    "temp_store": "MEMORY",
+    "wal_autocheckpoint": 1000,    # páginas
+}
+# Segundos entre checkpoints del WAL en segundo plano (0 lo desactiva)
+DB_CHECKPOINT_INTERVAL = float(os.getenv("ZERO_DB_CHECKPOINT_INTERVAL", "300"))
+
+# Archivo de tokens JWT anterior a la tabla token_sessions (se importa al migrar)
+LEGACY_TOKENS_FILE = os.getenv("ZERO_TOKENS_FILE", "active_tokens.json")
+# Archivo de usuarios anterior a la tabla usuarios como única fuente (se importa al migrar)
+LEGACY_USERS_FILE = os.getenv("ZERO_USERS_FILE", "usuarios.json")
+
+# Un paso de migración es una sentencia SQL o una función que recibe la conexión
+MigrationStep = Union[str, Callable[[sqlite3.Connection], None]]
+
+def _import_legacy_tokens(conn: sqlite3.Connection):
+    """Copia a token_sessions los tokens aún vigentes de LEGACY_TOKENS_FILE"""
+    if not os.path.exists(LEGACY_TOKENS_FILE):
+        return
+    try:
+        with open(LEGACY_TOKENS_FILE, "r") as f:
+            tokens = json.load(f)
+    except (OSError, ValueError):
+        return
+    
+    now = time.time()
+    rows = []
+    skipped = 0
+    for username, devices in (tokens.items() if isinstance(tokens, dict) else ()):
+        for device_id, data in (devices.items() if isinstance(devices, dict) else ()):
+            # Una entrada mal formada se descarta: no debe impedir que arranque la aplicación
+            try:
+                # Las fechas del archivo son UTC sin zona horaria
+                created_at = datetime.fromisoformat(data['created_at']).replace(tzinfo=timezone.utc).timestamp()
+                expires_at = datetime.fromisoformat(data['expires_at']).replace(tzinfo=timezone.utc).timestamp()
+                token = data['token']
+            except (KeyError, TypeError, ValueError):
+                skipped += 1
+                continue
+            if expires_at > now:
+                rows.append((username, device_id, token, created_at, expires_at))
+    if skipped:
+        print(f"{LEGACY_TOKENS_FILE}: {skipped} tokens mal formados omitidos")
+    conn.executemany(
+        """INSERT OR REPLACE INTO token_sessions (username, device_id, token, created_at, expires_at)
+           VALUES (?, ?, ?, ?, ?)""",
+        rows
+    )
+
+def hash_password(clave: str) -> str:
+    """Hash de contraseña con el formato de la tabla usuarios (MD5 en hexadecimal)"""
+    return hashlib.md5(clave.encode("utf-8")).hexdigest()
+
+def _import_users(conn: sqlite3.Connection, path: str) -> Dict[str, int]:
+    """Crea o actualiza en `usuarios` los usuarios de un archivo con el formato de usuarios.json"""
+    report = {'created': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0}
+    if not os.path.exists(path):
+        return report
+    try:
+        with open(path, "r") as f:
+            usuarios = json.load(f)
+    except (OSError, ValueError):
+        return report
+    if not isinstance(usuarios, dict):
+        # Se espera {usuario: {clave, rol, nfc_uid}}; cualquier otra cosa no se importa
+        report['skipped'] += 1
+        return report
+    
+    for username, datos in usuarios.items():
+        if not username.strip() or not isinstance(datos, dict) \
+                or not isinstance(datos.get('clave'), str) or not datos['clave']:
+            report['skipped'] += 1
+            continue
+        password_hash = hash_password(datos['clave'])
+        rol = datos.get('rol')
+        rol = rol if isinstance(rol, str) and rol else 'usuario'
+        nfc_uid = datos.get('nfc_uid')
+        nfc_uid = (nfc_uid.strip() or None) if isinstance(nfc_uid, str) else None
+        if nfc_uid:
+            owner = conn.execute("SELECT username FROM usuarios WHERE nfc_uid = ?", (nfc_uid,)).fetchone()
+            if owner and owner[0] != username:
+                # La tarjeta ya es de otro usuario (índice único)
+                nfc_uid = None
+        
+        row = conn.execute(
+            "SELECT password_hash, rol, nfc_uid FROM usuarios WHERE username = ?", (username,)
+        ).fetchone()
+        if row is None:
+            conn.execute(
+                "INSERT INTO usuarios (username, password_hash, rol, nfc_uid) VALUES (?, ?, ?, ?)",
+                (username, password_hash, rol, nfc_uid)
+            )
+            report['created'] += 1
+        elif tuple(row) == (password_hash, rol, nfc_uid):
+            report['unchanged'] += 1
+        else:
+            conn.execute(
+                "UPDATE usuarios SET password_hash = ?, rol = ?, nfc_uid = ? WHERE username = ?",
+                (password_hash, rol, nfc_uid, username)
+            )
+            report['updated'] += 1
+    return report
+
+def _import_legacy_users(conn: sqlite3.Connection):
+    _import_users(conn, LEGACY_USERS_FILE)
+
+# Migraciones del esquema, aplicadas en orden sobre las tablas base de
+# init_database. Una migración publicada no se edita: los cambios nuevos se
+# añaden al final con la siguiente versión.
+MIGRATIONS: List[tuple] = [
+    (1, "Índices secundarios de chats, mensajes, archivos y contexto", [
+        "CREATE INDEX IF NOT EXISTS idx_mensajes_chat_timestamp ON mensajes (chat_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_chats_user_updated ON chats (user_id, updated_at DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_archivos_user_uploaded ON archivos (user_id, uploaded_at DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_contexto_user_created ON contexto_usuario (user_id, created_at DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_contexto_source_file ON contexto_usuario (source_file_id)",
+        "CREATE INDEX IF NOT EXISTS idx_analisis_user_created ON analisis_imagenes (user_id, created_at DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_analisis_archivo ON analisis_imagenes (archivo_id)",
+    ]),
+    (2, "Marca de agua de mensajes persistidos por chat", [
+        "ALTER TABLE chats ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0",
+        "UPDATE chats SET message_count = (SELECT COUNT(*) FROM mensajes WHERE mensajes.chat_id = chats.id)",
+    ]),
+    (3, "Índices para paginación por cursor de chats y mensajes", [
+        "DROP INDEX IF EXISTS idx_chats_user_updated",
+        "CREATE INDEX IF NOT EXISTS idx_chats_user_updated_id ON chats (user_id, updated_at DESC, id DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_mensajes_chat_id ON mensajes (chat_id, id)",
+    ]),
+    (4, "Índices FTS5 de mensajes, archivos y contexto", [
+        """CREATE VIRTUAL TABLE IF NOT EXISTS mensajes_fts USING fts5(
+               content, content='mensajes', content_rowid='id',
+               tokenize='unicode61 remove_diacritics 2')""",
+        """CREATE TRIGGER IF NOT EXISTS mensajes_fts_ai AFTER INSERT ON mensajes BEGIN
+               INSERT INTO mensajes_fts (rowid, content) VALUES (new.id, new.content);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS mensajes_fts_ad AFTER DELETE ON mensajes BEGIN
+               INSERT INTO mensajes_fts (mensajes_fts, rowid, content) VALUES ('delete', old.id, old.content);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS mensajes_fts_au AFTER UPDATE OF content ON mensajes BEGIN
+               INSERT INTO mensajes_fts (mensajes_fts, rowid, content) VALUES ('delete', old.id, old.content);
+               INSERT INTO mensajes_fts (rowid, content) VALUES (new.id, new.content);
+           END""",
+        "INSERT INTO mensajes_fts (mensajes_fts) VALUES ('rebuild')",
+        
+        """CREATE VIRTUAL TABLE IF NOT EXISTS archivos_fts USING fts5(
+               filename, content_extracted, content='archivos', content_rowid='rowid',
+               tokenize='unicode61 remove_diacritics 2')""",
+        """CREATE TRIGGER IF NOT EXISTS archivos_fts_ai AFTER INSERT ON archivos BEGIN
+               INSERT INTO archivos_fts (rowid, filename, content_extracted)
+               VALUES (new.rowid, new.filename, new.content_extracted);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS archivos_fts_ad AFTER DELETE ON archivos BEGIN
+               INSERT INTO archivos_fts (archivos_fts, rowid, filename, content_extracted)
+               VALUES ('delete', old.rowid, old.filename, old.content_extracted);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS archivos_fts_au AFTER UPDATE OF filename, content_extracted ON archivos BEGIN
+               INSERT INTO archivos_fts (archivos_fts, rowid, filename, content_extracted)
+               VALUES ('delete', old.rowid, old.filename, old.content_extracted);
+               INSERT INTO archivos_fts (rowid, filename, content_extracted)
+               VALUES (new.rowid, new.filename, new.content_extracted);
+           END""",
+        "INSERT INTO archivos_fts (archivos_fts) VALUES ('rebuild')",
+        
+        """CREATE VIRTUAL TABLE IF NOT EXISTS contexto_fts USING fts5(
+               context_key, context_value, content='contexto_usuario', content_rowid='id',
+               tokenize='unicode61 remove_diacritics 2')""",
+        """CREATE TRIGGER IF NOT EXISTS contexto_fts_ai AFTER INSERT ON contexto_usuario BEGIN
+               INSERT INTO contexto_fts (rowid, context_key, context_value)
+               VALUES (new.id, new.context_key, new.context_value);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS contexto_fts_ad AFTER DELETE ON contexto_usuario BEGIN
+               INSERT INTO contexto_fts (contexto_fts, rowid, context_key, context_value)
+               VALUES ('delete', old.id, old.context_key, old.context_value);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS contexto_fts_au AFTER UPDATE OF context_key, context_value ON contexto_usuario BEGIN
+               INSERT INTO contexto_fts (contexto_fts, rowid, context_key, context_value)
+               VALUES ('delete', old.id, old.context_key, old.context_value);
+               INSERT INTO contexto_fts (rowid, context_key, context_value)
+               VALUES (new.id, new.context_key, new.context_value);
+           END""",
+        "INSERT INTO contexto_fts (contexto_fts) VALUES ('rebuild')",
+    ]),
+    (5, "Fragmentos de documentos con vectores para búsqueda semántica", [
+        """CREATE TABLE IF NOT EXISTS contexto_chunks (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               user_id INTEGER NOT NULL,
+               file_id TEXT NOT NULL,
+               chunk_index INTEGER NOT NULL,
+               page INTEGER,
+               content TEXT NOT NULL,
+               embedding BLOB NOT NULL,
+               created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+               FOREIGN KEY (user_id) REFERENCES usuarios (id),
+               FOREIGN KEY (file_id) REFERENCES archivos (id)
+           )""",
+        "CREATE INDEX IF NOT EXISTS idx_chunks_user ON contexto_chunks (user_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_chunks_file ON contexto_chunks (file_id, chunk_index)",
+    ]),
+    (6, "Resumen acumulado de los turnos antiguos de cada chat", [
+        """CREATE TABLE IF NOT EXISTS chat_summaries (
+               chat_id TEXT PRIMARY KEY,
+               covered_count INTEGER NOT NULL,
+               summary TEXT NOT NULL,
+               updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+               FOREIGN KEY (chat_id) REFERENCES chats (id)
+           )""",
+    ]),
+    (7, "Caché de respuestas del modelo direccionada por contenido", [
+        """CREATE TABLE IF NOT EXISTS llm_cache (
+               key TEXT PRIMARY KEY,
+               model TEXT,
+               response TEXT NOT NULL,
+               created_at REAL NOT NULL,
+               last_access REAL NOT NULL,
+               hits INTEGER DEFAULT 0
+           )""",
+        "CREATE INDEX IF NOT EXISTS idx_llm_cache_access ON llm_cache (last_access)",
+    ]),
+    (8, "Almacén de archivos direccionado por contenido con caché de extracción", [
+        """CREATE TABLE IF NOT EXISTS blobs (
+               hash TEXT PRIMARY KEY,
+               size INTEGER NOT NULL,
+               path TEXT NOT NULL,
+               refcount INTEGER NOT NULL DEFAULT 0,
+               file_type TEXT,
+               content_extracted TEXT,
+               analysis_summary TEXT,
+               extracted_at TIMESTAMP,
+               created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+           )""",
+        "ALTER TABLE archivos ADD COLUMN content_hash TEXT",
+        "CREATE INDEX IF NOT EXISTS idx_archivos_hash ON archivos (content_hash)",
+    ]),
+    (9, "Cola de trabajos de ingesta de archivos en segundo plano", [
+        """CREATE TABLE IF NOT EXISTS ingestion_jobs (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               user_id INTEGER NOT NULL,
+               filename TEXT NOT NULL,
+               content_hash TEXT NOT NULL,
+               file_size INTEGER,
+               status TEXT NOT NULL DEFAULT 'pending',
+               attempts INTEGER NOT NULL DEFAULT 0,
+               max_attempts INTEGER NOT NULL DEFAULT 3,
+               progress REAL NOT NULL DEFAULT 0,
+               message TEXT,
+               error TEXT,
+               file_id TEXT,
+               run_after REAL NOT NULL DEFAULT 0,
+               created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+               updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+               FOREIGN KEY (user_id) REFERENCES usuarios (id)
+           )""",
+        "CREATE INDEX IF NOT EXISTS idx_jobs_status ON ingestion_jobs (status, run_after, id)",
+        "CREATE INDEX IF NOT EXISTS idx_jobs_user ON ingestion_jobs (user_id, id DESC)",
+    ]),
+    (10, "Archivos de la carpeta de documentos de cada usuario ya ingeridos", [
+        """CREATE TABLE IF NOT EXISTS source_files (
+               user_id INTEGER NOT NULL,
+               path TEXT NOT NULL,
+               mtime REAL NOT NULL,
+               size INTEGER NOT NULL,
+               content_hash TEXT NOT NULL,
+               file_id TEXT,
+               indexed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+               PRIMARY KEY (user_id, path),
+               FOREIGN KEY (user_id) REFERENCES usuarios (id)
+           )""",
+    ]),
+    (11, "Sesiones JWT activas (antes en active_tokens.json)", [
+        """CREATE TABLE IF NOT EXISTS token_sessions (
+               username TEXT NOT NULL,
+               device_id TEXT NOT NULL,
+               token TEXT NOT NULL,
+               jti TEXT,
+               created_at REAL NOT NULL,
+               expires_at REAL NOT NULL,
+               PRIMARY KEY (username, device_id)
+           )""",
+        "CREATE INDEX IF NOT EXISTS idx_token_sessions_expiry ON token_sessions (expires_at)",
+        _import_legacy_tokens,
+    ]),
+    (12, "Índice único parcial de UID NFC para el acceso con tarjeta", [
+        "UPDATE usuarios SET nfc_uid = NULL WHERE TRIM(nfc_uid) = ''",
+        # Una tarjeta repetida se queda con el usuario más antiguo
+        """UPDATE usuarios SET nfc_uid = NULL
+           WHERE nfc_uid IS NOT NULL
+             AND id NOT IN (SELECT MIN(id) FROM usuarios WHERE nfc_uid IS NOT NULL GROUP BY nfc_uid)""",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_usuarios_nfc_uid ON usuarios (nfc_uid) WHERE nfc_uid IS NOT NULL",
+    ]),
+    (13, "Usuarios de usuarios.json importados a la tabla usuarios", [
+        _import_legacy_users,
+    ]),
+    (14, "Rowid estable para archivos_fts (el rowid implícito de archivos cambia con VACUUM)", [
+        "DROP TRIGGER IF EXISTS archivos_fts_ai",
+        "DROP TRIGGER IF EXISTS archivos_fts_ad",
+        "DROP TRIGGER IF EXISTS archivos_fts_au",
+        "DROP TABLE IF EXISTS archivos_fts",
+        "ALTER TABLE archivos ADD COLUMN fts_id INTEGER",
+        "UPDATE archivos SET fts_id = rowid",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_archivos_fts_id ON archivos (fts_id)",
+        """CREATE VIRTUAL TABLE IF NOT EXISTS archivos_fts USING fts5(
+               filename, content_extracted, content='archivos', content_rowid='fts_id',
+               tokenize='unicode61 remove_diacritics 2')""",
+        # fts_id se asigna al insertar y no vuelve a cambiar
+        """CREATE TRIGGER IF NOT EXISTS archivos_fts_ai AFTER INSERT ON archivos BEGIN
+               UPDATE archivos SET fts_id = (SELECT COALESCE(MAX(fts_id), 0) + 1 FROM archivos)
+               WHERE id = new.id AND fts_id IS NULL;
+               INSERT INTO archivos_fts (rowid, filename, content_extracted)
+               SELECT fts_id, new.filename, new.content_extracted FROM archivos WHERE id = new.id;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS archivos_fts_ad AFTER DELETE ON archivos BEGIN
+               INSERT INTO archivos_fts (archivos_fts, rowid, filename, content_extracted)
+               VALUES ('delete', old.fts_id, old.filename, old.content_extracted);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS archivos_fts_au AFTER UPDATE OF filename, content_extracted ON archivos BEGIN
+               INSERT INTO archivos_fts (archivos_fts, rowid, filename, content_extracted)
+               VALUES ('delete', old.fts_id, old.filename, old.content_extracted);
+               INSERT INTO archivos_fts (rowid, filename, content_extracted)
+               VALUES (new.fts_id, new.filename, new.content_extracted);
+           END""",
+        "INSERT INTO archivos_fts (archivos_fts) VALUES ('rebuild')",
+    ]),
+]
+
+# Título de un chat que aún no tiene mensajes del usuario
+DEFAULT_CHAT_TITLE = "Nuevo chat"
+
+# Estados de un trabajo de ingesta
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+# Fuentes que cubre search_context
+SEARCH_SOURCES = ("contexto", "archivos", "mensajes")
+
 class ZeroDatabase:
     def get_user_id_by_username(self, username: str) -> Optional[int]:
         """Obtiene el ID de usuario por nombre de usuario"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM usuarios WHERE username = ?", (username,))
-        result = cursor.fetchone()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id FROM usuarios WHERE username = ?", (username,))
+            result = cursor.fetchone()
         
         if result:
             return result[0]
         return None
 
-    def __init__(self, db_path: str = "zero.db"):
+    def __init__(self, db_path: str = "zero.db", pool_size: int = DB_POOL_SIZE,
+                 pool_timeout: float = DB_POOL_TIMEOUT, pragmas: Optional[Dict[str, Any]] = None,
+                 checkpoint_interval: float = DB_CHECKPOINT_INTERVAL):
         self.db_path = db_path
+        self.pool_size = max(1, pool_size)
+        self.pool_timeout = pool_timeout
+        self.pragmas = {**DEFAULT_PRAGMAS, **(pragmas or {})}
+        self.checkpoint_interval = checkpoint_interval
+        self._checkpoint_stop = threading.Event()
+        self._checkpoint_thread: Optional[threading.Thread] = None
+        # LIFO: se reutiliza primero la conexión usada más recientemente
+        self._pool = queue.LifoQueue(maxsize=self.pool_size)
+        self._pool_lock = threading.Lock()
+        self._open_connections = 0
+        # Conexión prestada y profundidad de transacción del hilo actual
+        self._local = threading.local()
         self.init_database()
+        if self.checkpoint_interval > 0:
+            self.start_checkpoint_task()
     
     def init_database(self):
         """Inicializa la base de datos con todas las tablas necesarias"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Tabla de usuarios
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS usuarios (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                rol TEXT NOT NULL DEFAULT 'usuario',
-                nfc_uid TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_login TIMESTAMP
-            )
-        """)
-        
-        # Tabla de chats
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS chats (
-                id TEXT PRIMARY KEY,
-                user_id INTEGER NOT NULL,
-                title TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES usuarios (id)
-            )
-        """)
-        
-        # Tabla de mensajes
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS mensajes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chat_id TEXT NOT NULL,
-                role TEXT NOT NULL,
-                content TEXT NOT NULL,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                metadata TEXT,
-                FOREIGN KEY (chat_id) REFERENCES chats (id)
-            )
-        """)
-        
-        # Tabla de archivos subidos
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS archivos (
-                id TEXT PRIMARY KEY,
-                user_id INTEGER NOT NULL,
-                filename TEXT NOT NULL,
-                file_type TEXT NOT NULL,
-                file_size INTEGER,
-                file_path TEXT NOT NULL,
-                content_extracted TEXT,
-                analysis_summary TEXT,
-                uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES usuarios (id)
-            )
-        """)
-        
-        # Tabla de análisis de imágenes
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS analisis_imagenes (
-                id TEXT PRIMARY KEY,
-                user_id INTEGER NOT NULL,
-                archivo_id TEXT,
-                image_path TEXT NOT NULL,
-                analysis_result TEXT NOT NULL,
-                model_used TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES usuarios (id),
-                FOREIGN KEY (archivo_id) REFERENCES archivos (id)
-            )
-        """)
-        
-        # Tabla de contexto personalizado por usuario
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS contexto_usuario (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                context_key TEXT NOT NULL,
-                context_value TEXT NOT NULL,
-                source_file_id TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES usuarios (id),
-                FOREIGN KEY (source_file_id) REFERENCES archivos (id)
-            )
-        """)
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            
+            # Tabla de usuarios
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS usuarios (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT UNIQUE NOT NULL,
+                    password_hash TEXT NOT NULL,
+                    rol TEXT NOT NULL DEFAULT 'usuario',
+                    nfc_uid TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    last_login TIMESTAMP
+                )
+            """)
+        
+            # Tabla de chats
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS chats (
+                    id TEXT PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    title TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES usuarios (id)
+                )
+            """)
+        
+            # Tabla de mensajes
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS mensajes (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    chat_id TEXT NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    metadata TEXT,
+                    FOREIGN KEY (chat_id) REFERENCES chats (id)
+                )
+            """)
+        
+            # Tabla de archivos subidos
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS archivos (
+                    id TEXT PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    filename TEXT NOT NULL,
+                    file_type TEXT NOT NULL,
+                    file_size INTEGER,
+                    file_path TEXT NOT NULL,
+                    content_extracted TEXT,
+                    analysis_summary TEXT,
+                    uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES usuarios (id)
+                )
+            """)
+        
+            # Tabla de análisis de imágenes
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS analisis_imagenes (
+                    id TEXT PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    archivo_id TEXT,
+                    image_path TEXT NOT NULL,
+                    analysis_result TEXT NOT NULL,
+                    model_used TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES usuarios (id),
+                    FOREIGN KEY (archivo_id) REFERENCES archivos (id)
+                )
+            """)
+        
+            # Tabla de contexto personalizado por usuario
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS contexto_usuario (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    context_key TEXT NOT NULL,
+                    context_value TEXT NOT NULL,
+                    source_file_id TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES usuarios (id),
+                    FOREIGN KEY (source_file_id) REFERENCES archivos (id)
+                )
+            """)
+            
+            # Control de versiones del esquema
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+        
+        self.migrate()
+    
+    # === MIGRACIONES ===
+    def get_schema_version(self) -> int:
+        """Devuelve la última versión de esquema aplicada (0 si ninguna)"""
+        with self.connection() as conn:
+            row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+        return row[0] or 0
+    
+    def migrate(self, target_version: Optional[int] = None) -> List[int]:
+        """Aplica en orden las migraciones pendientes y devuelve las versiones aplicadas"""
+        applied = []
+        for version, description, steps in sorted(MIGRATIONS, key=lambda m: m[0]):
+            if target_version is not None and version > target_version:
+                break
+            # Cada migración va en su propia transacción; la versión se vuelve
+            # a comprobar dentro por si otro proceso la aplicó en paralelo.
+            with self.transaction() as conn:
+                done = conn.execute(
+                    "SELECT 1 FROM schema_version WHERE version = ?", (version,)
+                ).fetchone()
+                if done:
+                    continue
+                for step in steps:
+                    if callable(step):
+                        step(conn)
+                    else:
+                        conn.execute(step)
+                conn.execute(
+                    "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                    (version, description)
+                )
+            applied.append(version)
+        
+        if applied:
+            with self.connection() as conn:
+                conn.execute("PRAGMA optimize")
+        return applied
+    
+    # === POOL DE CONEXIONES ===
+    def get_connection(self) -> sqlite3.Connection:
+        """Abre una conexión nueva a la base de datos (usada por el pool)"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.pool_timeout,
+            check_same_thread=False,
+            cached_statements=DB_STATEMENT_CACHE_SIZE,
+        )
+        # Autocommit: las transacciones se abren explícitamente en transaction()
+        conn.isolation_level = None
+        self._apply_pragmas(conn)
+        return conn
+    
+    def _apply_pragmas(self, conn: sqlite3.Connection):
+        """Aplica el perfil de PRAGMAs a una conexión recién abierta"""
+        for name, value in self.pragmas.items():
+            if value is None:
+                continue
+            conn.execute(f"PRAGMA {name} = {value}")
+    
+    @staticmethod
+    def _is_healthy(conn: sqlite3.Connection) -> bool:
+        """Comprueba que una conexión del pool sigue siendo utilizable"""
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+    
+    def _discard(self, conn: sqlite3.Connection):
+        """Cierra una conexión y libera su hueco en el pool"""
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._pool_lock:
+            self._open_connections -= 1
+    
+    def _acquire(self) -> sqlite3.Connection:
+        """Toma una conexión sana del pool o abre una nueva si hay hueco"""
+        while True:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                with self._pool_lock:
+                    can_open = self._open_connections < self.pool_size
+                    if can_open:
+                        self._open_connections += 1
+                if can_open:
+                    try:
+                        return self.get_connection()
+                    except sqlite3.Error:
+                        with self._pool_lock:
+                            self._open_connections -= 1
+                        raise
+                try:
+                    conn = self._pool.get(timeout=self.pool_timeout)
+                except queue.Empty:
+                    raise sqlite3.OperationalError(
+                        f"No hay conexiones libres en el pool tras {self.pool_timeout}s"
+                    )
+            
+            if self._is_healthy(conn):
+                return conn
+            self._discard(conn)
+    
+    def _release(self, conn: sqlite3.Connection):
+        """Devuelve una conexión al pool dejando su estado limpio"""
+        if conn.in_transaction:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                self._discard(conn)
+                return
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            self._discard(conn)
+    
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Presta una conexión del pool; las llamadas anidadas del mismo hilo la reutilizan"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            yield conn
+            return
+        
+        conn = self._acquire()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._release(conn)
+    
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Ejecuta el bloque en una transacción; se confirma al salir o se revierte si hay error"""
+        with self.connection() as conn:
+            depth = getattr(self._local, "tx_depth", 0)
+            if depth:
+                # Transacción anidada: se une a la exterior
+                self._local.tx_depth = depth + 1
+                try:
+                    yield conn
+                finally:
+                    self._local.tx_depth = depth
+                return
+            
+            conn.execute("BEGIN IMMEDIATE")
+            self._local.tx_depth = 1
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                self._local.tx_depth = 0
+    
+    # === MANTENIMIENTO DEL WAL ===
+    def checkpoint(self, mode: str = "PASSIVE") -> Optional[tuple]:
+        """Vuelca el WAL al archivo principal; devuelve (busy, log, checkpointed)"""
+        if mode.upper() not in ("PASSIVE", "FULL", "RESTART", "TRUNCATE"):
+            raise ValueError(f"Modo de checkpoint no válido: {mode}")
+        with self.connection() as conn:
+            return conn.execute(f"PRAGMA wal_checkpoint({mode.upper()})").fetchone()
+    
+    def _checkpoint_loop(self):
+        while not self._checkpoint_stop.wait(self.checkpoint_interval):
+            try:
+                self.checkpoint()
+            except sqlite3.Error as e:
+                print(f"Error en checkpoint del WAL: {e}")
+    
+    def start_checkpoint_task(self):
+        """Arranca el hilo que hace checkpoints periódicos del WAL"""
+        if self._checkpoint_thread and self._checkpoint_thread.is_alive():
+            return
+        self._checkpoint_stop.clear()
+        self._checkpoint_thread = threading.Thread(
+            target=self._checkpoint_loop, name="zero-db-checkpoint", daemon=True
+        )
+        self._checkpoint_thread.start()
+    
+    def stop_checkpoint_task(self):
+        """Detiene el hilo de checkpoints"""
+        self._checkpoint_stop.set()
+        if self._checkpoint_thread:
+            self._checkpoint_thread.join(timeout=5)
+            self._checkpoint_thread = None
+    
+    @contextmanager
+    def batch(self) -> Iterator["ZeroDatabase"]:
+        """Unidad de trabajo: todas las escrituras del bloque comparten una transacción.
+        
+            with db.batch():
+                db.add_message(...)
+                db.save_user_context(...)
         
-        conn.commit()
-        conn.close()
+        Los métodos llamados dentro se unen a la transacción, así que hay un
+        único commit (y un único fsync) al salir del bloque.
+        """
+        with self.transaction():
+            yield self
     
-    def get_connection(self):
-        """Obtiene una conexión a la base de datos"""
-        return sqlite3.connect(self.db_path)
+    def close(self):
+        """Detiene el mantenimiento y cierra todas las conexiones inactivas del pool"""
+        self.stop_checkpoint_task()
+        while True:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
     
     # === MÉTODOS PARA USUARIOS ===
     def create_user(self, username: str, password_hash: str, rol: str = "usuario", nfc_uid: str = None) -> bool:
         """Crea un nuevo usuario"""
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO usuarios (username, password_hash, rol, nfc_uid) VALUES (?, ?, ?, ?)",
-                (username, password_hash, rol, nfc_uid)
-            )
-            conn.commit()
-            conn.close()
+            with self.transaction() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "INSERT INTO usuarios (username, password_hash, rol, nfc_uid) VALUES (?, ?, ?, ?)",
+                    (username, password_hash, rol, nfc_uid)
+                )
             return True
         except sqlite3.IntegrityError:
             return False
     
+    _USER_COLUMNS = "id, username, password_hash, rol, nfc_uid, created_at, last_login"
+    
+    @staticmethod
+    def _user_from_row(row) -> Dict:
+        return {
+            'id': row[0],
+            'username': row[1],
+            'password_hash': row[2],
+            'rol': row[3],
+            'nfc_uid': row[4],
+            'created_at': row[5],
+            'last_login': row[6]
+        }
+    
     def get_user_by_username(self, username: str) -> Optional[Dict]:
         """Obtiene un usuario por nombre de usuario"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM usuarios WHERE username = ?", (username,))
-        row = cursor.fetchone()
-        conn.close()
-        
-        if row:
-            return {
-                'id': row[0],
-                'username': row[1],
-                'password_hash': row[2],
-                'rol': row[3],
-                'nfc_uid': row[4],
-                'created_at': row[5],
-                'last_login': row[6]
-            }
-        return None
+        with self.connection() as conn:
+            row = conn.execute(
+                f"SELECT {self._USER_COLUMNS} FROM usuarios WHERE username = ?", (username,)
+            ).fetchone()
+        return self._user_from_row(row) if row else None
+    
+    def get_user_by_nfc_uid(self, nfc_uid: str) -> Optional[Dict]:
+        """Obtiene el usuario de una tarjeta NFC (índice único parcial)"""
+        with self.connection() as conn:
+            row = conn.execute(
+                f"SELECT {self._USER_COLUMNS} FROM usuarios WHERE nfc_uid = ?", (nfc_uid,)
+            ).fetchone()
+        return self._user_from_row(row) if row else None
+    
+    def import_users_json(self, path: str = LEGACY_USERS_FILE) -> Dict[str, int]:
+        """Importa (o vuelve a sincronizar) los usuarios de un archivo JSON; devuelve los conteos"""
+        with self.transaction() as conn:
+            return _import_users(conn, path)
+    
+    def count_users(self) -> int:
+        """Número de usuarios registrados"""
+        with self.connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM usuarios").fetchone()[0]
     
     def update_last_login(self, user_id: int):
         """Actualiza la última fecha de login"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE usuarios SET last_login = CURRENT_TIMESTAMP WHERE id = ?",
-            (user_id,)
-        )
-        conn.commit()
-        conn.close()
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE usuarios SET last_login = CURRENT_TIMESTAMP WHERE id = ?",
+                (user_id,)
+            )
     
     # === MÉTODOS PARA CHATS ===
-    def create_chat(self, user_id: int, title: str = "Nuevo chat") -> str:
+    def create_chat(self, user_id: int, title: str = DEFAULT_CHAT_TITLE) -> str:
         """Crea un nuevo chat"""
         chat_id = str(uuid.uuid4())
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO chats (id, user_id, title) VALUES (?, ?, ?)",
-            (chat_id, user_id, title)
-        )
-        conn.commit()
-        conn.close()
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "INSERT INTO chats (id, user_id, title) VALUES (?, ?, ?)",
+                (chat_id, user_id, title)
+            )
         return chat_id
     
-    def get_user_chats(self, user_id: int) -> List[Dict]:
-        """Obtiene todos los chats de un usuario"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT * FROM chats WHERE user_id = ? ORDER BY updated_at DESC",
-            (user_id,)
-        )
-        rows = cursor.fetchall()
-        conn.close()
+    def get_user_chats(self, user_id: int, limit: Optional[int] = None,
+                       before_updated_at: Optional[str] = None, before_id: Optional[str] = None) -> List[Dict]:
+        """Obtiene los chats de un usuario, del más reciente al más antiguo.
+        
+        Con `limit` devuelve una sola página. Para la siguiente se pasan el
+        `updated_at` y el `id` del último chat recibido (paginación por cursor).
+        """
+        query = "SELECT * FROM chats WHERE user_id = ?"
+        params: List[Any] = [user_id]
+        if before_updated_at is not None:
+            if before_id is not None:
+                query += " AND (updated_at, id) < (?, ?)"
+                params += [before_updated_at, before_id]
+            else:
+                query += " AND updated_at < ?"
+                params.append(before_updated_at)
+        query += " ORDER BY updated_at DESC, id DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
         
         chats = []
         for row in rows:
@@ -196,53 +814,130 @@ class ZeroDatabase:
                 'user_id': row[1],
                 'title': row[2],
                 'created_at': row[3],
-                'updated_at': row[4]
+                'updated_at': row[4],
+                'message_count': row[5]
             })
         return chats
     
+    def get_chat(self, chat_id: str) -> Optional[Dict]:
+        """Obtiene un chat por ID"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM chats WHERE id = ?", (chat_id,))
+            row = cursor.fetchone()
+        
+        if row:
+            return {
+                'id': row[0],
+                'user_id': row[1],
+                'title': row[2],
+                'created_at': row[3],
+                'updated_at': row[4],
+                'message_count': row[5]
+            }
+        return None
+    
     def update_chat_title(self, chat_id: str, title: str):
         """Actualiza el título de un chat"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE chats SET title = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
-            (title, chat_id)
-        )
-        conn.commit()
-        conn.close()
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE chats SET title = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                (title, chat_id)
+            )
     
     # === MÉTODOS PARA MENSAJES ===
     def add_message(self, chat_id: str, role: str, content: str, metadata: Dict = None):
         """Añade un mensaje a un chat"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Actualizar timestamp del chat
-        cursor.execute(
-            "UPDATE chats SET updated_at = CURRENT_TIMESTAMP WHERE id = ?",
-            (chat_id,)
-        )
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            
+            # Actualizar timestamp y marca de agua del chat
+            cursor.execute(
+                "UPDATE chats SET updated_at = CURRENT_TIMESTAMP, message_count = message_count + 1 WHERE id = ?",
+                (chat_id,)
+            )
+            
+            # Insertar mensaje
+            metadata_json = json.dumps(metadata) if metadata else None
+            cursor.execute(
+                "INSERT INTO mensajes (chat_id, role, content, metadata) VALUES (?, ?, ?, ?)",
+                (chat_id, role, content, metadata_json)
+            )
+    
+    def append_chat_messages(self, chat_id: str, user_id: int, title: str,
+                             messages: List[Dict], offset: int = 0) -> int:
+        """Crea o actualiza el chat y guarda solo los mensajes aún no persistidos.
         
-        # Insertar mensaje
-        metadata_json = json.dumps(metadata) if metadata else None
-        cursor.execute(
-            "INSERT INTO mensajes (chat_id, role, content, metadata) VALUES (?, ?, ?, ?)",
-            (chat_id, role, content, metadata_json)
-        )
+        `messages` es la conversación en memoria y `offset` el número de mensajes
+        anteriores que no están cargados en ella. La marca de agua del chat
+        (message_count) indica cuántos ya están en la base de datos, así que
+        llamar varias veces con la misma conversación no duplica filas.
+        """
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            # El título se fija al crear el chat; después solo reemplaza al provisional
+            cursor.execute(
+                """INSERT INTO chats (id, user_id, title) VALUES (?, ?, ?)
+                   ON CONFLICT(id) DO UPDATE SET title = excluded.title
+                   WHERE chats.title = ? AND excluded.title != ?""",
+                (chat_id, user_id, title, DEFAULT_CHAT_TITLE, DEFAULT_CHAT_TITLE)
+            )
+            cursor.execute("SELECT message_count FROM chats WHERE id = ?", (chat_id,))
+            persisted = cursor.fetchone()[0]
+            
+            new_messages = messages[max(persisted - offset, 0):]
+            return self.add_messages_bulk(chat_id, new_messages)
+    
+    def add_messages_bulk(self, chat_id: str, messages: List[Dict]) -> int:
+        """Añade varios mensajes a un chat con un solo executemany y un solo commit"""
+        if not messages:
+            return 0
         
-        conn.commit()
-        conn.close()
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.executemany(
+                "INSERT INTO mensajes (chat_id, role, content, metadata) VALUES (?, ?, ?, ?)",
+                [
+                    (chat_id, msg['role'], msg['content'],
+                     json.dumps(msg['metadata']) if msg.get('metadata') else None)
+                    for msg in messages
+                ]
+            )
+            cursor.execute(
+                """UPDATE chats SET updated_at = CURRENT_TIMESTAMP,
+                   message_count = message_count + ? WHERE id = ?""",
+                (len(messages), chat_id)
+            )
+        return len(messages)
     
-    def get_chat_messages(self, chat_id: str) -> List[Dict]:
-        """Obtiene todos los mensajes de un chat"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT * FROM mensajes WHERE chat_id = ? ORDER BY timestamp ASC",
-            (chat_id,)
-        )
-        rows = cursor.fetchall()
-        conn.close()
+    def get_chat_messages(self, chat_id: str, limit: Optional[int] = None,
+                          before_id: Optional[int] = None) -> List[Dict]:
+        """Obtiene los mensajes de un chat en orden cronológico.
+        
+        Con `limit` devuelve solo los `limit` mensajes más recientes anteriores
+        a `before_id` (o al final del chat), para cargar el historial por páginas.
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            if limit is None and before_id is None:
+                cursor.execute(
+                    "SELECT * FROM mensajes WHERE chat_id = ? ORDER BY timestamp ASC, id ASC",
+                    (chat_id,)
+                )
+                rows = cursor.fetchall()
+            else:
+                query = "SELECT * FROM mensajes WHERE chat_id = ?"
+                params: List[Any] = [chat_id]
+                if before_id is not None:
+                    query += " AND id < ?"
+                    params.append(before_id)
+                query += " ORDER BY id DESC"
+                if limit is not None:
+                    query += " LIMIT ?"
+                    params.append(limit)
+                cursor.execute(query, params)
+                rows = cursor.fetchall()[::-1]
         
         messages = []
         for row in rows:
@@ -257,33 +952,109 @@ class ZeroDatabase:
             })
         return messages
     
+    # === RESUMEN DE HISTORIAL ===
+    def get_chat_summary(self, chat_id: str) -> Optional[Dict]:
+        """Obtiene el resumen acumulado de un chat y cuántos mensajes cubre"""
+        with self.connection() as conn:
+            row = conn.execute(
+                "SELECT covered_count, summary, updated_at FROM chat_summaries WHERE chat_id = ?",
+                (chat_id,)
+            ).fetchone()
+        
+        if row:
+            return {
+                'chat_id': chat_id,
+                'covered_count': row[0],
+                'summary': row[1],
+                'updated_at': row[2]
+            }
+        return None
+    
+    def save_chat_summary(self, chat_id: str, covered_count: int, summary: str):
+        """Guarda el resumen de los primeros `covered_count` mensajes de un chat"""
+        with self.transaction() as conn:
+            conn.execute(
+                """INSERT INTO chat_summaries (chat_id, covered_count, summary) VALUES (?, ?, ?)
+                   ON CONFLICT(chat_id) DO UPDATE SET covered_count = excluded.covered_count,
+                   summary = excluded.summary, updated_at = CURRENT_TIMESTAMP""",
+                (chat_id, covered_count, summary)
+            )
+    
+    # === CACHÉ DE RESPUESTAS DEL MODELO ===
+    def get_cached_response(self, key: str, min_created_at: float) -> Optional[str]:
+        """Devuelve una respuesta cacheada no caducada (solo lectura; el acceso se anota con touch_cached_responses)"""
+        with self.connection() as conn:
+            row = conn.execute(
+                "SELECT response FROM llm_cache WHERE key = ? AND created_at >= ?",
+                (key, min_created_at)
+            ).fetchone()
+        return row[0] if row else None
+    
+    def touch_cached_responses(self, hits: Dict[str, int], accessed_at: float):
+        """Anota en bloque el último acceso (LRU) y los aciertos de varias respuestas cacheadas"""
+        if not hits:
+            return
+        with self.transaction() as conn:
+            conn.executemany(
+                "UPDATE llm_cache SET last_access = ?, hits = hits + ? WHERE key = ?",
+                [(accessed_at, count, key) for key, count in hits.items()]
+            )
+    
+    def save_cached_response(self, key: str, model: str, response: str):
+        """Guarda (o reemplaza) una respuesta en la caché"""
+        now = time.time()
+        with self.transaction() as conn:
+            conn.execute(
+                """INSERT OR REPLACE INTO llm_cache (key, model, response, created_at, last_access, hits)
+                   VALUES (?, ?, ?, ?, ?, 0)""",
+                (key, model, response, now, now)
+            )
+    
+    def evict_cached_responses(self, max_entries: int, expired_before: float) -> int:
+        """Elimina las respuestas caducadas y las menos usadas recientemente por encima de `max_entries`"""
+        with self.transaction() as conn:
+            removed = conn.execute(
+                "DELETE FROM llm_cache WHERE created_at < ?", (expired_before,)
+            ).rowcount
+            removed += conn.execute(
+                """DELETE FROM llm_cache WHERE key IN (
+                       SELECT key FROM llm_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                   )""",
+                (max_entries,)
+            ).rowcount
+        return removed
+    
     # === MÉTODOS PARA ARCHIVOS ===
     def save_file(self, user_id: int, filename: str, file_type: str, file_size: int, 
-                  file_path: str, content_extracted: str = None, analysis_summary: str = None) -> str:
-        """Guarda información de un archivo subido"""
+                  file_path: str, content_extracted: str = None, analysis_summary: str = None,
+                  content_hash: str = None) -> str:
+        """Guarda información de un archivo subido (y suma una referencia a su blob)"""
         file_id = str(uuid.uuid4())
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            """INSERT INTO archivos (id, user_id, filename, file_type, file_size, 
-               file_path, content_extracted, analysis_summary) 
-               VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
-            (file_id, user_id, filename, file_type, file_size, file_path, content_extracted, analysis_summary)
-        )
-        conn.commit()
-        conn.close()
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """INSERT INTO archivos (id, user_id, filename, file_type, file_size, 
+                   file_path, content_extracted, analysis_summary, content_hash) 
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (file_id, user_id, filename, file_type, file_size, file_path, content_extracted,
+                 analysis_summary, content_hash)
+            )
+            if content_hash:
+                cursor.execute("UPDATE blobs SET refcount = refcount + 1 WHERE hash = ?", (content_hash,))
+                if cursor.rowcount == 0:
+                    # Sin blob registrado el archivo apuntaría a un contenido que puede no existir
+                    raise ValueError(f"El blob {content_hash} no está registrado")
         return file_id
     
     def get_user_files(self, user_id: int) -> List[Dict]:
         """Obtiene todos los archivos de un usuario"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT * FROM archivos WHERE user_id = ? ORDER BY uploaded_at DESC",
-            (user_id,)
-        )
-        rows = cursor.fetchall()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT * FROM archivos WHERE user_id = ? ORDER BY uploaded_at DESC",
+                (user_id,)
+            )
+            rows = cursor.fetchall()
         
         files = []
         for row in rows:
@@ -296,17 +1067,17 @@ class ZeroDatabase:
                 'file_path': row[5],
                 'content_extracted': row[6],
                 'analysis_summary': row[7],
-                'uploaded_at': row[8]
+                'uploaded_at': row[8],
+                'content_hash': row[9]
             })
         return files
     
     def get_file_by_id(self, file_id: str) -> Optional[Dict]:
         """Obtiene un archivo por ID"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM archivos WHERE id = ?", (file_id,))
-        row = cursor.fetchone()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM archivos WHERE id = ?", (file_id,))
+            row = cursor.fetchone()
         
         if row:
             return {
@@ -318,36 +1089,335 @@ class ZeroDatabase:
                 'file_path': row[5],
                 'content_extracted': row[6],
                 'analysis_summary': row[7],
-                'uploaded_at': row[8]
+                'uploaded_at': row[8],
+                'content_hash': row[9]
+            }
+        return None
+    
+    # === BLOBS DIRECCIONADOS POR CONTENIDO ===
+    def register_blob(self, content_hash: str, size: int, path: str) -> Dict:
+        """Registra un blob si no existía y devuelve su fila (con la extracción cacheada, si hay)"""
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO blobs (hash, size, path) VALUES (?, ?, ?)",
+                (content_hash, size, path)
+            )
+            return self.get_blob(content_hash)
+    
+    def get_blob(self, content_hash: str) -> Optional[Dict]:
+        """Obtiene un blob por su hash"""
+        with self.connection() as conn:
+            row = conn.execute(
+                """SELECT hash, size, path, refcount, file_type, content_extracted,
+                          analysis_summary, extracted_at
+                   FROM blobs WHERE hash = ?""",
+                (content_hash,)
+            ).fetchone()
+        
+        if row:
+            return {
+                'hash': row[0],
+                'size': row[1],
+                'path': row[2],
+                'refcount': row[3],
+                'file_type': row[4],
+                'content_extracted': row[5],
+                'analysis_summary': row[6],
+                'extracted_at': row[7]
             }
         return None
     
+    def save_blob_extraction(self, content_hash: str, file_type: str, content_extracted: Optional[str],
+                             analysis_summary: Optional[str]):
+        """Cachea el resultado de FileProcessor para un contenido"""
+        with self.transaction() as conn:
+            conn.execute(
+                """UPDATE blobs SET file_type = ?, content_extracted = ?, analysis_summary = ?,
+                   extracted_at = CURRENT_TIMESTAMP WHERE hash = ?""",
+                (file_type, content_extracted, analysis_summary, content_hash)
+            )
+    
+    def delete_unreferenced_blob(self, content_hash: str) -> Optional[str]:
+        """Borra el registro de un blob sin referencias; devuelve su ruta para eliminarla del disco"""
+        with self.transaction() as conn:
+            # Un blob en cola de ingesta todavía se va a usar
+            row = conn.execute(
+                """SELECT path FROM blobs WHERE hash = ? AND refcount <= 0
+                   AND NOT EXISTS (SELECT 1 FROM ingestion_jobs
+                                   WHERE content_hash = blobs.hash AND status IN (?, ?))""",
+                (content_hash, JOB_PENDING, JOB_RUNNING)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("DELETE FROM blobs WHERE hash = ?", (content_hash,))
+        return row[0]
+    
+    def find_indexed_file_by_hash(self, content_hash: str) -> Optional[str]:
+        """ID de algún archivo con ese contenido que ya tenga fragmentos vectorizados"""
+        with self.connection() as conn:
+            row = conn.execute(
+                """SELECT a.id FROM archivos a
+                   WHERE a.content_hash = ?
+                     AND EXISTS (SELECT 1 FROM contexto_chunks c WHERE c.file_id = a.id)
+                   LIMIT 1""",
+                (content_hash,)
+            ).fetchone()
+        return row[0] if row else None
+    
+    # === COLA DE INGESTA ===
+    _JOB_COLUMNS = """id, user_id, filename, content_hash, file_size, status, attempts, max_attempts,
+                      progress, message, error, file_id, created_at, updated_at"""
+    
+    @staticmethod
+    def _job_from_row(row) -> Dict:
+        return {
+            'id': row[0],
+            'user_id': row[1],
+            'filename': row[2],
+            'content_hash': row[3],
+            'file_size': row[4],
+            'status': row[5],
+            'attempts': row[6],
+            'max_attempts': row[7],
+            'progress': row[8],
+            'message': row[9],
+            'error': row[10],
+            'file_id': row[11],
+            'created_at': row[12],
+            'updated_at': row[13]
+        }
+    
+    def enqueue_ingestion_job(self, user_id: int, filename: str, content_hash: str,
+                              file_size: int, max_attempts: int = 3) -> int:
+        """Encola la ingesta de un blob ya guardado; devuelve el id del trabajo"""
+        with self.transaction() as conn:
+            return conn.execute(
+                """INSERT INTO ingestion_jobs (user_id, filename, content_hash, file_size, max_attempts, message)
+                   VALUES (?, ?, ?, ?, ?, 'En cola')""",
+                (user_id, filename, content_hash, file_size, max_attempts)
+            ).lastrowid
+    
+    def claim_ingestion_job(self) -> Optional[Dict]:
+        """Toma el trabajo pendiente más antiguo y lo marca en curso (atómico entre hilos y procesos)"""
+        with self.transaction() as conn:
+            row = conn.execute(
+                f"""SELECT {self._JOB_COLUMNS} FROM ingestion_jobs
+                    WHERE status = ? AND run_after <= ? ORDER BY id LIMIT 1""",
+                (JOB_PENDING, time.time())
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                """UPDATE ingestion_jobs SET status = ?, attempts = attempts + 1, error = NULL,
+                   updated_at = CURRENT_TIMESTAMP WHERE id = ?""",
+                (JOB_RUNNING, row[0])
+            )
+        job = self._job_from_row(row)
+        job['status'] = JOB_RUNNING
+        job['attempts'] += 1
+        return job
+    
+    def update_ingestion_progress(self, job_id: int, progress: float, message: str):
+        """Actualiza el avance (0-1) y el paso actual de un trabajo"""
+        with self.transaction() as conn:
+            conn.execute(
+                """UPDATE ingestion_jobs SET progress = ?, message = ?, updated_at = CURRENT_TIMESTAMP
+                   WHERE id = ?""",
+                (progress, message, job_id)
+            )
+    
+    def set_ingestion_job_file(self, job_id: int, file_id: str):
+        """Asocia al trabajo el archivo ya guardado (un reintento lo reutiliza)"""
+        with self.transaction() as conn:
+            conn.execute(
+                "UPDATE ingestion_jobs SET file_id = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                (file_id, job_id)
+            )
+    
+    def complete_ingestion_job(self, job_id: int, file_id: str):
+        """Marca un trabajo como terminado"""
+        with self.transaction() as conn:
+            conn.execute(
+                """UPDATE ingestion_jobs SET status = ?, progress = 1, message = 'Completado', file_id = ?,
+                   updated_at = CURRENT_TIMESTAMP WHERE id = ?""",
+                (JOB_DONE, file_id, job_id)
+            )
+    
+    def fail_ingestion_job(self, job_id: int, error: str, retry_delay: float, retry: bool = True) -> str:
+        """Registra un fallo: vuelve a la cola tras `retry_delay` segundos o queda fallido si agotó
+        los intentos (o si `retry` es False)"""
+        with self.transaction() as conn:
+            conn.execute(
+                """UPDATE ingestion_jobs
+                   SET status = CASE WHEN ? AND attempts < max_attempts THEN ? ELSE ? END,
+                       message = CASE WHEN ? AND attempts < max_attempts THEN 'Reintentando' ELSE 'Error' END,
+                       run_after = ?, error = ?, progress = 0, updated_at = CURRENT_TIMESTAMP
+                   WHERE id = ?""",
+                (retry, JOB_PENDING, JOB_FAILED, retry, time.time() + retry_delay, error, job_id)
+            )
+            return conn.execute("SELECT status FROM ingestion_jobs WHERE id = ?", (job_id,)).fetchone()[0]
+    
+    def requeue_running_ingestion_jobs(self) -> int:
+        """Devuelve a la cola los trabajos que quedaron en curso (proceso anterior interrumpido)"""
+        with self.transaction() as conn:
+            return conn.execute(
+                """UPDATE ingestion_jobs SET status = ?, message = 'En cola', updated_at = CURRENT_TIMESTAMP
+                   WHERE status = ?""",
+                (JOB_PENDING, JOB_RUNNING)
+            ).rowcount
+    
+    def get_ingestion_job(self, job_id: int) -> Optional[Dict]:
+        """Obtiene un trabajo de ingesta por ID"""
+        with self.connection() as conn:
+            row = conn.execute(
+                f"SELECT {self._JOB_COLUMNS} FROM ingestion_jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return self._job_from_row(row) if row else None
+    
+    def get_user_ingestion_jobs(self, user_id: int, limit: int = 10) -> List[Dict]:
+        """Últimos trabajos de ingesta de un usuario"""
+        with self.connection() as conn:
+            rows = conn.execute(
+                f"""SELECT {self._JOB_COLUMNS} FROM ingestion_jobs
+                    WHERE user_id = ? ORDER BY id DESC LIMIT ?""",
+                (user_id, limit)
+            ).fetchall()
+        return [self._job_from_row(row) for row in rows]
+    
+    # === CARPETAS DE DOCUMENTOS ===
+    def get_source_files(self, user_id: int) -> Dict[str, Dict]:
+        """Archivos de la carpeta del usuario ya ingeridos, por ruta relativa"""
+        with self.connection() as conn:
+            rows = conn.execute(
+                """SELECT s.path, s.mtime, s.size, s.content_hash, s.file_id, a.id IS NOT NULL
+                   FROM source_files s LEFT JOIN archivos a ON a.id = s.file_id
+                   WHERE s.user_id = ?""",
+                (user_id,)
+            ).fetchall()
+        
+        return {
+            row[0]: {
+                'path': row[0],
+                'mtime': row[1],
+                'size': row[2],
+                'content_hash': row[3],
+                'file_id': row[4],
+                'file_exists': bool(row[5])
+            }
+            for row in rows
+        }
+    
+    def save_source_file(self, user_id: int, path: str, mtime: float, size: int,
+                         content_hash: str, file_id: Optional[str]):
+        """Registra (o actualiza) el estado de un archivo de la carpeta del usuario"""
+        with self.transaction() as conn:
+            conn.execute(
+                """INSERT INTO source_files (user_id, path, mtime, size, content_hash, file_id)
+                   VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(user_id, path) DO UPDATE SET mtime = excluded.mtime, size = excluded.size,
+                   content_hash = excluded.content_hash, file_id = excluded.file_id,
+                   indexed_at = CURRENT_TIMESTAMP""",
+                (user_id, path, mtime, size, content_hash, file_id)
+            )
+    
+    def delete_source_file(self, user_id: int, path: str):
+        """Olvida un archivo de la carpeta del usuario"""
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM source_files WHERE user_id = ? AND path = ?", (user_id, path))
+    
+    # === SESIONES JWT ===
+    def save_token_session(self, username: str, device_id: str, token: str, jti: Optional[str],
+                           created_at: float, expires_at: float):
+        """Registra el token activo de un dispositivo (reemplaza el anterior)"""
+        with self.transaction() as conn:
+            conn.execute(
+                """INSERT INTO token_sessions (username, device_id, token, jti, created_at, expires_at)
+                   VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(username, device_id) DO UPDATE SET token = excluded.token, jti = excluded.jti,
+                   created_at = excluded.created_at, expires_at = excluded.expires_at""",
+                (username, device_id, token, jti, created_at, expires_at)
+            )
+    
+    def get_token_session(self, username: str, device_id: str) -> Optional[Dict]:
+        """Obtiene la sesión vigente de un dispositivo"""
+        with self.connection() as conn:
+            row = conn.execute(
+                """SELECT token, jti, created_at, expires_at FROM token_sessions
+                   WHERE username = ? AND device_id = ? AND expires_at > ?""",
+                (username, device_id, time.time())
+            ).fetchone()
+        
+        if row:
+            return {
+                'username': username,
+                'device_id': device_id,
+                'token': row[0],
+                'jti': row[1],
+                'created_at': row[2],
+                'expires_at': row[3]
+            }
+        return None
+    
+    def get_token_sessions(self) -> List[Dict]:
+        """Sesiones vigentes de todos los usuarios"""
+        with self.connection() as conn:
+            rows = conn.execute(
+                """SELECT username, device_id, token, jti, created_at, expires_at FROM token_sessions
+                   WHERE expires_at > ? ORDER BY username, created_at""",
+                (time.time(),)
+            ).fetchall()
+        
+        return [
+            {
+                'username': row[0],
+                'device_id': row[1],
+                'token': row[2],
+                'jti': row[3],
+                'created_at': row[4],
+                'expires_at': row[5]
+            }
+            for row in rows
+        ]
+    
+    def delete_token_sessions(self, username: str, device_id: Optional[str] = None) -> int:
+        """Elimina la sesión de un dispositivo o, sin device_id, todas las del usuario"""
+        with self.transaction() as conn:
+            if device_id is None:
+                return conn.execute("DELETE FROM token_sessions WHERE username = ?", (username,)).rowcount
+            return conn.execute(
+                "DELETE FROM token_sessions WHERE username = ? AND device_id = ?", (username, device_id)
+            ).rowcount
+    
+    def delete_expired_token_sessions(self, now: Optional[float] = None) -> int:
+        """Elimina las sesiones vencidas (usa el índice por expiración)"""
+        with self.transaction() as conn:
+            return conn.execute(
+                "DELETE FROM token_sessions WHERE expires_at <= ?", (now if now is not None else time.time(),)
+            ).rowcount
+    
     # === MÉTODOS PARA ANÁLISIS DE IMÁGENES ===
     def save_image_analysis(self, user_id: int, image_path: str, analysis_result: str, 
                            model_used: str, archivo_id: str = None) -> str:
         """Guarda un análisis de imagen"""
         analysis_id = str(uuid.uuid4())
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            """INSERT INTO analisis_imagenes (id, user_id, archivo_id, image_path, 
-               analysis_result, model_used) VALUES (?, ?, ?, ?, ?, ?)""",
-            (analysis_id, user_id, archivo_id, image_path, analysis_result, model_used)
-        )
-        conn.commit()
-        conn.close()
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """INSERT INTO analisis_imagenes (id, user_id, archivo_id, image_path, 
+                   analysis_result, model_used) VALUES (?, ?, ?, ?, ?, ?)""",
+                (analysis_id, user_id, archivo_id, image_path, analysis_result, model_used)
+            )
         return analysis_id
     
     def get_user_image_analyses(self, user_id: int) -> List[Dict]:
         """Obtiene todos los análisis de imágenes de un usuario"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT * FROM analisis_imagenes WHERE user_id = ? ORDER BY created_at DESC",
-            (user_id,)
-        )
-        rows = cursor.fetchall()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT * FROM analisis_imagenes WHERE user_id = ? ORDER BY created_at DESC",
+                (user_id,)
+            )
+            rows = cursor.fetchall()
         
         analyses = []
         for row in rows:
@@ -365,25 +1435,37 @@ class ZeroDatabase:
     # === MÉTODOS PARA CONTEXTO PERSONALIZADO ===
     def save_user_context(self, user_id: int, context_key: str, context_value: str, source_file_id: str = None):
         """Guarda contexto personalizado del usuario"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO contexto_usuario (user_id, context_key, context_value, source_file_id) VALUES (?, ?, ?, ?)",
-            (user_id, context_key, context_value, source_file_id)
-        )
-        conn.commit()
-        conn.close()
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "INSERT INTO contexto_usuario (user_id, context_key, context_value, source_file_id) VALUES (?, ?, ?, ?)",
+                (user_id, context_key, context_value, source_file_id)
+            )
+    
+    def save_user_context_bulk(self, user_id: int, entries: List[Dict]) -> int:
+        """Guarda varias entradas de contexto (context_key, context_value, source_file_id) en una transacción"""
+        if not entries:
+            return 0
+        
+        with self.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO contexto_usuario (user_id, context_key, context_value, source_file_id) VALUES (?, ?, ?, ?)",
+                [
+                    (user_id, entry['context_key'], entry['context_value'], entry.get('source_file_id'))
+                    for entry in entries
+                ]
+            )
+        return len(entries)
     
     def get_user_context(self, user_id: int) -> List[Dict]:
         """Obtiene todo el contexto personalizado de un usuario"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT * FROM contexto_usuario WHERE user_id = ? ORDER BY created_at DESC",
-            (user_id,)
-        )
-        rows = cursor.fetchall()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT * FROM contexto_usuario WHERE user_id = ? ORDER BY created_at DESC",
+                (user_id,)
+            )
+            rows = cursor.fetchall()
         
         context = []
         for row in rows:
@@ -397,26 +1479,201 @@ class ZeroDatabase:
             })
         return context
     
-    def delete_file(self, file_id: str, user_id: int) -> bool:
-        """Elimina un archivo y sus análisis asociados"""
-        try:
-            conn = self.get_connection()
+    # === MÉTODOS PARA FRAGMENTOS (BÚSQUEDA VECTORIAL) ===
+    def save_file_chunks(self, user_id: int, file_id: str, chunks: List[Dict]) -> int:
+        """Reemplaza los fragmentos de un archivo (page, content, embedding en float32)"""
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM contexto_chunks WHERE file_id = ?", (file_id,))
+            conn.executemany(
+                """INSERT INTO contexto_chunks (user_id, file_id, chunk_index, page, content, embedding)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                [
+                    (user_id, file_id, i, chunk.get('page'), chunk['content'], chunk['embedding'])
+                    for i, chunk in enumerate(chunks)
+                ]
+            )
+        return len(chunks)
+    
+    def copy_file_chunks(self, source_file_id: str, user_id: int, file_id: str) -> int:
+        """Reutiliza los fragmentos (y vectores) de otro archivo con el mismo contenido"""
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM contexto_chunks WHERE file_id = ?", (file_id,))
+            return conn.execute(
+                """INSERT INTO contexto_chunks (user_id, file_id, chunk_index, page, content, embedding)
+                   SELECT ?, ?, chunk_index, page, content, embedding
+                   FROM contexto_chunks WHERE file_id = ? ORDER BY chunk_index""",
+                (user_id, file_id, source_file_id)
+            ).rowcount
+    
+    def get_chunk_signature(self, user_id: int) -> tuple:
+        """Firma barata (número y último id) que cambia cuando cambian los fragmentos del usuario"""
+        with self.connection() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*), MAX(id) FROM contexto_chunks WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        return tuple(row)
+    
+    def get_user_chunk_vectors(self, user_id: int) -> tuple:
+        """Devuelve (ids, vectores en bytes) de todos los fragmentos del usuario"""
+        with self.connection() as conn:
+            rows = conn.execute(
+                "SELECT id, embedding FROM contexto_chunks WHERE user_id = ? ORDER BY id", (user_id,)
+            ).fetchall()
+        return [row[0] for row in rows], [row[1] for row in rows]
+    
+    def get_chunks_by_ids(self, chunk_ids: List[int]) -> List[Dict]:
+        """Obtiene el texto de varios fragmentos junto con el nombre de su archivo"""
+        if not chunk_ids:
+            return []
+        placeholders = ", ".join("?" for _ in chunk_ids)
+        with self.connection() as conn:
+            rows = conn.execute(
+                f"""SELECT c.id, c.file_id, a.filename, c.chunk_index, c.page, c.content
+                    FROM contexto_chunks c LEFT JOIN archivos a ON a.id = c.file_id
+                    WHERE c.id IN ({placeholders})""",
+                list(chunk_ids)
+            ).fetchall()
+        
+        return [
+            {
+                'id': row[0],
+                'file_id': row[1],
+                'filename': row[2],
+                'chunk_index': row[3],
+                'page': row[4],
+                'content': row[5]
+            }
+            for row in rows
+        ]
+    
+    # === BÚSQUEDA DE TEXTO COMPLETO ===
+    @staticmethod
+    def _fts_query(query: str, min_length: int = 3) -> Optional[str]:
+        """Convierte texto libre en una consulta FTS5 segura (términos entre comillas unidos con OR)"""
+        words = {w.lower() for w in re.findall(r"\w+", query) if len(w) >= min_length}
+        if not words:
+            return None
+        return " OR ".join(f'"{w}"' for w in sorted(words))
+    
+    def search_context(self, user_id: int, query: str, k: int = 3,
+                       sources: tuple = SEARCH_SOURCES, exclude_chat_id: Optional[str] = None) -> List[Dict]:
+        """Busca en el contexto, archivos y mensajes del usuario, ordenado por relevancia (bm25).
+        
+        bm25 solo es comparable dentro de una misma tabla FTS (un mensaje corto
+        puntúa mucho mejor que un documento largo), así que cada fuente se ordena
+        por separado y los resultados se reparten por turnos entre fuentes, en el
+        orden de SEARCH_SOURCES. `exclude_chat_id` omite los mensajes del chat
+        activo, que el modelo ya recibe como historial.
+        """
+        match = self._fts_query(query)
+        if not match:
+            return []
+        
+        results = []
+        with self.connection() as conn:
             cursor = conn.cursor()
+            if "contexto" in sources:
+                cursor.execute(
+                    """SELECT c.id, c.context_key, snippet(contexto_fts, 1, '', '', '…', 64),
+                              bm25(contexto_fts), c.source_file_id
+                       FROM contexto_fts JOIN contexto_usuario c ON c.id = contexto_fts.rowid
+                       WHERE contexto_fts MATCH ? AND c.user_id = ?
+                       ORDER BY bm25(contexto_fts) LIMIT ?""",
+                    (match, user_id, k)
+                )
+                for row in cursor.fetchall():
+                    results.append({
+                        'source': 'contexto',
+                        'id': row[0],
+                        'key': row[1],
+                        'content': row[2],
+                        'score': row[3],
+                        'file_id': row[4]
+                    })
             
-            # Eliminar análisis de imágenes asociados
-            cursor.execute("DELETE FROM analisis_imagenes WHERE archivo_id = ?", (file_id,))
-            
-            # Eliminar contexto asociado
-            cursor.execute("DELETE FROM contexto_usuario WHERE source_file_id = ?", (file_id,))
-            
-            # Eliminar archivo
-            cursor.execute("DELETE FROM archivos WHERE id = ? AND user_id = ?", (file_id, user_id))
+            if "archivos" in sources:
+                cursor.execute(
+                    """SELECT a.id, a.filename, snippet(archivos_fts, 1, '', '', '…', 64),
+                              bm25(archivos_fts)
+                       FROM archivos_fts JOIN archivos a ON a.fts_id = archivos_fts.rowid
+                       WHERE archivos_fts MATCH ? AND a.user_id = ?
+                       ORDER BY bm25(archivos_fts) LIMIT ?""",
+                    (match, user_id, k)
+                )
+                for row in cursor.fetchall():
+                    results.append({
+                        'source': 'archivos',
+                        'id': row[0],
+                        'key': f"Archivo: {row[1]}",
+                        'content': row[2],
+                        'score': row[3],
+                        'file_id': row[0]
+                    })
             
-            conn.commit()
-            conn.close()
+            if "mensajes" in sources:
+                cursor.execute(
+                    """SELECT m.id, m.role, snippet(mensajes_fts, 0, '', '', '…', 64),
+                              bm25(mensajes_fts), ch.title
+                       FROM mensajes_fts
+                       JOIN mensajes m ON m.id = mensajes_fts.rowid
+                       JOIN chats ch ON ch.id = m.chat_id
+                       WHERE mensajes_fts MATCH ? AND ch.user_id = ? AND m.chat_id IS NOT ?
+                       ORDER BY bm25(mensajes_fts) LIMIT ?""",
+                    (match, user_id, exclude_chat_id, k)
+                )
+                for row in cursor.fetchall():
+                    results.append({
+                        'source': 'mensajes',
+                        'id': row[0],
+                        'key': f"Conversación anterior ({row[4]})",
+                        'content': row[2],
+                        'score': row[3],
+                        'file_id': None
+                    })
+        
+        # Reparto por turnos: el mejor de cada fuente, luego el segundo de cada una, etc.
+        # (sort es estable y cada fuente ya viene ordenada por su bm25)
+        rank_in_source = {}
+        for result in results:
+            result['rank'] = rank_in_source.get(result['source'], 0)
+            rank_in_source[result['source']] = result['rank'] + 1
+        results.sort(key=lambda r: (r['rank'], SEARCH_SOURCES.index(r['source'])))
+        
+        # Un archivo cuyo contenido ya aparece como contexto no se repite
+        seen_files = set()
+        ranked = []
+        for result in results:
+            if result['file_id'] and result['file_id'] in seen_files:
+                continue
+            if result['file_id']:
+                seen_files.add(result['file_id'])
+            ranked.append(result)
+        return ranked[:k]
+    
+    def delete_file(self, file_id: str, user_id: int) -> bool:
+        """Elimina un archivo y sus análisis asociados"""
+        try:
+            with self.transaction() as conn:
+                cursor = conn.cursor()
+                
+                # Eliminar análisis de imágenes asociados
+                cursor.execute("DELETE FROM analisis_imagenes WHERE archivo_id = ?", (file_id,))
+                
+                # Eliminar contexto y fragmentos asociados
+                cursor.execute("DELETE FROM contexto_usuario WHERE source_file_id = ?", (file_id,))
+                cursor.execute("DELETE FROM contexto_chunks WHERE file_id = ?", (file_id,))
+                
+                # Eliminar archivo y su referencia al blob
+                cursor.execute(
+                    "SELECT content_hash FROM archivos WHERE id = ? AND user_id = ?", (file_id, user_id)
+                )
+                row = cursor.fetchone()
+                cursor.execute("DELETE FROM archivos WHERE id = ? AND user_id = ?", (file_id, user_id))
+                if row and row[0]:
+                    cursor.execute("UPDATE blobs SET refcount = refcount - 1 WHERE hash = ?", (row[0],))
             return True
         except Exception:
             return False
 
 # Instancia global de la base de datos
-db = ZeroDatabase()
\ No newline at end of file
+db = ZeroDatabase()
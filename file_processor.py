@@ -1,6 +1,11 @@
 import os
 import io
-from typing import Dict, Any, Optional
+import mmap
+import sys
+import time
+import tracemalloc
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Dict, Any, Optional, Iterator, List, Tuple, Union
 from PIL import Image
 import PyPDF2
 import docx
@@ -8,6 +13,39 @@ import pandas as pd
 import json
 from base64 import b64encode
 
+# Páginas por tarea enviada al pool de extracción
+PDF_PAGES_PER_TASK = 16
+
+
+def _open_pdf(file_path: str) -> Tuple[PyPDF2.PdfReader, Any]:
+    """Abre un PDF mapeado en memoria (las páginas se leen del disco bajo demanda)"""
+    with open(file_path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return PyPDF2.PdfReader(mapped), mapped
+
+
+def _extract_pdf_page_range(file_path: str, start: int, stop: int) -> List[Tuple[int, str]]:
+    """Tarea del pool: extrae las páginas [start, stop) de un PDF en disco"""
+    reader, mapped = _open_pdf(file_path)
+    try:
+        return [(i + 1, reader.pages[i].extract_text() or "") for i in range(start, stop)]
+    finally:
+        mapped.close()
+
+def process_stored_file(file_path: str, filename: str, executor: Optional[Executor] = None) -> Dict[str, Any]:
+    """Procesa un archivo ya guardado en disco; pensado como tarea de un pool de procesos.
+
+    Con `executor` las páginas de un PDF se reparten entre ese pool (ver `iter_pdf_pages`).
+    """
+    # Sin bytes: los PDF se mapean desde la ruta y el resto se lee solo si hace falta
+    result = FileProcessor.process_file(None, filename, file_path=file_path, executor=executor)
+    # El base64 de las imágenes no hace falta de vuelta en el proceso principal
+    result['metadata'] = {}
+    if not result['error']:
+        result['summary'] = FileProcessor.generate_summary(result['content'] or "", result['file_type'])
+    return result
+
+
 class FileProcessor:
     """Procesador de archivos para extraer contenido y generar análisis"""
     
@@ -35,84 +73,102 @@ class FileProcessor:
         return FileProcessor.get_file_type(filename) != 'unknown'
     
     @staticmethod
-    def extract_text_from_pdf(file_bytes: bytes) -> str:
-        """Extrae texto de un archivo PDF"""
+    def iter_pdf_pages(source: Union[str, bytes], executor: Optional[Executor] = None) -> Iterator[Tuple[int, str]]:
+        """Genera (número de página, texto) en orden, a medida que se extraen.
+        
+        Con una ruta el archivo se mapea en memoria en lugar de cargarse entero y,
+        con `executor` (el pool de procesos de la cola de ingesta), las páginas se
+        reparten en rangos de PDF_PAGES_PER_TASK entre sus procesos: la extracción
+        de PyPDF2 es CPU pura y no escala con hilos.
+        """
+        if isinstance(source, (bytes, bytearray)):
+            reader, mapped = PyPDF2.PdfReader(io.BytesIO(source)), None
+        else:
+            reader, mapped = _open_pdf(source)
+        
         try:
-            pdf_file = io.BytesIO(file_bytes)
-            pdf_reader = PyPDF2.PdfReader(pdf_file)
+            if mapped is None or executor is None:
+                for i, page in enumerate(reader.pages):
+                    yield i + 1, page.extract_text() or ""
+                return
             
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-            
-            return text.strip()
-        except Exception as e:
-            return f"Error al procesar PDF: {str(e)}"
+            total = len(reader.pages)
+            futures = [
+                executor.submit(_extract_pdf_page_range, source, start, min(start + PDF_PAGES_PER_TASK, total))
+                for start in range(0, total, PDF_PAGES_PER_TASK)
+            ]
+            try:
+                # Se entregan en orden de página según van terminando los rangos
+                for future in futures:
+                    yield from future.result()
+            finally:
+                # Si la extracción se corta, los rangos aún en cola no ocupan el pool
+                for future in futures:
+                    future.cancel()
+        finally:
+            if mapped is not None:
+                mapped.close()
+    
+    @staticmethod
+    def extract_text_from_pdf(source: Union[str, bytes]) -> str:
+        """Extrae texto de un archivo PDF (bytes o ruta en disco); lanza excepción si falla"""
+        return "\n".join(text for _, text in FileProcessor.iter_pdf_pages(source)).strip()
     
     @staticmethod
     def extract_text_from_word(file_bytes: bytes) -> str:
-        """Extrae texto de un archivo Word"""
-        try:
-            doc_file = io.BytesIO(file_bytes)
-            doc = docx.Document(doc_file)
-            
-            text = ""
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
-            
-            return text.strip()
-        except Exception as e:
-            return f"Error al procesar Word: {str(e)}"
+        """Extrae texto de un archivo Word; lanza excepción si falla"""
+        doc_file = io.BytesIO(file_bytes)
+        doc = docx.Document(doc_file)
+        
+        text = ""
+        for paragraph in doc.paragraphs:
+            text += paragraph.text + "\n"
+        
+        return text.strip()
     
     @staticmethod
     def extract_text_from_excel(file_bytes: bytes, filename: str) -> str:
-        """Extrae datos de un archivo Excel o CSV"""
-        try:
-            if filename.lower().endswith('.csv'):
-                df = pd.read_csv(io.BytesIO(file_bytes))
-            else:
-                df = pd.read_excel(io.BytesIO(file_bytes))
-            
-            # Convertir a texto estructurado
-            text = f"Archivo: {filename}\n"
-            text += f"Dimensiones: {df.shape[0]} filas, {df.shape[1]} columnas\n\n"
-            text += "Columnas: " + ", ".join(df.columns.tolist()) + "\n\n"
-            text += "Primeras 10 filas:\n"
-            text += df.head(10).to_string(index=False)
-            
-            if df.shape[0] > 10:
-                text += f"\n\n... y {df.shape[0] - 10} filas más"
-            
-            return text
-        except Exception as e:
-            return f"Error al procesar Excel/CSV: {str(e)}"
+        """Extrae datos de un archivo Excel o CSV; lanza excepción si falla"""
+        if filename.lower().endswith('.csv'):
+            df = pd.read_csv(io.BytesIO(file_bytes))
+        else:
+            df = pd.read_excel(io.BytesIO(file_bytes))
+        
+        # Convertir a texto estructurado
+        text = f"Archivo: {filename}\n"
+        text += f"Dimensiones: {df.shape[0]} filas, {df.shape[1]} columnas\n\n"
+        text += "Columnas: " + ", ".join(map(str, df.columns.tolist())) + "\n\n"
+        text += "Primeras 10 filas:\n"
+        text += df.head(10).to_string(index=False)
+        
+        if df.shape[0] > 10:
+            text += f"\n\n... y {df.shape[0] - 10} filas más"
+        
+        return text
     
     @staticmethod
     def extract_text_from_text_file(file_bytes: bytes, filename: str) -> str:
-        """Extrae contenido de archivos de texto"""
-        try:
-            # Intentar diferentes encodings
-            encodings = ['utf-8', 'latin-1', 'cp1252']
-            
-            for encoding in encodings:
-                try:
-                    text = file_bytes.decode(encoding)
-                    
-                    # Si es JSON, formatear
-                    if filename.lower().endswith('.json'):
-                        try:
-                            json_data = json.loads(text)
-                            text = json.dumps(json_data, indent=2, ensure_ascii=False)
-                        except:
-                            pass
-                    
-                    return text
-                except UnicodeDecodeError:
-                    continue
-            
-            return "Error: No se pudo decodificar el archivo de texto"
-        except Exception as e:
-            return f"Error al procesar archivo de texto: {str(e)}"
+        """Extrae contenido de archivos de texto; lanza excepción si falla"""
+        # Intentar diferentes encodings
+        encodings = ['utf-8', 'latin-1', 'cp1252']
+        
+        for encoding in encodings:
+            try:
+                text = file_bytes.decode(encoding)
+                
+                # Si es JSON, formatear
+                if filename.lower().endswith('.json'):
+                    try:
+                        json_data = json.loads(text)
+                        text = json.dumps(json_data, indent=2, ensure_ascii=False)
+                    except:
+                        pass
+                
+                return text
+            except UnicodeDecodeError:
+                continue
+        
+        raise ValueError("No se pudo decodificar el archivo de texto")
     
     @staticmethod
     def process_image(file_bytes: bytes, filename: str) -> Dict[str, Any]:
@@ -150,33 +206,63 @@ class FileProcessor:
             }
     
     @staticmethod
-    def process_file(file_bytes: bytes, filename: str) -> Dict[str, Any]:
-        """Procesa un archivo y extrae su contenido"""
+    def process_file(file_bytes: Optional[bytes], filename: str, file_path: Optional[str] = None,
+                     executor: Optional[Executor] = None) -> Dict[str, Any]:
+        """Procesa un archivo y extrae su contenido.
+        
+        Si se indica `file_path` (el mismo contenido ya guardado en disco), los PDF
+        se leen desde ahí y el resultado incluye `pages` con (página, texto). Con
+        `file_bytes=None` el contenido se toma de `file_path`: un PDF nunca se
+        carga entero en memoria y el resto de tipos se lee al procesarlo. Con
+        `executor` las páginas de un PDF en disco se extraen en ese pool.
+        """
         file_type = FileProcessor.get_file_type(filename)
-        file_size = len(file_bytes)
+        file_size = len(file_bytes) if file_bytes is not None else os.path.getsize(file_path)
         
         result = {
             'filename': filename,
             'file_type': file_type,
             'file_size': file_size,
             'content': None,
+            'pages': None,
             'metadata': {},
             'error': None
         }
         
         try:
+            if file_bytes is None and file_type not in ('pdf', 'unknown'):
+                with open(file_path, "rb") as f:
+                    file_bytes = f.read()
+            
             if file_type == 'pdf':
-                result['content'] = FileProcessor.extract_text_from_pdf(file_bytes)
+                try:
+                    pages = list(FileProcessor.iter_pdf_pages(file_path or file_bytes, executor=executor))
+                    result['pages'] = pages
+                    result['content'] = "\n".join(text for _, text in pages).strip()
+                except Exception as e:
+                    result['error'] = f"Error al procesar PDF: {str(e)}"
             elif file_type == 'word':
-                result['content'] = FileProcessor.extract_text_from_word(file_bytes)
+                try:
+                    result['content'] = FileProcessor.extract_text_from_word(file_bytes)
+                except Exception as e:
+                    result['error'] = f"Error al procesar Word: {str(e)}"
             elif file_type == 'excel':
-                result['content'] = FileProcessor.extract_text_from_excel(file_bytes, filename)
+                try:
+                    result['content'] = FileProcessor.extract_text_from_excel(file_bytes, filename)
+                except Exception as e:
+                    result['error'] = f"Error al procesar Excel/CSV: {str(e)}"
             elif file_type == 'text':
-                result['content'] = FileProcessor.extract_text_from_text_file(file_bytes, filename)
+                try:
+                    result['content'] = FileProcessor.extract_text_from_text_file(file_bytes, filename)
+                except Exception as e:
+                    result['error'] = f"Error al procesar archivo de texto: {str(e)}"
             elif file_type == 'image':
                 image_info = FileProcessor.process_image(file_bytes, filename)
-                result['content'] = image_info.get('description', '')
-                result['metadata'] = image_info
+                if image_info.get('error'):
+                    result['error'] = image_info['error']
+                else:
+                    result['content'] = image_info.get('description', '')
+                    result['metadata'] = image_info
             else:
                 result['error'] = f"Tipo de archivo no soportado: {file_type}"
                 
@@ -217,4 +303,34 @@ class FileProcessor:
                 if line.strip():
                     summary += f"  {line.strip()[:100]}...\n"
         
-        return summary
\ No newline at end of file
+        return summary
+
+
+def _benchmark(file_path: str, workers: int):
+    """Compara la extracción de un PDF desde bytes, desde mmap y repartida en un pool"""
+    def run(label: str, source: Union[str, bytes], executor: Optional[Executor] = None):
+        started = time.perf_counter()
+        pages = list(FileProcessor.iter_pdf_pages(source, executor=executor))
+        elapsed = time.perf_counter() - started
+        # tracemalloc ralentiza mucho PyPDF2: la memoria se mide en una segunda pasada
+        tracemalloc.start()
+        list(FileProcessor.iter_pdf_pages(source, executor=executor))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        chars = sum(len(text) for _, text in pages)
+        print(f"{label:<28} {elapsed:8.2f} s  {peak / 2**20:8.1f} MB pico  "
+              f"{len(pages)} páginas, {chars} caracteres")
+
+    with open(file_path, "rb") as f:
+        run("bytes en memoria, en serie", f.read())
+    run("mmap, en serie", file_path)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        run(f"mmap, pool de {workers} procesos", file_path, pool)
+    print("El pico cuenta la memoria de Python del proceso principal (no la de los procesos del pool)")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Uso: python file_processor.py archivo.pdf [procesos]")
+        sys.exit(1)
+    _benchmark(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else (os.cpu_count() or 1))
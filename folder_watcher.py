@@ -0,0 +1,202 @@
+import os
+import threading
+import time
+from typing import Dict, Optional, Set
+
+from watchdog.events import FileSystemEvent, FileSystemEventHandler
+from watchdog.observers import Observer
+from watchdog.observers.polling import PollingObserver
+
+from database import db, ZeroDatabase
+from blob_store import blob_store
+from bulk_ingest import FolderIngestor, STORAGE_ROOT, format_report
+from ingestion import ImageAnalyzer, INGEST_WORKERS
+from retrieval import retriever
+
+# Segundos sin eventos antes de procesar un lote de cambios
+WATCH_DEBOUNCE = float(os.getenv("ZERO_WATCH_DEBOUNCE", "2"))
+# Espera máxima de un lote aunque sigan llegando eventos
+WATCH_MAX_DELAY = float(os.getenv("ZERO_WATCH_MAX_DELAY", "30"))
+# Intervalo del observador por sondeo (cuando inotify no está disponible)
+WATCH_POLL_INTERVAL = float(os.getenv("ZERO_WATCH_POLL_INTERVAL", "5"))
+
+
+class _EventHandler(FileSystemEventHandler):
+    def __init__(self, watcher: "StorageWatcher"):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_any_event(self, event: FileSystemEvent):
+        if event.event_type in ("opened", "closed_no_write"):
+            return
+        # inotify marca el directorio padre como modificado con cada archivo que cambia;
+        # solo crear, borrar o mover un directorio altera el árbol
+        if event.is_directory and event.event_type not in ("created", "deleted", "moved"):
+            return
+        self.watcher.notify(event.src_path, event.is_directory)
+        dest_path = getattr(event, "dest_path", "")
+        if dest_path:
+            self.watcher.notify(dest_path, event.is_directory)
+
+
+class StorageWatcher:
+    """Vigila storage/<usuario>/docs y reindexa solo los archivos que cambian.
+
+    Usa el observador nativo de watchdog (inotify en Linux) y cae al observador
+    por sondeo si no se puede iniciar. Los eventos se acumulan por usuario y se
+    procesan en lote cuando la carpeta lleva `debounce` segundos sin cambios, con
+    `FolderIngestor.sync(paths=...)`: los archivos nuevos o modificados se
+    reingieren y los borrados se eliminan de archivos, contexto e índices. Crear,
+    borrar o mover un directorio provoca una resincronización completa de ese
+    usuario; las modificaciones de directorios se ignoran.
+    """
+
+    def __init__(self, database: ZeroDatabase, ingestor: FolderIngestor, root: str = STORAGE_ROOT,
+                 debounce: float = WATCH_DEBOUNCE, max_delay: float = WATCH_MAX_DELAY,
+                 poll_interval: float = WATCH_POLL_INTERVAL, use_polling: bool = False):
+        self.db = database
+        self.ingestor = ingestor
+        self.root = os.path.abspath(root)
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.use_polling = use_polling
+        self.observer = None
+        # usuario -> rutas relativas cambiadas (None = resincronizar toda la carpeta)
+        self._pending: Dict[str, Optional[Set[str]]] = {}
+        self._first_event = 0.0
+        self._last_event = 0.0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # === EVENTOS ===
+    def notify(self, path: str, is_directory: bool = False):
+        """Registra un cambio en una ruta (ignora lo que no esté en <usuario>/docs)"""
+        relative = os.path.relpath(os.path.abspath(path), self.root)
+        parts = relative.replace(os.sep, "/").split("/")
+        if len(parts) < 2 or parts[0] in ("", ".", "..") or parts[1] != "docs":
+            return
+        username, doc_path = parts[0], "/".join(parts[2:])
+        if any(part.startswith(".") for part in parts[2:]):
+            return
+
+        now = time.monotonic()
+        with self._lock:
+            if not self._pending:
+                self._first_event = now
+            self._last_event = now
+            if is_directory or not doc_path:
+                self._pending[username] = None
+            elif username not in self._pending:
+                self._pending[username] = {doc_path}
+            elif self._pending[username] is not None:
+                self._pending[username].add(doc_path)
+        self._wake.set()
+
+    def _take_batch(self) -> Dict[str, Optional[Set[str]]]:
+        """Devuelve los cambios acumulados si ya toca procesarlos"""
+        with self._lock:
+            if not self._pending:
+                return {}
+            now = time.monotonic()
+            if now - self._last_event < self.debounce and now - self._first_event < self.max_delay:
+                return {}
+            batch, self._pending = self._pending, {}
+        return batch
+
+    def flush(self) -> Dict[str, Dict]:
+        """Procesa de inmediato los cambios pendientes; devuelve un informe por usuario"""
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        return self._process(batch)
+
+    def _process(self, batch: Dict[str, Optional[Set[str]]]) -> Dict[str, Dict]:
+        reports = {}
+        for username, paths in batch.items():
+            user_id = self.db.get_user_id_by_username(username)
+            if not user_id:
+                continue
+            try:
+                reports[username] = self.ingestor.sync(
+                    user_id, os.path.join(self.root, username, "docs"), paths=paths
+                )
+            except Exception as e:
+                print(f"Error reindexando la carpeta de {username}: {e}")
+        return reports
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.debounce)
+            self._wake.clear()
+            batch = self._take_batch()
+            if batch:
+                for username, report in self._process(batch).items():
+                    print(f"[{username}] {format_report(report)}")
+
+    # === CICLO DE VIDA ===
+    def start(self):
+        """Arranca el observador (inotify o sondeo) y el hilo que procesa los lotes"""
+        if self._thread is not None:
+            return
+        os.makedirs(self.root, exist_ok=True)
+        handler = _EventHandler(self)
+        observer = None
+        if not self.use_polling:
+            try:
+                observer = Observer()
+                observer.schedule(handler, self.root, recursive=True)
+                observer.start()
+            except OSError as e:
+                # Límite de inotify agotado, sistema de archivos de red, etc.
+                print(f"Observador nativo no disponible ({e}); usando sondeo")
+                observer = None
+        if observer is None:
+            observer = PollingObserver(timeout=self.poll_interval)
+            observer.schedule(handler, self.root, recursive=True)
+            observer.start()
+        self.observer = observer
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="zero-storage-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wake.set()
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join(timeout)
+            self.observer = None
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.ingestor.close()
+
+
+_watcher: Optional[StorageWatcher] = None
+_watcher_lock = threading.Lock()
+
+
+def get_storage_watcher(analyze_image: Optional[ImageAnalyzer] = None,
+                        vision_model: Optional[str] = None) -> StorageWatcher:
+    """Vigilante compartido por todo el proceso; arranca en la primera llamada"""
+    global _watcher
+    if _watcher is None:
+        with _watcher_lock:
+            if _watcher is None:
+                ingestor = FolderIngestor(db, blob_store, retriever, INGEST_WORKERS, analyze_image, vision_model)
+                _watcher = StorageWatcher(db, ingestor)
+                _watcher.start()
+    return _watcher
+
+
+if __name__ == "__main__":
+    watcher = get_storage_watcher()
+    print(f"Vigilando {watcher.root} ({type(watcher.observer).__name__}). Ctrl+C para salir.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        watcher.stop()
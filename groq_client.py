@@ -0,0 +1,142 @@
+import os
+import threading
+from typing import List, Dict, Optional, Iterator, Any
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from sse import StreamDelta, iter_deltas
+
+GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
+
+# Pool de conexiones keep-alive (configurable por entorno)
+GROQ_POOL_CONNECTIONS = int(os.getenv("GROQ_POOL_CONNECTIONS", "4"))
+GROQ_POOL_MAXSIZE = int(os.getenv("GROQ_POOL_MAXSIZE", "16"))
+GROQ_CONNECT_TIMEOUT = float(os.getenv("GROQ_CONNECT_TIMEOUT", "10"))
+GROQ_READ_TIMEOUT = float(os.getenv("GROQ_READ_TIMEOUT", "300"))
+# Reintentos solo ante fallos de conexión (nunca se reenvía una petición ya leída)
+GROQ_CONNECT_RETRIES = int(os.getenv("GROQ_CONNECT_RETRIES", "2"))
+
+
+class GroqError(Exception):
+    """Respuesta no exitosa de la API de Groq"""
+
+    def __init__(self, status_code: int, body: str):
+        super().__init__(f"Error {status_code}: {body}")
+        self.status_code = status_code
+        self.body = body
+
+
+class GroqClient:
+    """Cliente de la API de Groq sobre una única requests.Session con conexiones reutilizables.
+
+    Mantener la sesión viva entre turnos evita repetir DNS + TCP + TLS contra
+    api.groq.com en cada petición.
+    """
+
+    def __init__(self, api_key: Optional[str] = None, api_url: str = GROQ_API_URL,
+                 pool_connections: int = GROQ_POOL_CONNECTIONS, pool_maxsize: int = GROQ_POOL_MAXSIZE,
+                 connect_timeout: float = GROQ_CONNECT_TIMEOUT, read_timeout: float = GROQ_READ_TIMEOUT,
+                 connect_retries: int = GROQ_CONNECT_RETRIES):
+        self.api_url = api_url
+        self.timeout = (connect_timeout, read_timeout)
+
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key if api_key is not None else os.getenv('GROQ_API_KEY', '')}",
+            "Content-Type": "application/json",
+        })
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=False,
+            max_retries=Retry(total=connect_retries, connect=connect_retries, read=0, status=0,
+                              backoff_factor=0.2),
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def post(self, payload: Dict[str, Any], *, stream: bool = False,
+             timeout: Optional[float] = None) -> requests.Response:
+        """POST al endpoint de chat completions usando la sesión compartida"""
+        headers = {"Accept": "text/event-stream"} if stream else None
+        return self.session.post(
+            self.api_url,
+            json=payload,
+            headers=headers,
+            stream=stream,
+            timeout=(self.timeout[0], timeout) if timeout else self.timeout,
+        )
+
+    def chat(self, messages: List[Dict], *, model: str, max_tokens: int = 1200,
+             temperature: float = 0.7, timeout: Optional[float] = None) -> str:
+        """Completion sin streaming; devuelve el texto de la respuesta"""
+        payload = {
+            "model": model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+        }
+        r = self.post(payload, timeout=timeout)
+        if r.status_code != 200:
+            raise GroqError(r.status_code, r.text)
+        return r.json()["choices"][0]["message"]["content"]
+
+    def chat_stream_events(self, messages: List[Dict], *, model: str, max_tokens: int = 1200,
+                           temperature: float = 0.7, timeout: Optional[float] = None) -> Iterator[StreamDelta]:
+        """Completion en streaming (SSE); genera deltas tipados (content, usage, error, done)"""
+        payload = {
+            "model": model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "stream": True,
+        }
+        with self.post(payload, stream=True, timeout=timeout) as r:
+            if r.status_code != 200:
+                raise GroqError(r.status_code, r.text)
+            # Fragmentos crudos tal como llegan del socket
+            yield from iter_deltas(r.iter_content(chunk_size=None))
+
+    def chat_stream(self, messages: List[Dict], *, model: str, max_tokens: int = 1200,
+                    temperature: float = 0.7, timeout: Optional[float] = None) -> Iterator[str]:
+        """Completion en streaming; genera solo los fragmentos de texto a medida que llegan"""
+        for delta in self.chat_stream_events(messages, model=model, max_tokens=max_tokens,
+                                             temperature=temperature, timeout=timeout):
+            if delta.kind == "content":
+                yield delta.text
+            elif delta.kind == "error":
+                raise GroqError(200, delta.text)
+
+    def vision(self, prompt: str, image_base64: str, *, model: str, mime_type: str = "image/jpeg",
+               max_tokens: int = 1000, temperature: float = 0.3, timeout: Optional[float] = None) -> str:
+        """Analiza una imagen (base64) con un modelo de visión"""
+        messages = [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": prompt},
+                    {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{image_base64}"}},
+                ],
+            }
+        ]
+        return self.chat(messages, model=model, max_tokens=max_tokens,
+                         temperature=temperature, timeout=timeout)
+
+    def close(self):
+        self.session.close()
+
+
+_client: Optional[GroqClient] = None
+_client_lock = threading.Lock()
+
+
+def get_groq_client() -> GroqClient:
+    """Cliente compartido por todo el proceso (sobrevive a los reruns de Streamlit)"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = GroqClient()
+    return _client
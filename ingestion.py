@@ -0,0 +1,255 @@
+import multiprocessing
+import os
+import threading
+from base64 import b64encode
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Any
+
+from database import db, ZeroDatabase, JOB_FAILED
+from blob_store import blob_store, BlobStore
+from file_processor import FileProcessor, process_stored_file
+from retrieval import retriever, ChunkRetriever
+
+# Hilos que procesan trabajos a la vez (y procesos del pool de extracción)
+INGEST_WORKERS = int(os.getenv("ZERO_INGEST_WORKERS", str(min(2, os.cpu_count() or 1))))
+# Intentos por trabajo antes de marcarlo como fallido
+INGEST_MAX_ATTEMPTS = int(os.getenv("ZERO_INGEST_MAX_ATTEMPTS", "3"))
+# Espera antes de reintentar, multiplicada por el número de intentos
+INGEST_RETRY_DELAY = float(os.getenv("ZERO_INGEST_RETRY_DELAY", "10"))
+# Segundos entre consultas a la cola cuando está vacía
+INGEST_POLL_INTERVAL = 2.0
+
+# analyze_image(image_base64, filename) -> texto del análisis
+ImageAnalyzer = Callable[[str, str], str]
+# progress(fracción 0-1, mensaje)
+ProgressCallback = Callable[[float, str], None]
+
+
+class IngestionError(Exception):
+    """El archivo no se pudo procesar"""
+
+
+class IngestionQueue:
+    """Cola de ingesta de archivos respaldada por SQLite (tabla ingestion_jobs).
+
+    Subir un archivo solo guarda el blob y encola un trabajo; varios hilos de
+    fondo toman trabajos de la cola, extraen el contenido en un pool de procesos
+    (la extracción es CPU pura) y hacen las escrituras, la vectorización y el
+    análisis de imagen fuera del hilo de la petición. Cada paso actualiza el
+    avance del trabajo para que la interfaz lo consulte, y los fallos se
+    reintentan con espera creciente hasta `max_attempts`.
+    """
+
+    def __init__(self, database: ZeroDatabase, blobs: BlobStore, chunk_retriever: ChunkRetriever,
+                 analyze_image: Optional[ImageAnalyzer] = None, vision_model: Optional[str] = None,
+                 workers: int = INGEST_WORKERS, max_attempts: int = INGEST_MAX_ATTEMPTS,
+                 retry_delay: float = INGEST_RETRY_DELAY, poll_interval: float = INGEST_POLL_INTERVAL):
+        self.db = database
+        self.blobs = blobs
+        self.retriever = chunk_retriever
+        self.analyze_image = analyze_image
+        self.vision_model = vision_model
+        self.workers = max(1, workers)
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+
+    # === ENCOLAR ===
+    def enqueue(self, user_id: int, filename: str, data: bytes) -> int:
+        """Guarda el contenido en el almacén de blobs y encola su ingesta"""
+        # En una transacción: un `release` del mismo contenido no puede borrar el blob antes de encolarlo
+        with self.db.transaction():
+            blob = self.blobs.put(data)
+            job_id = self.db.enqueue_ingestion_job(user_id, filename, blob['hash'], len(data),
+                                                   self.max_attempts)
+        self._wake.set()
+        return job_id
+
+    # === PROCESAMIENTO ===
+    def ingest_blob(self, user_id: int, filename: str, file_size: int, blob: Dict,
+                    progress: Optional[ProgressCallback] = None, job_id: Optional[int] = None,
+                    file_id: Optional[str] = None) -> str:
+        """Extrae, guarda, indexa y (si es imagen) analiza un blob; devuelve el id del archivo.
+
+        Con `job_id` el id del archivo se guarda en el trabajo en la misma transacción
+        que el registro; el reintento lo recibe como `file_id` y solo repite lo que
+        faltaba (el análisis de imagen), sin crear otro registro. Sin `job_id`, si el
+        análisis falla se borra el registro recién creado antes de propagar el error.
+        """
+        progress = progress or (lambda fraction, message: None)
+        file_type = FileProcessor.get_file_type(filename)
+        
+        stored = not file_id or self.db.get_file_by_id(file_id) is None
+        if stored:
+            file_id = self._store(user_id, filename, file_type, file_size, blob, progress, job_id)
+        
+        if file_type == 'image' and self.analyze_image is not None:
+            progress(0.8, "Analizando imagen")
+            with open(blob['path'], "rb") as f:
+                image_base64 = b64encode(f.read()).decode('utf-8')
+            try:
+                analysis = self.analyze_image(image_base64, filename)
+            except Exception:
+                if job_id is None and stored:
+                    # Sin trabajo no hay reintento que complete el análisis: se deshace el registro
+                    file_data = self.db.get_file_by_id(file_id)
+                    if file_data:
+                        self.blobs.delete_file(file_data, user_id)
+                raise
+            with self.db.transaction():
+                self.db.save_image_analysis(
+                    user_id=user_id,
+                    image_path=blob['path'],
+                    analysis_result=analysis,
+                    model_used=self.vision_model,
+                    archivo_id=file_id
+                )
+                self.db.save_user_context(user_id, f"Análisis de imagen: {filename}", analysis, file_id)
+
+        return file_id
+
+    def _store(self, user_id: int, filename: str, file_type: str, file_size: int, blob: Dict,
+               progress: ProgressCallback, job_id: Optional[int]) -> str:
+        """Extracción, vectores y registro del archivo; devuelve su id"""
+        # Extracción, salvo que este contenido ya se haya procesado antes
+        pages = None
+        if blob['extracted_at']:
+            content = blob['content_extracted']
+            summary = blob['analysis_summary']
+        else:
+            progress(0.1, "Extrayendo contenido")
+            result = self._extract(blob['path'], filename)
+            if result['error']:
+                # Un tipo no soportado no cambia al reintentarlo; un fallo de extracción
+                # (archivo bloqueado, falta de memoria) se reintenta y nunca se cachea
+                if result['file_type'] == 'unknown':
+                    raise IngestionError(result['error'])
+                raise RuntimeError(result['error'])
+            content = result['content']
+            pages = result['pages']
+            summary = result['summary']
+            self.blobs.save_extraction(blob['hash'], result['file_type'], content, summary)
+        
+        # Los vectores se calculan antes de la transacción para no bloquear a otros escritores
+        progress(0.5, "Vectorizando")
+        indexed_file_id = self.db.find_indexed_file_by_hash(blob['hash']) if content else None
+        chunks = self.retriever.prepare_chunks(pages or [(None, content)]) if content and not indexed_file_id else []
+        
+        # Registro, contexto y fragmentos en una sola transacción
+        progress(0.6, "Indexando")
+        with self.db.transaction():
+            file_id = self.db.save_file(
+                user_id=user_id,
+                filename=filename,
+                file_path=blob['path'],
+                file_type=file_type,
+                file_size=file_size,
+                content_extracted=content,
+                analysis_summary=summary,
+                content_hash=blob['hash']
+            )
+            if content:
+                self.db.save_user_context(user_id, f"Archivo: {filename}", content, file_id)
+                if indexed_file_id:
+                    self.db.copy_file_chunks(indexed_file_id, user_id, file_id)
+                elif chunks:
+                    self.db.save_file_chunks(user_id, file_id, chunks)
+            if job_id is not None:
+                self.db.set_ingestion_job_file(job_id, file_id)
+        return file_id
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Pool de procesos de extracción, creado con el primer uso"""
+        with self._executor_lock:
+            if self._executor is None:
+                # spawn: el servidor de Streamlit tiene hilos y fork podría heredar locks tomados
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def _extract(self, path: str, filename: str) -> Dict[str, Any]:
+        executor = self._get_executor()
+        if FileProcessor.get_file_type(filename) == 'pdf':
+            # Los rangos de páginas van al mismo pool: un PDF grande usa todos los procesos libres
+            return process_stored_file(path, filename, executor=executor)
+        return executor.submit(process_stored_file, path, filename).result()
+
+    def _process(self, job: Dict):
+        def progress(fraction: float, message: str):
+            self.db.update_ingestion_progress(job['id'], fraction, message)
+
+        try:
+            blob = self.db.get_blob(job['content_hash'])
+            if blob is None:
+                raise IngestionError("El contenido del archivo ya no está disponible")
+            file_id = self.ingest_blob(job['user_id'], job['filename'], job['file_size'], blob, progress,
+                                       job_id=job['id'], file_id=job['file_id'])
+        except Exception as e:
+            # Un archivo que no se puede procesar no mejora al reintentarlo
+            status = self.db.fail_ingestion_job(job['id'], str(e), self.retry_delay * job['attempts'],
+                                                retry=not isinstance(e, IngestionError))
+            if status == JOB_FAILED:
+                # Nadie más va a usar el blob de un trabajo descartado
+                self.blobs.release(job['content_hash'])
+            return
+        self.db.complete_ingestion_job(job['id'], file_id)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                job = self.db.claim_ingestion_job()
+            except Exception as e:
+                print(f"Error leyendo la cola de ingesta: {e}")
+                job = None
+            if job is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+            try:
+                self._process(job)
+            except Exception as e:
+                print(f"Error procesando el trabajo de ingesta {job['id']}: {e}")
+
+    # === CICLO DE VIDA ===
+    def start(self):
+        """Arranca los hilos que consumen la cola (idempotente)"""
+        if self._threads:
+            return
+        self.db.requeue_running_ingestion_jobs()
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"zero-ingest-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+_queue: Optional[IngestionQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_ingestion_queue(analyze_image: Optional[ImageAnalyzer] = None,
+                        vision_model: Optional[str] = None) -> IngestionQueue:
+    """Cola compartida por todo el proceso; los hilos de trabajo arrancan en la primera llamada"""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = IngestionQueue(db, blob_store, retriever, analyze_image, vision_model)
+                _queue.start()
+    return _queue
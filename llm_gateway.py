@@ -0,0 +1,156 @@
+import asyncio
+import os
+import threading
+from typing import List, Dict, Optional, AsyncIterator, Awaitable, Any
+
+import httpx
+
+from groq_client import GROQ_API_URL, GROQ_CONNECT_TIMEOUT, GROQ_READ_TIMEOUT, GroqError
+from sse import SSEParser, StreamDelta, decode_deltas
+
+# Peticiones simultáneas máximas hacia Groq desde este proceso
+GATEWAY_MAX_CONCURRENCY = int(os.getenv("GROQ_MAX_CONCURRENCY", "8"))
+
+try:
+    import h2  # noqa: F401  (httpx solo negocia HTTP/2 si está instalado)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class LLMGateway:
+    """Gateway asíncrono hacia Groq (httpx.AsyncClient, HTTP/2 cuando está disponible).
+
+    Permite lanzar varias llamadas al modelo a la vez (títulos, resúmenes,
+    análisis de varias imágenes) en lugar de encadenarlas. Desde el hilo de
+    Streamlit se usa a través de `run_sync` / `gather_sync`, que ejecutan las
+    corrutinas en un event loop propio de larga vida para que el pool de
+    conexiones se reutilice entre reruns.
+    """
+
+    def __init__(self, api_key: Optional[str] = None, api_url: str = GROQ_API_URL,
+                 max_concurrency: int = GATEWAY_MAX_CONCURRENCY,
+                 connect_timeout: float = GROQ_CONNECT_TIMEOUT, read_timeout: float = GROQ_READ_TIMEOUT):
+        self.api_url = api_url
+        self.api_key = api_key if api_key is not None else os.getenv("GROQ_API_KEY", "")
+        self.max_concurrency = max_concurrency
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_lock = threading.Lock()
+
+    # === CLIENTE ASÍNCRONO ===
+    def _get_client(self) -> httpx.AsyncClient:
+        # Se crea dentro del loop que lo va a usar
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_concurrency,
+                                    max_keepalive_connections=self.max_concurrency),
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json",
+                },
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    async def chat(self, messages: List[Dict], *, model: str, max_tokens: int = 1200,
+                   temperature: float = 0.7) -> str:
+        """Completion sin streaming"""
+        client = self._get_client()
+        payload = {
+            "model": model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+        }
+        async with self._semaphore:
+            r = await client.post(self.api_url, json=payload)
+        if r.status_code != 200:
+            raise GroqError(r.status_code, r.text)
+        return r.json()["choices"][0]["message"]["content"]
+
+    async def chat_stream(self, messages: List[Dict], *, model: str, max_tokens: int = 1200,
+                          temperature: float = 0.7) -> AsyncIterator[StreamDelta]:
+        """Completion en streaming; genera deltas tipados a medida que llegan"""
+        client = self._get_client()
+        payload = {
+            "model": model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "stream": True,
+        }
+        async with self._semaphore:
+            async with client.stream("POST", self.api_url, json=payload,
+                                     headers={"Accept": "text/event-stream"}) as r:
+                if r.status_code != 200:
+                    body = await r.aread()
+                    raise GroqError(r.status_code, body.decode("utf-8", "replace"))
+                parser = SSEParser()
+                async for chunk in r.aiter_bytes():
+                    for delta in decode_deltas(parser.feed(chunk)):
+                        yield delta
+                        if delta.kind == "done":
+                            return
+
+    async def vision(self, prompt: str, image_base64: str, *, model: str, mime_type: str = "image/jpeg",
+                     max_tokens: int = 1000, temperature: float = 0.3) -> str:
+        """Analiza una imagen (base64) con un modelo de visión"""
+        messages = [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": prompt},
+                    {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{image_base64}"}},
+                ],
+            }
+        ]
+        return await self.chat(messages, model=model, max_tokens=max_tokens, temperature=temperature)
+
+    # === PUENTE PARA STREAMLIT (CÓDIGO SÍNCRONO) ===
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._loop_lock:
+            if self._loop is None or self._loop.is_closed():
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="zero-llm-gateway", daemon=True)
+                thread.start()
+                self._loop = loop
+        return self._loop
+
+    def run_sync(self, coro: Awaitable, timeout: Optional[float] = None) -> Any:
+        """Ejecuta una corrutina del gateway desde código síncrono y espera su resultado"""
+        future = asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+        return future.result(timeout)
+
+    def gather_sync(self, *coros: Awaitable, timeout: Optional[float] = None) -> List[Any]:
+        """Ejecuta varias corrutinas en paralelo; los errores se devuelven en su posición"""
+        async def _gather():
+            return await asyncio.gather(*coros, return_exceptions=True)
+        return self.run_sync(_gather(), timeout)
+
+    def close(self):
+        if self._loop is None:
+            return
+        if self._client is not None:
+            self.run_sync(self._client.aclose())
+            self._client = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop = None
+
+
+_gateway: Optional[LLMGateway] = None
+_gateway_lock = threading.Lock()
+
+
+def get_llm_gateway() -> LLMGateway:
+    """Gateway compartido por todo el proceso"""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = LLMGateway()
+    return _gateway
@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Any
+
+from database import db, ZeroDatabase
+
+# Segundos que una respuesta cacheada sigue siendo válida
+RESPONSE_CACHE_TTL = float(os.getenv("ZERO_RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))
+# Entradas máximas; por encima se expulsan las menos usadas recientemente (LRU)
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("ZERO_RESPONSE_CACHE_MAX_ENTRIES", "2000"))
+# Cada cuántas escrituras se ejecuta la expulsión
+RESPONSE_CACHE_EVICT_EVERY = 50
+# Aciertos acumulados en memoria antes de anotar su último acceso en la base de datos
+RESPONSE_CACHE_TOUCH_EVERY = 32
+# Tamaño de los fragmentos al reproducir una respuesta cacheada como streaming
+REPLAY_CHUNK_CHARS = 24
+
+
+def normalize_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Deja solo los campos que determinan la respuesta, con el texto sin espacios sobrantes"""
+    def _content(content):
+        if isinstance(content, str):
+            return content.strip()
+        return content
+
+    return {
+        "model": payload.get("model"),
+        "messages": [
+            {"role": msg.get("role"), "content": _content(msg.get("content"))}
+            for msg in payload.get("messages", [])
+        ],
+        "max_tokens": payload.get("max_tokens"),
+        "temperature": payload.get("temperature"),
+    }
+
+
+def cache_key(payload: Dict[str, Any]) -> str:
+    """SHA-256 del payload normalizado (JSON canónico)"""
+    canonical = json.dumps(normalize_payload(payload), sort_keys=True, separators=(",", ":"),
+                           ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def replay(text: str, chunk_chars: int = REPLAY_CHUNK_CHARS) -> Iterator[str]:
+    """Reproduce una respuesta completa como una secuencia de deltas, sin esperas"""
+    for start in range(0, len(text), chunk_chars):
+        yield text[start:start + chunk_chars]
+
+
+class ResponseCache:
+    """Caché de respuestas del modelo direccionada por contenido, guardada en SQLite.
+
+    La clave es el hash del payload normalizado (modelo, mensajes, max_tokens,
+    temperatura), así que dos peticiones idénticas comparten respuesta sin
+    importar quién las haga. Las entradas caducan a los `ttl` segundos y, por
+    encima de `max_entries`, se expulsan las de acceso más antiguo.
+
+    Leer la caché no toma el bloqueo de escritura de SQLite: los aciertos se
+    acumulan en memoria y su último acceso se anota en bloque cada
+    `touch_every` aciertos (y antes de cada expulsión). Si esa escritura falla
+    solo se pierde precisión en el orden LRU.
+    """
+
+    def __init__(self, database: ZeroDatabase, ttl: float = RESPONSE_CACHE_TTL,
+                 max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+                 evict_every: int = RESPONSE_CACHE_EVICT_EVERY,
+                 touch_every: int = RESPONSE_CACHE_TOUCH_EVERY):
+        self.db = database
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.evict_every = evict_every
+        self.touch_every = max(1, touch_every)
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        # clave -> aciertos aún no anotados en la base de datos
+        self._touched: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, payload: Dict[str, Any]) -> Optional[str]:
+        """Respuesta cacheada para el payload, o None"""
+        key = cache_key(payload)
+        try:
+            response = self.db.get_cached_response(key, time.time() - self.ttl)
+        except Exception as e:
+            print(f"Error leyendo caché de respuestas: {e}")
+            response = None
+        with self._lock:
+            if response is None:
+                self.misses += 1
+                flush = False
+            else:
+                self.hits += 1
+                self._touched[key] = self._touched.get(key, 0) + 1
+                flush = len(self._touched) >= self.touch_every
+        if flush:
+            self.flush_touches()
+        return response
+
+    def flush_touches(self):
+        """Anota en la base de datos el último acceso de los aciertos pendientes (best-effort)"""
+        with self._lock:
+            touched, self._touched = self._touched, {}
+        try:
+            self.db.touch_cached_responses(touched, time.time())
+        except Exception as e:
+            print(f"Error anotando accesos de la caché de respuestas: {e}")
+
+    def put(self, payload: Dict[str, Any], response: str):
+        """Guarda la respuesta del payload (las respuestas vacías no se cachean)"""
+        if not response:
+            return
+        try:
+            self.db.save_cached_response(cache_key(payload), payload.get("model"), response)
+            with self._lock:
+                self._writes += 1
+                evict = self._writes % self.evict_every == 0
+            if evict:
+                self.evict()
+        except Exception as e:
+            print(f"Error guardando en caché de respuestas: {e}")
+
+    def evict(self) -> int:
+        """Aplica TTL y límite de tamaño"""
+        self.flush_touches()
+        return self.db.evict_cached_responses(self.max_entries, time.time() - self.ttl)
+
+    def stream(self, payload: Dict[str, Any], deltas: Iterator[str]) -> Iterator[str]:
+        """Reproduce la respuesta cacheada o pasa los deltas y guarda la respuesta completa.
+
+        Solo se guarda si el stream termina sin excepciones.
+        """
+        cached = self.get(payload)
+        if cached is not None:
+            yield from replay(cached)
+            return
+        parts: List[str] = []
+        for delta in deltas:
+            parts.append(delta)
+            yield delta
+        self.put(payload, "".join(parts))
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+# Caché compartida por todo el proceso
+response_cache = ResponseCache(db)
@@ -0,0 +1,179 @@
+import re
+import unicodedata
+import zlib
+from typing import List, Dict, Optional, Iterable, Tuple
+
+import numpy as np
+
+from database import db, ZeroDatabase
+
+# Dimensión de los vectores (hashing trick). 512 float32 = 2 KB por fragmento.
+EMBEDDING_DIM = 512
+# Tamaño y solapamiento de las ventanas de texto, en caracteres
+CHUNK_SIZE = 800
+CHUNK_OVERLAP = 200
+# Similitud coseno mínima para considerar relevante un fragmento
+MIN_SCORE = 0.08
+
+# Palabras vacías frecuentes que solo añaden ruido a los vectores
+STOPWORDS = {
+    "de", "la", "que", "el", "en", "y", "a", "los", "se", "del", "las", "un", "por",
+    "con", "no", "una", "su", "para", "es", "al", "lo", "como", "mas", "o", "pero",
+    "sus", "le", "ha", "me", "si", "sin", "sobre", "este", "ya", "entre", "cuando",
+    "todo", "esta", "ser", "son", "dos", "tambien", "fue", "habia", "era", "muy",
+    "the", "of", "and", "to", "in", "is", "for", "on", "that", "with", "as", "it",
+}
+
+
+def normalize_text(text: str) -> str:
+    """Minúsculas y sin tildes, igual que el tokenizador de FTS5"""
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text: str) -> List[str]:
+    """Divide un texto en términos normalizados"""
+    return [w for w in re.findall(r"\w+", normalize_text(text)) if len(w) > 1 and w not in STOPWORDS]
+
+
+def chunk_text(text: str, size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    """Parte un texto en ventanas solapadas, cortando en espacios cuando es posible"""
+    text = re.sub(r"\s+", " ", text or "").strip()
+    if not text:
+        return []
+    if len(text) <= size:
+        return [text]
+
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + size, len(text))
+        if end < len(text):
+            # Retroceder hasta el último espacio para no cortar palabras
+            space = text.rfind(" ", start + size // 2, end)
+            if space != -1:
+                end = space
+        chunks.append(text[start:end].strip())
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+
+def embed_texts(texts: List[str], dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """Vectoriza textos con TF sublineal + hashing con signo, normalizados (L2).
+
+    Es determinista (crc32, no hash() de Python) para que los vectores
+    guardados sigan siendo comparables entre procesos.
+    """
+    return embed_terms([tokenize(text) for text in texts], dim)
+
+
+def embed_terms(term_lists: List[List[str]], dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """Vectoriza listas de términos ya extraídos (mismo esquema que embed_texts)"""
+    matrix = np.zeros((len(term_lists), dim), dtype=np.float32)
+    for row, terms in enumerate(term_lists):
+        counts: Dict[int, float] = {}
+        for token in terms:
+            h = zlib.crc32(token.encode("utf-8"))
+            index = h % dim
+            sign = 1.0 if (h >> 31) & 1 else -1.0
+            counts[index] = counts.get(index, 0.0) + sign
+        if not counts:
+            continue
+        indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        values = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        matrix[row, indices] = np.sign(values) * (1.0 + np.log(np.abs(values) + 1e-9))
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+def top_k(query_vector: np.ndarray, matrix: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Índices y similitudes coseno de los k vectores más cercanos (ordenados)"""
+    if matrix.shape[0] == 0 or k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    scores = matrix @ query_vector
+    k = min(k, scores.shape[0])
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    order = candidates[np.argsort(-scores[candidates])]
+    return order, scores[order]
+
+
+class ChunkRetriever:
+    """Índice vectorial en memoria sobre los fragmentos guardados en la base de datos"""
+
+    def __init__(self, database: ZeroDatabase):
+        self.db = database
+        # user_id -> (firma, ids, matriz)
+        self._cache: Dict[int, Tuple[tuple, np.ndarray, np.ndarray]] = {}
+
+    @staticmethod
+    def prepare_chunks(pages: Iterable[Tuple[Optional[int], str]]) -> List[Dict]:
+        """Fragmenta y vectoriza un documento sin tocar la base de datos.
+
+        Permite calcular los vectores (lo costoso) antes de abrir una transacción
+        de escritura y guardarlos después con `db.save_file_chunks`.
+        """
+        chunks = []
+        for page, text in pages:
+            for chunk in chunk_text(text):
+                chunks.append((page, chunk))
+        if not chunks:
+            return []
+
+        vectors = embed_texts([chunk for _, chunk in chunks])
+        return [
+            {'page': page, 'content': chunk, 'embedding': vectors[i].tobytes()}
+            for i, (page, chunk) in enumerate(chunks)
+        ]
+
+    def index_document(self, user_id: int, file_id: str,
+                       pages: Iterable[Tuple[Optional[int], str]]) -> int:
+        """Fragmenta y vectoriza un documento; `pages` son pares (número de página, texto)"""
+        chunks = self.prepare_chunks(pages)
+        if not chunks:
+            return 0
+        return self.db.save_file_chunks(user_id, file_id, chunks)
+
+    def _load_matrix(self, user_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Matriz de vectores del usuario, recargada solo si cambiaron sus fragmentos"""
+        signature = self.db.get_chunk_signature(user_id)
+        cached = self._cache.get(user_id)
+        if cached and cached[0] == signature:
+            return cached[1], cached[2]
+
+        ids, blobs = self.db.get_user_chunk_vectors(user_id)
+        ids_array = np.asarray(ids, dtype=np.int64)
+        if blobs:
+            matrix = np.frombuffer(b"".join(blobs), dtype=np.float32).reshape(len(blobs), -1)
+        else:
+            matrix = np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+        self._cache[user_id] = (signature, ids_array, matrix)
+        return ids_array, matrix
+
+    def search(self, user_id: int, query: str, k: int = 3, min_score: float = MIN_SCORE) -> List[Dict]:
+        """Devuelve los k fragmentos del usuario más similares a la consulta"""
+        ids, matrix = self._load_matrix(user_id)
+        if matrix.shape[0] == 0:
+            return []
+
+        query_vector = embed_texts([query], dim=matrix.shape[1])[0]
+        order, scores = top_k(query_vector, matrix, k)
+        selected = [(int(ids[i]), float(score)) for i, score in zip(order, scores) if score >= min_score]
+        if not selected:
+            return []
+
+        chunks = {chunk['id']: chunk for chunk in self.db.get_chunks_by_ids([cid for cid, _ in selected])}
+        results = []
+        for chunk_id, score in selected:
+            chunk = chunks.get(chunk_id)
+            if chunk:
+                chunk['score'] = score
+                results.append(chunk)
+        return results
+
+
+# Instancia global del recuperador (mantiene la caché entre reruns de Streamlit)
+retriever = ChunkRetriever(db)
@@ -0,0 +1,139 @@
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from retrieval import embed_terms, normalize_text, EMBEDDING_DIM, STOPWORDS
+
+# Similitud coseno mínima (unigramas + bigramas) entre preguntas con las mismas palabras clave
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("ZERO_SEMANTIC_CACHE_THRESHOLD", "0.6"))
+# Preguntas guardadas como máximo; al llenarse se reemplaza la usada hace más tiempo
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("ZERO_SEMANTIC_CACHE_MAX_ENTRIES", "1000"))
+
+# Palabras vacías que invierten el sentido de la pregunta y por eso cuentan como clave
+NEGATIONS = {
+    "no", "sin", "ni", "nunca", "jamas", "tampoco", "nada", "nadie", "ningun", "ninguno",
+    "ninguna", "not", "without", "never",
+}
+
+
+def question_tokens(question: str) -> Tuple[str, ...]:
+    """Palabras normalizadas de la pregunta, en orden y sin quitar palabras vacías"""
+    return tuple(re.findall(r"\w+", normalize_text(question)))
+
+
+def question_terms(tokens: Tuple[str, ...]) -> List[str]:
+    """Palabras más bigramas: "no", "sin" o el orden de las palabras cambian el vector"""
+    return list(tokens) + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+
+def question_key(tokens: Tuple[str, ...]) -> Tuple[str, ...]:
+    """Palabras con contenido, negaciones y números de la pregunta, en orden"""
+    return tuple(
+        w for w in tokens
+        if w in NEGATIONS or any(c.isdigit() for c in w) or (len(w) > 1 and w not in STOPWORDS)
+    )
+
+
+class SemanticCache:
+    """Caché de respuestas para preguntas casi idénticas (FAQ), en memoria con NumPy.
+
+    Dos preguntas solo pueden compartir respuesta si tienen la misma clave: las
+    mismas palabras con contenido, negaciones y números, en el mismo orden
+    ("con gluten" / "sin gluten" o "2 + 2" / "2 + 3" nunca coinciden). Entre las
+    preguntas guardadas con esa clave se elige la más parecida por similitud
+    coseno de unigramas y bigramas, que debe llegar a `threshold`; así se
+    toleran mayúsculas, tildes, signos y algunas palabras vacías ("¿qué es la
+    fotosíntesis?" / "que es fotosintesis"). Los vectores viven en una matriz
+    preasignada de tamaño fijo. Solo debe usarse con preguntas de un único turno
+    y sin contexto de archivos, cuya respuesta no depende del usuario.
+    """
+
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES, dim: int = EMBEDDING_DIM):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        self._last_used = np.zeros(max_entries, dtype=np.int64)
+        self._keys: List[Optional[Tuple[str, Tuple[str, ...]]]] = [None] * max_entries
+        self._questions: List[Optional[str]] = [None] * max_entries
+        self._answers: List[Optional[str]] = [None] * max_entries
+        # (modelo, clave) -> filas con esa clave
+        self._rows_by_key: Dict[Tuple[str, Tuple[str, ...]], List[int]] = {}
+        self._size = 0
+        self._clock = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _find(self, vector: np.ndarray, key: Tuple[str, Tuple[str, ...]]) -> int:
+        """Fila que vale como la misma pregunta, o -1"""
+        rows = self._rows_by_key.get(key)
+        if not rows:
+            return -1
+        scores = self._vectors[rows] @ vector
+        best = int(np.argmax(scores))
+        return rows[best] if scores[best] >= self.threshold else -1
+
+    def _embed(self, tokens: Tuple[str, ...]) -> np.ndarray:
+        return embed_terms([question_terms(tokens)], dim=self._vectors.shape[1])[0]
+
+    def lookup(self, question: str, model: str) -> Optional[str]:
+        """Respuesta de una pregunta suficientemente parecida, o None"""
+        tokens = question_tokens(question)
+        vector = self._embed(tokens)
+        key = (model, question_key(tokens))
+        with self._lock:
+            if vector.any():
+                row = self._find(vector, key)
+                if row >= 0:
+                    self._clock += 1
+                    self._last_used[row] = self._clock
+                    self.hits += 1
+                    return self._answers[row]
+            self.misses += 1
+            return None
+
+    def store(self, question: str, model: str, answer: str):
+        """Guarda la respuesta de una pregunta (reemplaza la de una casi idéntica si existe)"""
+        if not answer:
+            return
+        tokens = question_tokens(question)
+        vector = self._embed(tokens)
+        if not vector.any():
+            return
+        key = (model, question_key(tokens))
+        with self._lock:
+            row = self._find(vector, key)
+            if row < 0:
+                if self._size < self.max_entries:
+                    row = self._size
+                    self._size += 1
+                else:
+                    row = int(np.argmin(self._last_used[:self._size]))
+                    old_rows = self._rows_by_key[self._keys[row]]
+                    old_rows.remove(row)
+                    if not old_rows:
+                        del self._rows_by_key[self._keys[row]]
+                self._rows_by_key.setdefault(key, []).append(row)
+                self._keys[row] = key
+            self._clock += 1
+            self._vectors[row] = vector
+            self._last_used[row] = self._clock
+            self._questions[row] = question
+            self._answers[row] = answer
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "entries": self._size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+# Caché compartida por todo el proceso (sobrevive a los reruns de Streamlit)
+semantic_cache = SemanticCache()
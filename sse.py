@@ -0,0 +1,114 @@
+import json
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Dict, Any
+
+DONE_PAYLOAD = b"[DONE]"
+
+_json_decoder = json.JSONDecoder()
+
+
+class StreamDelta(NamedTuple):
+    """Evento tipado de una respuesta en streaming"""
+    kind: str                          # "content" | "usage" | "error" | "done"
+    text: str = ""
+    data: Optional[Dict[str, Any]] = None
+
+
+class SSEParser:
+    """Parser incremental de Server-Sent Events que trabaja sobre bytes crudos.
+
+    Recibe los fragmentos tal como llegan del socket (sin partir ni decodificar
+    por líneas) y devuelve el campo `data` de cada evento completo. Los eventos
+    con varias líneas `data:` se unen con saltos de línea, como indica la
+    especificación.
+    """
+
+    def __init__(self):
+        # Bytes del evento que aún no terminó de llegar
+        self._tail = b""
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        """Añade bytes y devuelve los payloads de los eventos completos"""
+        if not chunk:
+            return []
+        data = self._tail + chunk if self._tail else chunk
+        if b"\r" in data:
+            # El fin de evento puede llegar como CRLF, incluso partido entre fragmentos
+            data = data.replace(b"\r\n", b"\n")
+
+        blocks = data.split(b"\n\n")
+        self._tail = blocks.pop()
+        if not blocks:
+            return []
+
+        events = []
+        for block in blocks:
+            # Caso común: una sola línea "data: {...}"
+            if block.startswith(b"data: ") and b"\n" not in block:
+                events.append(block[6:])
+            elif block:
+                payload = self._parse_block(block)
+                if payload is not None:
+                    events.append(payload)
+        return events
+
+    @staticmethod
+    def _parse_block(block: bytes) -> Optional[bytes]:
+        data_lines = []
+        for line in block.split(b"\n"):
+            if line.startswith(b"data:"):
+                value = line[5:]
+                data_lines.append(value[1:] if value.startswith(b" ") else value)
+            # Comentarios (":") y campos event/id/retry no aportan datos
+        if not data_lines:
+            return None
+        return b"\n".join(data_lines)
+
+
+def iter_events(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Payloads de todos los eventos de un flujo de fragmentos de bytes"""
+    parser = SSEParser()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+
+
+def iter_deltas(chunks: Iterable[bytes]) -> Iterator[StreamDelta]:
+    """Convierte un flujo SSE de chat completions (formato OpenAI/Groq) en deltas tipados"""
+    return decode_deltas(iter_events(chunks))
+
+
+def decode_deltas(payloads: Iterable[bytes]) -> Iterator[StreamDelta]:
+    """Deltas tipados a partir de payloads `data` ya separados por SSEParser"""
+    decode = _json_decoder.decode
+    for payload in payloads:
+        if payload[:1] == b"[" and payload.strip() == DONE_PAYLOAD:
+            yield StreamDelta("done")
+            return
+        try:
+            # Un solo decode UTF-8 en C por evento; json.loads(bytes) adivinaría la codificación
+            obj = decode(payload.decode("utf-8"))
+        except ValueError:
+            continue
+
+        try:
+            content = obj["choices"][0]["delta"]["content"]
+        except (KeyError, IndexError, TypeError):
+            content = None
+        if content:
+            yield StreamDelta("content", content)
+            # Los deltas de contenido no traen uso ni errores
+            if "x_groq" not in obj and "usage" not in obj:
+                continue
+
+        if not isinstance(obj, dict):
+            continue
+
+        error = obj.get("error")
+        if error:
+            message = error.get("message", "") if isinstance(error, dict) else str(error)
+            yield StreamDelta("error", message, obj)
+            continue
+
+        # Groq envía el uso en x_groq.usage; OpenAI en usage
+        usage = obj.get("usage") or (obj.get("x_groq") or {}).get("usage")
+        if usage:
+            yield StreamDelta("usage", "", usage)
@@ -0,0 +1,69 @@
+import time
+from typing import Callable, List
+
+# Presupuesto de refresco: se redibuja como mucho cada RENDER_INTERVAL segundos
+# o cuando se acumulan RENDER_MIN_CHARS caracteres nuevos
+RENDER_INTERVAL = 0.05
+RENDER_MIN_CHARS = 200
+
+
+class ThrottledRenderer:
+    """Agrupa los deltas de una respuesta en streaming y limita los redibujados.
+
+    Cada llamada a `render(texto, final)` reenvía la respuesta completa al
+    navegador, así que hacerlo por cada token cuesta bytes cuadráticos. Aquí los
+    deltas se acumulan y solo se vuelca cuando se agota el presupuesto de tiempo
+    o de caracteres. Al salir del bloque `with` siempre se hace el volcado final.
+
+        with ThrottledRenderer(lambda text, final: placeholder.markdown(text)) as renderer:
+            for delta in stream:
+                renderer.push(delta)
+        full_response = renderer.text
+    """
+
+    def __init__(self, render: Callable[[str, bool], None], interval: float = RENDER_INTERVAL,
+                 min_chars: int = RENDER_MIN_CHARS, clock: Callable[[], float] = time.monotonic):
+        self.render = render
+        self.interval = interval
+        self.min_chars = min_chars
+        self.clock = clock
+        self.flushes = 0
+        self._parts: List[str] = []
+        self._text = ""
+        self._pending_chars = 0
+        self._last_flush = clock()
+        self._finished = False
+
+    @property
+    def text(self) -> str:
+        """Texto acumulado hasta ahora"""
+        if self._parts:
+            self._text += "".join(self._parts)
+            self._parts.clear()
+        return self._text
+
+    def push(self, delta: str):
+        """Añade un delta y redibuja si se agotó el presupuesto"""
+        if not delta:
+            return
+        self._parts.append(delta)
+        self._pending_chars += len(delta)
+        if self._pending_chars >= self.min_chars or self.clock() - self._last_flush >= self.interval:
+            self.flush()
+
+    def flush(self, final: bool = False):
+        """Redibuja con todo el texto acumulado"""
+        if self._finished:
+            return
+        self.render(self.text, final)
+        self.flushes += 1
+        self._pending_chars = 0
+        self._last_flush = self.clock()
+        self._finished = final
+
+    def __enter__(self) -> "ThrottledRenderer":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush(final=True)
+        return False
@@ -0,0 +1,123 @@
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+from database import db, ZeroDatabase, hash_password, LEGACY_USERS_FILE
+
+# Usuarios (por nombre) que cada proceso mantiene en memoria
+USER_CACHE_SIZE = int(os.getenv("ZERO_USER_CACHE_SIZE", "256"))
+# Segundos que un usuario (por nombre o por UID NFC) se sirve desde memoria sin volver a consultarlo
+USER_CACHE_TTL = float(os.getenv("ZERO_USER_CACHE_TTL", "5"))
+
+
+class UserStore:
+    """Acceso a los usuarios de zero.db con cachés en memoria.
+
+    La tabla `usuarios` es la única fuente de usuarios: los registros de
+    usuarios.json se importan con la migración 13 o con `import_json`. Las filas
+    consultadas por nombre se guardan en una caché LRU de `cache_size` entradas,
+    de modo que iniciar sesión o renderizar una página no vuelve a consultar la
+    base de datos mientras la entrada tenga menos de `ttl` segundos.
+
+    Los accesos con tarjeta usan otra caché LRU igual, por UID NFC: cada UID se
+    consulta con el índice único de `usuarios.nfc_uid` la primera vez y cuando
+    su entrada cumple `ttl` segundos, sin recorrer nunca todos los usuarios.
+    Crear o importar usuarios en este proceso invalida las cachés al momento;
+    un cambio hecho desde otro proceso (otro worker, la importación por CLI) se
+    ve como mucho `ttl` segundos después.
+    """
+
+    def __init__(self, database: ZeroDatabase, cache_size: int = USER_CACHE_SIZE,
+                 ttl: float = USER_CACHE_TTL):
+        self.db = database
+        self.cache_size = max(1, cache_size)
+        self.ttl = ttl
+        # nombre -> (fila, instante en que se leyó)
+        self._by_username: "OrderedDict[str, Tuple[Dict, float]]" = OrderedDict()
+        # UID NFC -> (fila, instante en que se leyó)
+        self._by_nfc: "OrderedDict[str, Tuple[Dict, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    # === CONSULTAS ===
+    def _cached(self, cache: "OrderedDict[str, Tuple[Dict, float]]", key: str,
+                load: Callable[[str], Optional[Dict]]) -> Optional[Dict]:
+        """Entrada de una caché LRU con TTL; si falta o caducó se consulta con `load`"""
+        with self._lock:
+            cached = cache.get(key)
+            if cached is not None and time.monotonic() - cached[1] < self.ttl:
+                cache.move_to_end(key)
+                return cached[0]
+
+        user = load(key)
+        with self._lock:
+            if user:
+                cache[key] = (user, time.monotonic())
+                cache.move_to_end(key)
+                while len(cache) > self.cache_size:
+                    cache.popitem(last=False)
+            else:
+                cache.pop(key, None)
+        return user
+
+    def get_by_username(self, username: str) -> Optional[Dict]:
+        """Fila del usuario, desde la caché LRU si ya se consultó"""
+        if not username:
+            return None
+        return self._cached(self._by_username, username, self.db.get_user_by_username)
+
+    def get_user_id(self, username: str) -> Optional[int]:
+        """ID del usuario por nombre"""
+        user = self.get_by_username(username)
+        return user['id'] if user else None
+
+    def authenticate(self, username: str, clave: str) -> Optional[Dict]:
+        """Usuario si la contraseña es correcta, o None"""
+        user = self.get_by_username(username)
+        if user and hmac.compare_digest(user['password_hash'], hash_password(clave)):
+            return user
+        return None
+
+    def get_by_nfc_uid(self, nfc_uid: str) -> Optional[Dict]:
+        """Usuario dueño de una tarjeta NFC, desde la caché LRU si ya se consultó"""
+        if not nfc_uid:
+            return None
+        return self._cached(self._by_nfc, nfc_uid, self.db.get_user_by_nfc_uid)
+
+    # === ESCRITURAS ===
+    def create(self, username: str, clave: str, rol: str, nfc_uid: Optional[str] = None) -> bool:
+        """Crea un usuario; False si el nombre o la tarjeta ya existen"""
+        created = self.db.create_user(username, hash_password(clave), rol, nfc_uid or None)
+        if created:
+            self.invalidate(username)
+        return created
+
+    def import_json(self, path: str = LEGACY_USERS_FILE) -> Dict[str, int]:
+        """Importa los usuarios de un archivo con el formato de usuarios.json"""
+        report = self.db.import_users_json(path)
+        self.invalidate()
+        return report
+
+    def invalidate(self, username: Optional[str] = None):
+        """Descarta un usuario (o todos) de la caché por nombre y la caché NFC"""
+        with self._lock:
+            if username is None:
+                self._by_username.clear()
+            else:
+                self._by_username.pop(username, None)
+            # Una tarjeta puede cambiar de dueño: la caché NFC se vacía entera
+            self._by_nfc.clear()
+
+
+# Instancia compartida por todo el proceso (sobrevive a los reruns de Streamlit)
+user_store = UserStore(db)
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else LEGACY_USERS_FILE
+    report = user_store.import_json(path)
+    print(f"{path}: {report['created']} creados, {report['updated']} actualizados, "
+          f"{report['unchanged']} sin cambios, {report['skipped']} omitidos")